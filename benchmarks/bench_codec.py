@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+# Message.encode and MessageHandler.decode packet rates across packet sizes,
+# and App_Parameters encoding and lookup
+
+import sys, threading, time
+from common import MiB, main, timed
+from nOBEX import headers, requests, transport
+
+PACKET_SIZES = [255, 1024, 4096, 16384, 65535]
+
+def _put_request(size):
+    # 3 bytes of request header and 3 bytes of body header
+    request = requests.Put()
+    request.add_header(headers.Body(b"\xa5" * (size - 6)))
+    return request
+
+def bench_encode(size, quick):
+    request = _put_request(size)
+    calls, elapsed = timed(request.encode, 0.05 if quick else 0.3)
+    return {
+        "name": "encode",
+        "packet_size": size,
+        "packets_per_s": calls / elapsed,
+        "mb_per_s": calls * size / elapsed / MiB
+    }
+
+def bench_decode(size, quick):
+    packet = _put_request(size).encode()
+    count = max(100, min(20000, (16 * MiB) // size))
+    if quick:
+        count //= 10
+
+    csock, ssock = transport.socketpair()
+    def writer():
+        for i in range(count):
+            csock.sendall(packet)
+    t = threading.Thread(target=writer, daemon=True)
+
+    handler = requests.RequestHandler()
+    start = time.perf_counter()
+    t.start()
+    for i in range(count):
+        handler.decode(ssock)
+    elapsed = time.perf_counter() - start
+    t.join()
+    csock.close()
+    ssock.close()
+
+    return {
+        "name": "decode",
+        "packet_size": size,
+        "packets_per_s": count / elapsed,
+        "mb_per_s": count * size / elapsed / MiB
+    }
+
+# a typical paged PBAP listing request
+LISTING_PARAMS = {"Order": 0, "MaxListCount": 50, "ListStartOffset": 100,
+        "Filter": 0x85}
+
+def bench_app_params(quick):
+    min_time = 0.05 if quick else 0.3
+    tags = headers.PBAP_APP_PARAMS
+    data = headers.encode_app_params(LISTING_PARAMS, tags)
+
+    def encode():
+        headers.encode_app_params(LISTING_PARAMS, tags)
+    def encode_memoized():
+        headers.App_Parameters(LISTING_PARAMS, tags=tags)
+    def lookup():
+        params = headers.AppParams(data, tags)
+        params.get("MaxListCount")
+        params.get("ListStartOffset")
+
+    results = []
+    for name, fn in (("app_params_encode", encode),
+            ("app_params_header_memoized", encode_memoized),
+            ("app_params_lookup", lookup)):
+        calls, elapsed = timed(fn, min_time)
+        results.append({
+            "name": name,
+            "params": len(LISTING_PARAMS),
+            "ops_per_s": calls / elapsed
+        })
+    return results
+
+def run(quick=False):
+    results = []
+    for size in PACKET_SIZES:
+        results.append(bench_encode(size, quick))
+        results.append(bench_decode(size, quick))
+    results.extend(bench_app_params(quick))
+    return results
+
+if __name__ == "__main__":
+    sys.exit(main("codec", run, sys.argv))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+# GET/PUT transfer times over an emulated RFCOMM link, by OBEX packet size
+
+import os, shutil, sys, tempfile, time
+from common import main
+from nOBEX import transport
+from clients.opp import OPPClient
+from clients.pbap import PBAPClient
+from servers.opp import OPPServer
+from servers.pbap import PBAPServer
+
+PACKET_LENGTHS = [1024, 4096, 16384, 65535]
+
+# roughly a Bluetooth EDR RFCOMM channel between a phone and a head unit
+LINK = {"bandwidth": 250000, "latency": 0.01, "mtu": 1013, "jitter": 0.002}
+
+def _transfer(client, server, op):
+    link = transport.LinkEmulator(**LINK)
+    t = transport.connect_local(client, server, pair=link.socketpair)
+    start = time.perf_counter()
+    op(client)
+    elapsed = time.perf_counter() - start
+    client.disconnect()
+    client.socket.close()
+    t.join()
+    return elapsed
+
+def bench_get(root, size, packet_length):
+    c = PBAPClient("local", 0)
+    c.max_packet_length = packet_length
+    elapsed = _transfer(c, PBAPServer(root), lambda c: c.get("telecom/obj.bin"))
+    return {
+        "name": "link_get",
+        "object_size": size,
+        "packet_length": packet_length,
+        "seconds": elapsed,
+        "kb_per_s": size / elapsed / 1024
+    }
+
+def bench_put(root, data, packet_length):
+    c = OPPClient("local", 0)
+    c.max_packet_length = packet_length
+    elapsed = _transfer(c, OPPServer(root), lambda c: c.put("obj.bin", data))
+    return {
+        "name": "link_put",
+        "object_size": len(data),
+        "packet_length": packet_length,
+        "seconds": elapsed,
+        "kb_per_s": len(data) / elapsed / 1024
+    }
+
+def run(quick=False):
+    size = (64 if quick else 256) * 1024
+    data = os.urandom(size)
+    root = tempfile.mkdtemp(prefix="nobex-bench-")
+    try:
+        os.makedirs(os.path.join(root, "telecom"))
+        with open(os.path.join(root, "telecom", "obj.bin"), "wb") as f:
+            f.write(data)
+
+        results = []
+        for packet_length in PACKET_LENGTHS:
+            results.append(bench_get(root, size, packet_length))
+            results.append(bench_put(root, data, packet_length))
+        return results
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    sys.exit(main("link", run, sys.argv))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+# gen_folder_listing cost as the directory grows, and paged PBAP vCard and
+# MAP message listings from the phonebook and message stores as they grow
+
+import itertools, os, shutil, sys, tempfile
+from common import main, timed
+from servers.ftp import gen_folder_listing
+from servers.phonebook import PhonebookStore, ORDER_ALPHANUMERIC
+from servers.messages import MessageStore, READ_STATUS_UNREAD
+
+DIRECTORY_SIZES = [10, 100, 1000, 10000]
+PHONEBOOK_SIZES = [100, 10000, 100000]
+INBOX_SIZES = [100, 10000, 100000]
+
+def bench_listing(size, quick):
+    path = tempfile.mkdtemp(prefix="nobex-bench-")
+    try:
+        for i in range(size):
+            if i % 10 == 0:
+                os.mkdir(os.path.join(path, "dir%05i" % i))
+            else:
+                open(os.path.join(path, "file%05i.vcf" % i), "wb").close()
+
+        calls, elapsed = timed(lambda: gen_folder_listing(path),
+                0.05 if quick else 0.3)
+    finally:
+        shutil.rmtree(path)
+
+    return {
+        "name": "gen_folder_listing",
+        "entries": size,
+        "listings_per_s": calls / elapsed,
+        "us_per_entry": elapsed / calls / size * 1e6
+    }
+
+def bench_phonebook_page(size, quick):
+    path = tempfile.mkdtemp(prefix="nobex-bench-")
+    try:
+        os.mkdir(os.path.join(path, "telecom"))
+        with open(os.path.join(path, "telecom", "pb.vcf"), "wb") as f:
+            for i in range(size):
+                f.write(b"BEGIN:VCARD\r\nVERSION:2.1\r\nFN:Contact %06i\r\n"
+                        b"TEL;CELL:555%07i\r\nEND:VCARD\r\n" % (size - i, i))
+        book = PhonebookStore(path).get("telecom/pb")
+    finally:
+        shutil.rmtree(path)
+
+    # a page of 50 from the middle of the alphabetically ordered book
+    params = {
+        "Order": ORDER_ALPHANUMERIC,
+        "ListStartOffset": min(size // 2, 0xFFFF),
+        "MaxListCount": 50
+    }
+    calls, elapsed = timed(lambda: book.listing(params),
+            0.05 if quick else 0.3)
+
+    return {
+        "name": "phonebook_page",
+        "entries": size,
+        "pages_per_s": calls / elapsed,
+        "us_per_page": elapsed / calls * 1e6
+    }
+
+def bench_message_page(size, quick):
+    path = tempfile.mkdtemp(prefix="nobex-bench-")
+    try:
+        os.makedirs(os.path.join(path, "telecom", "msg", "inbox"))
+        listing = os.path.join(path, "telecom", "msg", "inbox", "mlisting.xml")
+        with open(listing, "wb") as f:
+            f.write(b'<MAP-msg-listing version="1.0">\n')
+            for i in range(size):
+                f.write(b'    <msg handle="%016X" subject="Message %i" '
+                        b'datetime="2017%02i%02iT%02i%02i%02i" type="%s" '
+                        b'read="%s" priority="no"/>\n' % (i, i, i % 12 + 1,
+                            i % 28 + 1, i % 24, i % 60, i % 60,
+                            b"EMAIL" if i % 3 == 0 else b"SMS_GSM",
+                            b"yes" if i % 2 else b"no"))
+            f.write(b'</MAP-msg-listing>\n')
+        store = MessageStore(path)
+
+        # page through the unread SMS 20 at a time, as a head unit would,
+        # starting from the middle of the filtered listing
+        params = {
+            "MaxListCount": 20,
+            "FilterMessageType": 0x04,
+            "FilterReadStatus": READ_STATUS_UNREAD,
+            "SubjectLength": 10
+        }
+        start = min(size // 6, 0xFFFF)
+        offsets = itertools.cycle(range(start, min(size // 3, 0xFFFF), 20))
+        def page():
+            params["StartOffset"] = next(offsets)
+            store.listing("telecom/msg/inbox", params)
+        calls, elapsed = timed(page, 0.05 if quick else 0.3)
+    finally:
+        shutil.rmtree(path)
+
+    return {
+        "name": "message_page",
+        "entries": size,
+        "pages_per_s": calls / elapsed,
+        "us_per_page": elapsed / calls * 1e6
+    }
+
+def run(quick=False):
+    results = [bench_listing(size, quick) for size in DIRECTORY_SIZES]
+    results += [bench_phonebook_page(size, quick) for size in PHONEBOOK_SIZES]
+    results += [bench_message_page(size, quick) for size in INBOX_SIZES]
+    return results
+
+if __name__ == "__main__":
+    sys.exit(main("listing", run, sys.argv))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+# Operations per second for one small GET per request, connecting a new
+# session for each request versus reusing sessions from a SessionPool
+
+import os, shutil, sys, tempfile, time
+from common import main
+from nOBEX import transport
+from nOBEX.pool import SessionPool
+from clients.pbap import PBAPClient
+from servers.pbap import PBAPServer
+
+OBJECT_SIZE = 512
+
+# roughly a Bluetooth EDR RFCOMM channel between a phone and a head unit
+LINK = {"bandwidth": 250000, "latency": 0.01, "mtu": 1013, "jitter": 0.002}
+
+def _connector(root, link):
+    threads = []
+    def connect(client):
+        pair = transport.LinkEmulator(**LINK).socketpair if link else \
+                transport.socketpair
+        threads.append(transport.connect_local(client, PBAPServer(root),
+            pair=pair))
+    return connect, threads
+
+def _get(client):
+    client.chdir("/telecom")
+    return client.get("obj.bin")
+
+def bench_unpooled(root, link, ops):
+    connect, threads = _connector(root, link)
+    start = time.perf_counter()
+    for i in range(ops):
+        c = PBAPClient("local", 0)
+        connect(c)
+        _get(c)
+        c.disconnect()
+        c.socket.close()
+    elapsed = time.perf_counter() - start
+    for t in threads:
+        t.join()
+    return elapsed, ops
+
+def bench_pooled(root, link, ops):
+    connect, threads = _connector(root, link)
+    pool = SessionPool(connect=connect)
+    start = time.perf_counter()
+    for i in range(ops):
+        pool.call(PBAPClient, "local", 0, _get)
+    elapsed = time.perf_counter() - start
+    connects = pool.connects
+    pool.close()
+    for t in threads:
+        t.join()
+    return elapsed, connects
+
+def run(quick=False):
+    root = tempfile.mkdtemp(prefix="nobex-bench-")
+    try:
+        os.makedirs(os.path.join(root, "telecom"))
+        with open(os.path.join(root, "telecom", "obj.bin"), "wb") as f:
+            f.write(os.urandom(OBJECT_SIZE))
+
+        results = []
+        for link in (False, True):
+            if link:
+                ops = 20 if quick else 100
+            else:
+                ops = 200 if quick else 2000
+            for pooled in (False, True):
+                bench = bench_pooled if pooled else bench_unpooled
+                elapsed, connects = bench(root, link, ops)
+                results.append({
+                    "name": "pooled" if pooled else "unpooled",
+                    "transport": "link" if link else "socketpair",
+                    "operations": ops,
+                    "connects": connects,
+                    "ops_per_s": ops / elapsed
+                })
+        return results
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    sys.exit(main("pool", run, sys.argv))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+# Pushing many files over an emulated RFCOMM link: one OPP session per file,
+# versus OPPClient.push_many() in one session, with and without SRM
+
+import os, shutil, sys, tempfile, time
+from common import main
+from nOBEX import transport
+from clients.opp import OPPClient
+from servers.opp import OPPServer
+
+FILE_SIZE = 16 * 1024
+PACKET_LENGTH = 4096
+
+# roughly a Bluetooth EDR RFCOMM channel between a phone and a head unit
+LINK = {"bandwidth": 250000, "latency": 0.01, "mtu": 1013, "jitter": 0.002}
+
+def _connect(dest):
+    c = OPPClient("local", 0)
+    c.max_packet_length = PACKET_LENGTH
+    link = transport.LinkEmulator(**LINK)
+    return c, transport.connect_local(c, OPPServer(dest), pair=link.socketpair)
+
+def _finish(c, t):
+    c.disconnect()
+    c.socket.close()
+    t.join()
+
+def bench_separate(paths, dest):
+    start = time.perf_counter()
+    for path in paths:
+        c, t = _connect(dest)
+        with open(path, "rb") as f:
+            c.put(os.path.basename(path), f.read())
+        _finish(c, t)
+    return time.perf_counter() - start
+
+def bench_push_many(paths, dest, srm):
+    start = time.perf_counter()
+    c, t = _connect(dest)
+    report = c.push_many(paths, srm=srm)
+    _finish(c, t)
+    assert not report.failed
+    return time.perf_counter() - start
+
+def _check(paths, dest):
+    for path in paths:
+        with open(path, "rb") as a:
+            with open(os.path.join(dest, os.path.basename(path)), "rb") as b:
+                assert a.read() == b.read(), path
+
+def run(quick=False):
+    count = 20 if quick else 100
+    root = tempfile.mkdtemp(prefix="nobex-bench-")
+    try:
+        src = os.path.join(root, "src")
+        os.makedirs(src)
+        paths = []
+        for i in range(count):
+            paths.append(os.path.join(src, "obj%03i.bin" % i))
+            with open(paths[-1], "wb") as f:
+                f.write(os.urandom(FILE_SIZE))
+
+        results = []
+        for name, bench in (("separate", bench_separate),
+                ("push_many", lambda p, d: bench_push_many(p, d, False)),
+                ("push_many_srm", lambda p, d: bench_push_many(p, d, True))):
+            dest = os.path.join(root, name)
+            elapsed = bench(paths, dest)
+            _check(paths, dest)
+            results.append({
+                "name": name,
+                "files": count,
+                "file_size": FILE_SIZE,
+                "seconds": elapsed,
+                "files_per_s": count / elapsed,
+                "kb_per_s": count * FILE_SIZE / elapsed / 1024
+            })
+        return results
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    sys.exit(main("push", run, sys.argv))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+# Time to complete a GET or PUT whose link drops part way through, starting
+# the transfer over on a new link versus resuming it in a reliable session
+
+import os, shutil, sys, tempfile, time
+from common import main
+from nOBEX import transport
+from clients.opp import OPPClient
+from clients.pbap import PBAPClient
+from servers.opp import OPPServer
+from servers.pbap import PBAPServer
+
+PACKET_LENGTH = 4096
+
+# the fraction of the transfer made before the link drops
+DROP_AT = 0.8
+
+# roughly a Bluetooth EDR RFCOMM channel between a phone and a head unit
+LINK = {"bandwidth": 250000, "latency": 0.01, "mtu": 1013, "jitter": 0.002}
+
+def _client(cls):
+    c = cls("local", 0)
+    c.max_packet_length = PACKET_LENGTH
+    return c
+
+def _finish(client, threads):
+    client.disconnect()
+    client.socket.close()
+    for t in threads:
+        t.join()
+
+def bench_restart(make_client, server, op, drop_after):
+    threads = []
+    links = 0
+    start = time.perf_counter()
+    while True:
+        if links == 0 and drop_after is not None:
+            link = transport.LinkEmulator(drop_after=drop_after, **LINK)
+        else:
+            link = transport.LinkEmulator(**LINK)
+        c = make_client()
+        threads.append(transport.connect_local(c, server, pair=link.socketpair))
+        links += 1
+        try:
+            op(c)
+            break
+        except OSError:
+            c.socket.close()
+    elapsed = time.perf_counter() - start
+    _finish(c, threads)
+    return elapsed, links
+
+def bench_resume(make_client, server, op, drop_after):
+    threads = []
+    def reconnect():
+        csock, ssock = transport.LinkEmulator(**LINK).socketpair()
+        threads.append(transport.serve_in_thread(server, ssock))
+        return csock
+
+    if drop_after is not None:
+        link = transport.LinkEmulator(drop_after=drop_after, **LINK)
+    else:
+        link = transport.LinkEmulator(**LINK)
+    c = make_client()
+    c.set_reliable(reconnect=reconnect, timeout=5)
+    start = time.perf_counter()
+    threads.append(transport.connect_local(c, server, pair=link.socketpair))
+    op(c)
+    elapsed = time.perf_counter() - start
+    links = c.socket.resumes + 1
+    _finish(c, threads)
+    return elapsed, links
+
+def run(quick=False):
+    size = (128 if quick else 512) * 1024
+    data = os.urandom(size)
+    root = tempfile.mkdtemp(prefix="nobex-bench-")
+    try:
+        os.makedirs(os.path.join(root, "telecom"))
+        with open(os.path.join(root, "telecom", "obj.bin"), "wb") as f:
+            f.write(data)
+
+        transfers = {
+            "get": (lambda: _client(PBAPClient), PBAPServer(root),
+                lambda c: c.get("telecom/obj.bin")),
+            "put": (lambda: _client(OPPClient), OPPServer(root),
+                lambda c: c.put("obj.bin", data))
+        }
+
+        results = []
+        for name in sorted(transfers):
+            make_client, server, op = transfers[name]
+            for dropped in (False, True):
+                drop_after = int(size * DROP_AT) if dropped else None
+                for reliable in (False, True):
+                    bench = bench_resume if reliable else bench_restart
+                    elapsed, links = bench(make_client, server, op, drop_after)
+                    results.append({
+                        "name": "resume_" + name if reliable else
+                            "restart_" + name,
+                        "object_size": size,
+                        "dropped": dropped,
+                        "links": links,
+                        "seconds": elapsed
+                    })
+        return results
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    sys.exit(main("resume", run, sys.argv))
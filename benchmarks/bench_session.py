@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+# Client GET/PUT throughput and connect/disconnect latency against the
+# example servers over in-process socket pairs
+
+import os, shutil, sys, tempfile, time
+from common import MiB, main
+from nOBEX import transport
+from nOBEX.replay import percentile
+from clients.opp import OPPClient
+from clients.pbap import PBAPClient
+from servers.opp import OPPServer
+from servers.pbap import PBAPServer
+
+OBJECT_SIZES = [64 * 1024, 1 * MiB, 8 * MiB]
+
+def _transfers(size, quick):
+    total = (16 if quick else 64) * MiB
+    return max(2, total // size)
+
+def _finish(client, thread):
+    client.disconnect()
+    client.socket.close()
+    thread.join()
+
+def bench_get(root, size, quick):
+    os.makedirs(os.path.join(root, "telecom"), exist_ok=True)
+    with open(os.path.join(root, "telecom", "obj.bin"), "wb") as f:
+        f.write(os.urandom(size))
+
+    c = PBAPClient("local", 0)
+    t = transport.connect_local(c, PBAPServer(root))
+    n = _transfers(size, quick)
+    start = time.perf_counter()
+    for i in range(n):
+        c.get("telecom/obj.bin")
+    elapsed = time.perf_counter() - start
+    _finish(c, t)
+
+    return {
+        "name": "get",
+        "object_size": size,
+        "objects_per_s": n / elapsed,
+        "mb_per_s": n * size / elapsed / MiB
+    }
+
+def bench_put(root, size, quick):
+    data = os.urandom(size)
+    c = OPPClient("local", 0)
+    t = transport.connect_local(c, OPPServer(root))
+    n = _transfers(size, quick)
+    start = time.perf_counter()
+    for i in range(n):
+        c.put("obj.bin", data)
+    elapsed = time.perf_counter() - start
+    _finish(c, t)
+
+    return {
+        "name": "put",
+        "object_size": size,
+        "objects_per_s": n / elapsed,
+        "mb_per_s": n * size / elapsed / MiB
+    }
+
+def bench_connect(root, quick):
+    connects = []
+    disconnects = []
+    for i in range(50 if quick else 500):
+        csock, ssock = transport.socketpair()
+        t = transport.serve_in_thread(PBAPServer(root), ssock)
+        c = PBAPClient("local", 0)
+        c.set_socket(csock)
+
+        start = time.perf_counter()
+        c.connect()
+        mid = time.perf_counter()
+        c.disconnect()
+        end = time.perf_counter()
+
+        connects.append(mid - start)
+        disconnects.append(end - mid)
+        csock.close()
+        t.join()
+
+    results = []
+    for name, lat in (("connect", connects), ("disconnect", disconnects)):
+        lat.sort()
+        results.append({
+            "name": name,
+            "samples": len(lat),
+            "latency_mean_us": sum(lat) / len(lat) * 1e6,
+            "latency_p50_us": percentile(lat, 50) * 1e6,
+            "latency_p99_us": percentile(lat, 99) * 1e6
+        })
+    return results
+
+def run(quick=False):
+    root = tempfile.mkdtemp(prefix="nobex-bench-")
+    try:
+        results = []
+        for size in OBJECT_SIZES:
+            results.append(bench_get(root, size, quick))
+            results.append(bench_put(root, size, quick))
+        results.extend(bench_connect(root, quick))
+        return results
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    sys.exit(main("session", run, sys.argv))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+# Transfer rates over successive sessions with a fixed packet length versus
+# adaptive packet sizing, against a device that copes with any packet size
+# and one that stalls on packets bigger than its buffer
+
+import os, shutil, sys, tempfile, time
+from common import main
+from nOBEX import requests, transport
+from nOBEX.devicecache import DeviceCache
+from clients.opp import OPPClient
+from clients.pbap import PBAPClient
+from servers.opp import OPPServer
+from servers.pbap import PBAPServer
+
+# roughly a Bluetooth EDR RFCOMM channel between a phone and a head unit
+LINK = {"bandwidth": 250000, "latency": 0.01, "mtu": 1013, "jitter": 0.002}
+
+# the stalling device holds up the link for this long for every BUFFER bytes
+# a packet goes over its buffer
+BUFFER = 4096
+STALL = 0.1
+
+def _stall(length):
+    if length > BUFFER:
+        time.sleep(STALL * ((length - 1) // BUFFER))
+
+class _StallingRequestHandler(requests.RequestHandler):
+    def _read_packet(self, socket_):
+        code, data = super(_StallingRequestHandler, self)._read_packet(socket_)
+        _stall(len(data))
+        return code, data
+
+class _StallingOPPServer(OPPServer):
+    def __init__(self, directory):
+        super(_StallingOPPServer, self).__init__(directory)
+        self.request_handler = _StallingRequestHandler()
+
+class _StallingPBAPServer(PBAPServer):
+    def _send_packet(self, socket, data):
+        _stall(len(data))
+        super(_StallingPBAPServer, self)._send_packet(socket, data)
+
+def _sessions(make_client, server, op, size, sessions, adaptive):
+    cache = DeviceCache()
+    rates = []
+    for i in range(sessions):
+        c = make_client()
+        c.set_cache(cache, "bench")
+        if adaptive:
+            c.set_adaptive()
+        link = transport.LinkEmulator(**LINK)
+        t = transport.connect_local(c, server, pair=link.socketpair)
+        start = time.perf_counter()
+        op(c)
+        rates.append(size / (time.perf_counter() - start) / 1024)
+        c.disconnect()
+        c.socket.close()
+        t.join()
+    return rates, cache.get("local", "bench")
+
+def run(quick=False):
+    size = (128 if quick else 512) * 1024
+    sessions = 3 if quick else 6
+    data = os.urandom(size)
+    root = tempfile.mkdtemp(prefix="nobex-bench-")
+    try:
+        os.makedirs(os.path.join(root, "telecom"))
+        with open(os.path.join(root, "telecom", "obj.bin"), "wb") as f:
+            f.write(data)
+
+        transfers = [
+            ("get", lambda: PBAPClient("local", 0),
+                {False: PBAPServer(root), True: _StallingPBAPServer(root)},
+                lambda c: c.get("telecom/obj.bin")),
+            ("put", lambda: OPPClient("local", 0),
+                {False: OPPServer(root), True: _StallingOPPServer(root)},
+                lambda c: c.put("obj.bin", data))
+        ]
+
+        results = []
+        for name, make_client, servers, op in transfers:
+            for stalling in (False, True):
+                for adaptive in (False, True):
+                    rates, profile = _sessions(make_client, servers[stalling],
+                            op, size, sessions, adaptive)
+                    goodput = (profile.goodput or {}).get(name, {})
+                    results.append({
+                        "name": "%s_%s" % ("adaptive" if adaptive else "fixed",
+                            name),
+                        "device": "stalling" if stalling else "normal",
+                        "object_size": size,
+                        "kb_per_s": rates,
+                        "best_packet_length": int(max(goodput,
+                            key=goodput.get)) if goodput else None
+                    })
+        return results
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    sys.exit(main("sizing", run, sys.argv))
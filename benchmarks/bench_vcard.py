@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+# vCard property filtering of photo-heavy phone books: filtering raw cards,
+# filtering cards with precomputed offsets, and streaming a combined pull,
+# then parsing a combined pull into records as it streams in
+
+import base64, random, sys
+from common import main, timed, MiB
+from nOBEX import vcard
+
+# (cards, fraction with photos, photo size in bytes)
+PHONEBOOKS = [(100, 1.0, 8192), (1000, 0.5, 16384), (1000, 1.0, 65536)]
+
+# the properties a typical head unit asks for: N, FN, TEL
+CONTACT_FILTER = (1 << 1) | (1 << 2) | (1 << 7)
+
+def make_card(i, photo):
+    lines = [b"BEGIN:VCARD", b"VERSION:2.1", b"N:Contact;%06i;;;" % i,
+            b"FN:%06i Contact" % i, b"TEL;CELL:555%07i" % i,
+            b"EMAIL;HOME:contact%06i@example.com" % i]
+    if photo:
+        lines.append(b"PHOTO;ENCODING=BASE64;TYPE=JPEG:")
+        lines.extend(b"    " + photo[j:j+76] for j in range(0, len(photo), 76))
+        lines.append(b"")
+    lines.extend([b"NOTE:Note for contact %06i" % i, b"END:VCARD"])
+    return b"\r\n".join(lines) + b"\r\n"
+
+def make_phonebook(cards, photo_fraction, photo_size):
+    rng = random.Random(cards)
+    photo = base64.b64encode(bytes(rng.getrandbits(8) for i in range(photo_size)))
+    return [make_card(i, photo if rng.random() < photo_fraction else None)
+            for i in range(cards)]
+
+def bench_phonebook(cards, photo_fraction, photo_size, quick):
+    book = make_phonebook(cards, photo_fraction, photo_size)
+    data = b"".join(book)
+    min_time = 0.05 if quick else 0.3
+
+    def cold():
+        for card in book:
+            vcard.filter_card(card, CONTACT_FILTER)
+
+    indexes = [vcard.VCardIndex(card) for card in book]
+    def warm():
+        for index in indexes:
+            index.filter(CONTACT_FILTER)
+
+    def stream():
+        chunks = (data[i:i+65000] for i in range(0, len(data), 65000))
+        for card in vcard.filter_stream(chunks, CONTACT_FILTER):
+            pass
+
+    def parse():
+        chunks = (data[i:i+65000] for i in range(0, len(data), 65000))
+        for card in vcard.parse_stream(chunks):
+            pass
+
+    results = []
+    for name, fn in (("filter_cold", cold), ("filter_indexed", warm),
+            ("filter_stream", stream), ("parse_stream", parse)):
+        calls, elapsed = timed(fn, min_time)
+        results.append({
+            "name": name,
+            "cards": cards,
+            "photo_fraction": photo_fraction,
+            "photo_bytes": photo_size,
+            "phonebook_MiB": len(data) / float(MiB),
+            "us_per_card": elapsed / calls / cards * 1e6,
+            "MiB_per_s": len(data) * calls / elapsed / MiB
+        })
+    return results
+
+def run(quick=False):
+    results = []
+    for cards, photo_fraction, photo_size in PHONEBOOKS:
+        results.extend(bench_phonebook(cards, photo_fraction, photo_size, quick))
+    return results
+
+if __name__ == "__main__":
+    sys.exit(main("vcard", run, sys.argv))
@@ -0,0 +1,49 @@
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+import json, os, platform, sys, time
+
+# make nOBEX and the example clients/servers importable from a source checkout
+_here = os.path.dirname(os.path.abspath(__file__))
+for p in (os.path.join(_here, ".."), os.path.join(_here, "..", "examples")):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+import nOBEX
+
+MiB = 1024 * 1024
+
+def timed(fn, min_time=0.2):
+    """Calls fn repeatedly for at least min_time seconds.
+    Returns a tuple of (calls, elapsed seconds)."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls, elapsed
+
+def report(results):
+    return {
+        "nobex_version": nOBEX.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results
+    }
+
+def main(name, run, argv):
+    quick = "--quick" in argv
+    results = {name: run(quick)}
+    json.dump(report(results), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
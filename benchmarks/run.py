@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+# Runs the nOBEX benchmark suite and emits the results as JSON
+
+import json, sys
+from common import report
+import bench_codec, bench_link, bench_listing, bench_pool, bench_push, \
+        bench_resume, bench_session, bench_sizing, bench_vcard
+
+suites = {
+    "codec": bench_codec.run,
+    "session": bench_session.run,
+    "sizing": bench_sizing.run,
+    "link": bench_link.run,
+    "listing": bench_listing.run,
+    "pool": bench_pool.run,
+    "push": bench_push.run,
+    "resume": bench_resume.run,
+    "vcard": bench_vcard.run
+}
+
+def usage(argv):
+    sys.stderr.write("Usage: %s [--quick] [-o output.json] [suite...]\n" % argv[0])
+    sys.stderr.write("Suites: %s\n" % " ".join(sorted(suites)))
+
+def main(argv):
+    args = argv[1:]
+    quick = False
+    output = None
+    names = []
+
+    while len(args):
+        a = args.pop(0)
+        if a == "--quick":
+            quick = True
+        elif a == "-o" and len(args):
+            output = args.pop(0)
+        elif a in suites:
+            names.append(a)
+        else:
+            usage(argv)
+            return -1
+
+    if not names:
+        names = sorted(suites)
+
+    results = {}
+    for name in names:
+        results[name] = suites[name](quick)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report(results), f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report(results), sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
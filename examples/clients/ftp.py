@@ -8,9 +8,25 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
+import json, logging, os
 from nOBEX.client import Client
+from nOBEX.common import OBEXError
 from nOBEX.bluez_helper import find_service
 from nOBEX import headers
+from nOBEX.xml_helper import parse_xml
+
+logger = logging.getLogger(__name__)
+
+# written to the local root by FTPClient.mirror()
+MIRROR_MANIFEST = ".nobex-mirror.json"
+
+# folder listing attributes recorded for each mirrored file
+_MIRROR_ATTRIBUTES = ("size", "modified", "created")
+
+def _safe_name(name):
+    # names come from the server, and must not escape the local root
+    return name not in ("", ".", "..") and "/" not in name and \
+            "\\" not in name and "\x00" not in name
 
 class FTPClient(Client):
     """FTPClient(Client)
@@ -26,14 +42,20 @@ class FTPClient(Client):
     service name and address of the device as arguments.
     """
 
-    def __init__(self, address, port=None):
+    target = b"\xF9\xEC\x7B\xC4\x95\x3C\x11\xd2\x98\x4E\x52\x54\x00\xDC\x9E\x09"
+
+    def __init__(self, address, port=None, cache=None):
         if port is None:
-            port = find_service("ftp", address)
+            if cache is not None:
+                port = cache.channel(address, "ftp")
+            else:
+                port = find_service("ftp", address)
         super(FTPClient, self).__init__(address, port)
+        if cache is not None:
+            self.set_cache(cache, "ftp")
 
     def connect(self):
-        uuid = b"\xF9\xEC\x7B\xC4\x95\x3C\x11\xd2\x98\x4E\x52\x54\x00\xDC\x9E\x09"
-        super(FTPClient, self).connect(header_list = [headers.Target(uuid)])
+        super(FTPClient, self).connect(header_list = [headers.Target(self.target)])
 
     def capability(self):
         """capability(self)
@@ -45,6 +67,122 @@ class FTPClient(Client):
         hdrs, data = self.get(header_list=[headers.Type(b"x-obex/capability")])
         return data
 
+    def _listing(self):
+        tree = parse_xml(self.listdir(xml=True))
+        folders = []
+        files = []
+        for e in tree:
+            name = e.attrib.get("name", "")
+            if e.tag not in ("folder", "file"):
+                continue
+            if not _safe_name(name):
+                logger.warning("Skipping unsafe name %r", name)
+            elif e.tag == "folder":
+                folders.append(name)
+            else:
+                files.append((name, dict((a, e.attrib[a])
+                    for a in _MIRROR_ATTRIBUTES if a in e.attrib)))
+        return folders, files
+
+    def mirror(self, remote_root, local_root):
+        """mirror(self, remote_root, local_root)
+
+        Copies the tree under remote_root on the server to local_root,
+        fetching only files that changed since the last mirror.
+
+        The tree is walked using the size, modified and created attributes
+        of the folder listings. These are recorded in a manifest in
+        local_root, and a file whose attributes match the manifest and whose
+        local copy is still the recorded size is skipped. Other files are
+        streamed to disk as they arrive. Files recorded in the manifest but
+        gone from the server are deleted locally; other local files are
+        left alone. The manifest is saved even if the mirror is interrupted,
+        so the next one only fetches what is still missing.
+
+        Returns a dict counting the files fetched, skipped and removed.
+        """
+
+        manifest_path = os.path.join(local_root, MIRROR_MANIFEST)
+        try:
+            with open(manifest_path) as f:
+                previous = json.load(f)
+        except (IOError, OSError, ValueError):
+            previous = {}
+
+        manifest = {}
+        listed = set()
+        stats = {"fetched": 0, "skipped": 0, "removed": 0}
+        root = "/" + remote_root.strip("/")
+        pending = [()]
+        complete = False
+        if not os.path.isdir(local_root):
+            os.makedirs(local_root)
+        try:
+            while pending:
+                path = pending.pop()
+                self.chdir("/".join((root.rstrip("/"),) + path) or "/")
+                folders, files = self._listing()
+                local_dir = os.path.join(local_root, *path)
+                if not os.path.isdir(local_dir):
+                    os.makedirs(local_dir)
+
+                for name, attrs in files:
+                    key = "/".join(path + (name,))
+                    if key == MIRROR_MANIFEST:
+                        continue
+                    listed.add(key)
+                    local = os.path.join(local_dir, name)
+                    size = attrs.get("size")
+                    if previous.get(key) == attrs and os.path.isfile(local) \
+                            and (size is None or
+                                str(os.path.getsize(local)) == size):
+                        manifest[key] = attrs
+                        stats["skipped"] += 1
+                        continue
+
+                    logger.info("Fetching %s", key)
+                    tmp = local + ".part"
+                    try:
+                        try:
+                            with open(tmp, "wb") as f:
+                                for chunk in self.get_chunks(name):
+                                    f.write(chunk)
+                        except OBEXError as e:
+                            # left out of the manifest, so it is retried
+                            # next time
+                            logger.warning("Failed to fetch %s: %s", key, e)
+                            continue
+                        os.rename(tmp, local)
+                    finally:
+                        if os.path.exists(tmp):
+                            os.remove(tmp)
+                    manifest[key] = attrs
+                    stats["fetched"] += 1
+
+                # walk the folders in listing order
+                pending.extend(path + (d,) for d in reversed(folders))
+
+            for key in previous:
+                if key not in listed:
+                    try:
+                        os.remove(os.path.join(local_root, *key.split("/")))
+                        stats["removed"] += 1
+                    except OSError:
+                        pass
+            complete = True
+        finally:
+            if not complete:
+                # keep what is known of the files not reached yet, so an
+                # interrupted mirror resumes rather than starting over
+                saved = dict((key, attrs) for key, attrs in previous.items()
+                        if key not in listed)
+                saved.update(manifest)
+                manifest = saved
+            with open(manifest_path + ".part", "w") as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.rename(manifest_path + ".part", manifest_path)
+        return stats
+
 class SyncClient(Client):
     def connect(self, header_list=(headers.Target(b"IRMC-SYNC"),)):
         super(SyncClient, self).connect(header_list)
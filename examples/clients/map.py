@@ -13,11 +13,17 @@ from nOBEX.bluez_helper import find_service
 from nOBEX import headers
 
 class MAPClient(Client):
-    def __init__(self, address, port=None):
+    target = b'\xbb\x58\x2b\x40\x42\x0c\x11\xdb\xb0\xde\x08\x00\x20\x0c\x9a\x66'
+
+    def __init__(self, address, port=None, cache=None):
         if port is None:
-            port = find_service("map", address)
+            if cache is not None:
+                port = cache.channel(address, "map")
+            else:
+                port = find_service("map", address)
         super(MAPClient, self).__init__(address, port)
+        if cache is not None:
+            self.set_cache(cache, "map")
 
     def connect(self):
-        uuid = b'\xbb\x58\x2b\x40\x42\x0c\x11\xdb\xb0\xde\x08\x00\x20\x0c\x9a\x66'
-        super(MAPClient, self).connect(header_list = [headers.Target(uuid)])
+        super(MAPClient, self).connect(header_list = [headers.Target(self.target)])
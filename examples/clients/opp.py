@@ -8,12 +8,137 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
+import logging, os, socket, time
 from nOBEX.client import Client
 from nOBEX.bluez_helper import find_service
-from nOBEX import headers
+from nOBEX.common import OBEXError
+from nOBEX import headers, reliable, responses
+
+logger = logging.getLogger(__name__)
+
+class PushResult(object):
+    """The outcome of pushing one file. seconds runs from sending the first
+    packet to reading the final response, and error is the OBEXError the
+    server answered with, if it refused the file."""
+
+    __slots__ = ("path", "size", "seconds", "error")
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def rate(self):
+        """Bytes per second"""
+        return self.size / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return "<PushResult %s %s, %i bytes in %.3f s>" % (self.path,
+                "ok" if self.ok else "failed", self.size, self.seconds)
+
+class PushReport(object):
+    """The results of OPPClient.push_many(), in the order pushed, and the
+    time taken to push them all"""
+
+    def __init__(self, results, seconds):
+        self.results = results
+        self.seconds = seconds
+
+    @property
+    def size(self):
+        """Bytes of the files pushed successfully"""
+        return sum(r.size for r in self.results if r.ok)
+
+    @property
+    def rate(self):
+        """Bytes per second over the whole push"""
+        return self.size / self.seconds if self.seconds else 0.0
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
 
 class OPPClient(Client):
-    def __init__(self, address, port=None):
+    def __init__(self, address, port=None, cache=None):
         if port is None:
-            port = find_service("opush", address)
+            if cache is not None:
+                port = cache.channel(address, "opush")
+            else:
+                port = find_service("opush", address)
         super(OPPClient, self).__init__(address, port)
+        if cache is not None:
+            self.set_cache(cache, "opush")
+
+    def push_many(self, paths, srm=True):
+        """push_many(self, paths, srm=True)
+
+        Pushes each of the files at paths in this session, streaming them
+        from disk, and returns a PushReport of the time taken by each file
+        and by all of them. Files the server refuses are recorded as failed
+        and the rest are still pushed. Other errors, such as a file that
+        cannot be read, stop the push and are raised once the session is
+        back in step with the server.
+
+        If srm is true and the server enables Single Response Mode, each
+        file's body is sent without waiting for a response to every packet,
+        and the next file is started before the response to the last packet
+        of the one before has arrived. SRM is not used in reliable sessions,
+        which resend only the last packet after reconnecting.
+        """
+
+        srm = srm and not isinstance(self.socket, reliable.ClientSession)
+        results = []
+        start = time.perf_counter()
+        try:
+            for path in paths:
+                result = PushResult(path, os.path.getsize(path))
+                results.append(result)
+                with open(path, "rb") as f:
+                    self._push(result, f, srm)
+            if self._deferred is not None:
+                self._finish_deferred()
+        except BaseException as e:
+            if self._deferred is not None:
+                if isinstance(e, socket.timeout) or reliable.link_lost(e):
+                    # the response to the last file will never arrive
+                    self._deferred = None
+                else:
+                    # read it, so the session stays in step with the server
+                    try:
+                        self._finish_deferred()
+                    except OSError:
+                        pass
+            raise
+        return PushReport(results, time.perf_counter() - start)
+
+    def _push(self, result, f, srm):
+        begin = time.perf_counter()
+
+        def finish(response):
+            result.seconds = time.perf_counter() - begin
+            if not isinstance(response, responses.Success):
+                result.error = OBEXError(response)
+            logger.debug("%r", result)
+            if self.instrument is not None:
+                self.instrument.operation("put", result.seconds,
+                        result.size if result.ok else 0, result.error)
+
+        name = os.path.basename(result.path)
+        try:
+            for response in self._put_stream(name, f.read, result.size,
+                    srm=srm, defer_final=srm):
+                if response is None:
+                    # the response arrives while the next file is started
+                    self._deferred = finish
+                    return
+                if not isinstance(response, responses.Continue):
+                    finish(response)
+                    return
+        except OBEXError as e:
+            finish(e.args[0])
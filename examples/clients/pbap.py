@@ -12,12 +12,34 @@ from nOBEX.client import Client
 from nOBEX.bluez_helper import find_service
 from nOBEX import headers
 
+# PbapSupportedFeatures bits
+FEATURE_DOWNLOAD = 0x0001
+FEATURE_BROWSING = 0x0002
+FEATURE_DATABASE_IDENTIFIER = 0x0004
+FEATURE_FOLDER_VERSION_COUNTERS = 0x0008
+FEATURE_VCARD_SELECTING = 0x0010
+
 class PBAPClient(Client):
-    def __init__(self, address, port=None):
+    target = b'\x79\x61\x35\xf0\xf0\xc5\x11\xd8\x09\x66\x08\x00\x20\x0c\x9a\x66'
+
+    # sent on connection, as PBAP 1.2 servers only send the database
+    # identifier and folder version counters to clients declaring support
+    supported_features = FEATURE_DOWNLOAD | FEATURE_BROWSING | \
+            FEATURE_DATABASE_IDENTIFIER | FEATURE_FOLDER_VERSION_COUNTERS
+
+    def __init__(self, address, port=None, cache=None):
         if port is None:
-            port = find_service("pbap", address)
+            if cache is not None:
+                port = cache.channel(address, "pbap")
+            else:
+                port = find_service("pbap", address)
         super(PBAPClient, self).__init__(address, port)
+        if cache is not None:
+            self.set_cache(cache, "pbap")
 
     def connect(self):
-        uuid = b'\x79\x61\x35\xf0\xf0\xc5\x11\xd8\x09\x66\x08\x00\x20\x0c\x9a\x66'
-        super(PBAPClient, self).connect(header_list = [headers.Target(uuid)])
+        features = headers.App_Parameters(
+                {"PbapSupportedFeatures": self.supported_features},
+                tags = headers.PBAP_APP_PARAMS)
+        super(PBAPClient, self).connect(header_list = [headers.Target(self.target),
+            features])
@@ -10,7 +10,7 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
-import os, sys, traceback
+import logging, os, sys, traceback
 from xml.etree import ElementTree
 from clients.ftp import FTPClient
 
@@ -19,8 +19,7 @@ def _pjoin(paths):
 
 def dump_recurse(client, path, save_path=None):
     offset = len(path)
-    if len(path) > 0:
-        client.setpath(path[-1])
+    client.chdir("/" + _pjoin(path))
 
     # since some people may still be holding back progress with Python 2, I'll support
     # them for now and not use the Python 3 exist_ok option :(
@@ -47,9 +46,6 @@ def dump_recurse(client, path, save_path=None):
         new_path = path + (d,)
         dump_recurse(client, new_path, save_path)
 
-    if len(path) > 0:
-        client.setpath(to_parent=True)
-
 def main(argv):
     if not (2 <= len(argv) <= 3):
         sys.stderr.write("Usage: %s <device_address> [save_directory]\n" % argv[0])
@@ -64,7 +60,14 @@ def main(argv):
     c = FTPClient(device_address)
     c.connect()
 
-    dump_recurse(c, (), save_path)
+    if save_path:
+        # only fetch the files that changed since the last run
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        stats = c.mirror("/", save_path)
+        print("%(fetched)i fetched, %(skipped)i unchanged, %(removed)i removed"
+                % stats)
+    else:
+        dump_recurse(c, (), save_path)
 
     c.disconnect()
     return 0
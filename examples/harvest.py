@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+# Harvests PBAP, MAP and FTP data from many devices at once
+
+import logging, os, sys
+from nOBEX.bluez_helper import list_paired_devices
+from nOBEX.common import OBEXError
+from nOBEX.devicecache import DeviceCache
+from nOBEX.scheduler import Scheduler
+import mapclient, pbapclient
+from clients.ftp import FTPClient
+from clients.map import MAPClient
+from clients.pbap import PBAPClient
+
+PROFILES = ("pbap", "map", "ftp")
+
+# SDP records and connection parameters of the devices, kept in the
+# destination directory so later harvests skip service discovery
+CACHE_FILE = "devices.json"
+
+def usage(argv):
+    sys.stderr.write("Usage: %s [-j <connections>] [--retries <count>] "
+            "[--profiles pbap,map,ftp] [--sync] <dest directory> "
+            "[device address ...]\n" % argv[0])
+    sys.stderr.write("Harvests every paired device if no addresses are given\n")
+
+def open_bluetooth(cls, address, cache=None):
+    """Returns a connected client of the given class for the device"""
+    c = cls(address, cache=cache)
+    c.connect()
+    return c
+
+def close_session(c):
+    try:
+        c.disconnect()
+    except (OBEXError, OSError):
+        pass
+    if c.socket is not None:
+        c.socket.close()
+
+def device_dir(dest_dir, address):
+    return os.path.join(dest_dir, address.replace(":", "").upper())
+
+def pbap_job(dest_dir, sync=False, open_session=open_bluetooth):
+    def run(address):
+        dest = os.path.join(device_dir(dest_dir, address), "pbap", "telecom")
+        c = open_session(PBAPClient, address)
+        try:
+            for book in ("pb", "ich", "och", "mch", "cch"):
+                if sync:
+                    pbapclient.sync_dir(c, "telecom/" + book,
+                            os.path.join(dest, book))
+                else:
+                    pbapclient.dump_dir(c, "telecom/" + book,
+                            os.path.join(dest, book))
+        finally:
+            close_session(c)
+    return run
+
+def map_job(dest_dir, sync=False, open_session=open_bluetooth):
+    def run(address):
+        dest = os.path.join(device_dir(dest_dir, address), "map", "telecom",
+                "msg")
+        c = open_session(MAPClient, address)
+        try:
+            c.chdir("/telecom/msg")
+            dirs, _ = c.listdir()
+            for d in dirs:
+                if sync:
+                    mapclient.sync_dir(c, "telecom/msg/" + d,
+                            os.path.join(dest, d))
+                else:
+                    mapclient.dump_dir(c, "telecom/msg/" + d,
+                            os.path.join(dest, d))
+        finally:
+            close_session(c)
+    return run
+
+def ftp_job(dest_dir, sync=False, open_session=open_bluetooth):
+    # mirroring only fetches what changed anyway
+    def run(address):
+        c = open_session(FTPClient, address)
+        try:
+            return c.mirror("/", os.path.join(device_dir(dest_dir, address),
+                "ftp"))
+        finally:
+            close_session(c)
+    return run
+
+JOBS = {"pbap": pbap_job, "map": map_job, "ftp": ftp_job}
+
+def print_results(results):
+    print("%-20s %-6s %-8s %8s %10s  %s" % ("device", "job", "status",
+        "attempts", "seconds", "error"))
+    for r in sorted(results, key=lambda r: (r.device, r.job)):
+        print("%-20s %-6s %-8s %8i %10.3f  %s" % (r.device, r.job,
+            "ok" if r.ok else "FAILED", r.attempts, r.total,
+            r.error if r.error is not None else ""))
+
+def main(argv):
+    args = argv[1:]
+    connections = 1
+    retries = 2
+    profiles = PROFILES
+    sync = False
+    positional = []
+    try:
+        while args:
+            a = args.pop(0)
+            if a == "-j":
+                connections = int(args.pop(0))
+            elif a == "--retries":
+                retries = int(args.pop(0))
+            elif a == "--profiles":
+                profiles = args.pop(0).split(",")
+            elif a == "--sync":
+                sync = True
+            else:
+                positional.append(a)
+    except (IndexError, ValueError):
+        usage(argv)
+        return -1
+
+    if not positional or any(p not in JOBS for p in profiles):
+        usage(argv)
+        return -1
+
+    dest_dir = os.path.abspath(positional[0])
+    devices = positional[1:] or sorted(list_paired_devices())
+
+    logging.basicConfig(level=logging.INFO,
+            format="%(asctime)s %(threadName)s: %(message)s")
+
+    os.makedirs(dest_dir, exist_ok=True)
+    cache = DeviceCache(os.path.join(dest_dir, CACHE_FILE))
+    open_session = lambda cls, address: open_bluetooth(cls, address, cache)
+
+    jobs = [(p, JOBS[p](dest_dir, sync, open_session)) for p in profiles]
+    scheduler = Scheduler(max_connections=connections, retries=retries)
+    results = scheduler.run(devices, jobs)
+    print_results(results)
+    return 0 if all(r.ok for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -10,9 +10,9 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
-import os, sys
+import json, os, sys
 from xml.etree import ElementTree
-from nOBEX import headers
+from nOBEX import export, headers
 from nOBEX.common import OBEXError
 from nOBEX.xml_helper import parse_xml
 from clients.map import MAPClient
@@ -32,19 +32,26 @@ def get_file(c, src_path, dest_path, verbose=True, folder_name=None):
 
     # include attachments, use UTF-8 encoding
     req_hdrs = [headers.Type(b'x-bt/message'),
-                headers.App_Parameters(b'\x0A\x01\x01\x14\x01\x01')]
+                headers.App_Parameters({"Attachment": 1, "Charset": 1},
+                    tags=headers.MAP_APP_PARAMS)]
     hdrs, card = c.get(src_path, header_list=req_hdrs)
     with open(dest_path, 'wb') as f:
         f.write(card)
+    return card
 
-def dump_dir(c, src_path, dest_path):
+def dump_dir(c, src_path, dest_path, writer=None):
+    """Saves the listing and every message of a MAP folder, given relative
+    to the root folder, and leaves the client in that folder. If writer is
+    an nOBEX.export.Writer, the listing is also added to its messages
+    table."""
     src_path = src_path.strip("/")
 
     # Access the list of vcards in the directory
-    hdrs, cards = c.get(src_path, header_list=[headers.Type(b'x-bt/MAP-msg-listing')])
+    c.chdir("/" + src_path)
+    root = get_listing(c)
 
     # folder doesn't exist, iPhone behaves this way
-    if len(cards) == 0:
+    if root is None:
         return
 
     # since some people may still be holding back progress with Python 2, I'll support
@@ -54,44 +61,227 @@ def dump_dir(c, src_path, dest_path):
     except OSError:
         pass
 
-    # Parse the XML response to the previous request.
     # Extract a list of file names in the directory
     names = []
-    root = parse_xml(cards)
     dump_xml(root, "/".join([dest_path, "mlisting.xml"]))
     for card in root.findall("msg"):
         names.append(card.attrib["handle"])
-
-    c.setpath(src_path)
+        if writer is not None:
+            writer.add_message(src_path, card.attrib)
 
     # get all the files
     for name in names:
         get_file(c, name, "/".join([dest_path, name]), folder_name=src_path)
 
-    # return to the root directory
-    depth = len([f for f in src_path.split("/") if len(f)])
-    for i in range(depth):
-        c.setpath(to_parent=True)
+# per folder index of synced messages; a dot file, so that the MAP server
+# does not take it for a message when serving the folder
+SYNC_INDEX = ".sync.json"
+
+# listing attributes kept in the index; a change to any but "read" means a
+# message must be fetched again
+SYNC_ATTRIBUTES = ("datetime", "size", "attachment_size", "read")
+
+# messages asked for per listing request; servers default to 1024 when
+# MaxListCount is left out
+LISTING_PAGE = 1024
+
+# fetch orders for sync_dir()
+ORDER_NEWEST, ORDER_OLDEST, ORDER_LISTING = "newest", "oldest", "listing"
+
+def _message_bytes(attrib):
+    size = 0
+    for name in ("size", "attachment_size"):
+        try:
+            size += int(attrib.get(name, 0))
+        except ValueError:
+            pass
+    return size
+
+def _content_changed(old, new):
+    """Whether a message must be fetched again, given its indexed and
+    listed attributes. Fetching a message marks it read, so the read status
+    alone is only recorded."""
+    if old is None:
+        return True
+    return any(old.get(name) != new[name] for name in SYNC_ATTRIBUTES
+            if name != "read")
+
+def get_listing(c):
+    """Fetches the whole message listing of the current folder, one page
+    of LISTING_PAGE messages at a time, and returns it as a single XML
+    element, or None if the folder is empty or doesn't exist."""
+    root = None
+    offset = 0
+    while True:
+        params = headers.App_Parameters({"MaxListCount": LISTING_PAGE,
+                "StartOffset": offset}, tags=headers.MAP_APP_PARAMS)
+        hdrs, cards = c.get("", header_list=[
+                headers.Type(b'x-bt/MAP-msg-listing'), params])
+        if len(cards) == 0:
+            break
+
+        page = parse_xml(cards)
+        msgs = page.findall("msg")
+        if root is None:
+            root = page
+        else:
+            root.extend(msgs)
+        offset += len(msgs)
+
+        size = None
+        for h in hdrs:
+            if isinstance(h, headers.App_Parameters):
+                size = h.decode(headers.MAP_APP_PARAMS).get("MessagesListingSize")
+        if len(msgs) == 0 or (size is not None and offset >= size) or \
+                (size is None and len(msgs) < LISTING_PAGE):
+            break
+    return root
+
+def sync_dir(c, src_path, dest_path, budget=None, order=ORDER_NEWEST,
+        writer=None):
+    """Brings a folder saved by dump_dir() or an earlier sync up to date.
+
+    An index of the synced messages and their listing attributes is kept
+    in SYNC_INDEX. The listing is fetched in pages until the whole folder
+    is known. Messages that are new, or whose size or datetime changed, are
+    fetched in the given order, and messages gone from the listing are
+    deleted. A change of read status alone is recorded without fetching the
+    message again. With a budget, fetching stops before the
+    listed sizes of the messages fetched would exceed that many bytes; the
+    rest are fetched by a later sync.
+
+    The folder is given relative to the root folder, and the client is left
+    in it. Returns the number of bytes fetched."""
+    src_path = src_path.strip("/")
+
+    c.chdir("/" + src_path)
+    root = get_listing(c)
+
+    # folder doesn't exist, iPhone behaves this way
+    if root is None:
+        return 0
+
+    try:
+        os.makedirs(dest_path)
+    except OSError:
+        pass
+
+    index_file = "/".join([dest_path, SYNC_INDEX])
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        index = {}
+
+    dump_xml(root, "/".join([dest_path, "mlisting.xml"]))
+    listing = {}
+    pending = []
+    for msg in root.findall("msg"):
+        handle = msg.attrib["handle"]
+        attrs = dict((name, msg.attrib.get(name, "")) for name in SYNC_ATTRIBUTES)
+        listing[handle] = attrs
+        if writer is not None:
+            writer.add_message(src_path, msg.attrib)
+        if _content_changed(index.get(handle), attrs) or \
+                not os.path.exists("/".join([dest_path, handle])):
+            pending.append((handle, attrs))
+        elif index[handle] != attrs:
+            index[handle] = attrs
+
+    # delete messages no longer on the phone; handles are sent by the phone,
+    # so only plain file names are trusted
+    removed = [handle for handle in index if handle not in listing]
+    for handle in removed:
+        del index[handle]
+        if os.path.basename(handle) == handle:
+            try:
+                os.remove("/".join([dest_path, handle]))
+            except OSError:
+                pass
+
+    # MAP datetimes are YYYYMMDDTHHMMSS, which sort as strings
+    if order == ORDER_NEWEST:
+        pending.sort(key=lambda p: p[1]["datetime"], reverse=True)
+    elif order == ORDER_OLDEST:
+        pending.sort(key=lambda p: p[1]["datetime"])
+
+    print("Syncing %s: %i of %i messages changed, %i removed" % (src_path,
+            len(pending), len(listing), len(removed)))
+
+    fetched = 0
+    for handle, attrs in pending:
+        if budget is not None and fetched + _message_bytes(attrs) > budget:
+            print("Byte budget reached, %s and later messages left for the "
+                    "next sync" % handle)
+            break
+        try:
+            fetched += len(get_file(c, handle, "/".join([dest_path, handle]),
+                    folder_name=src_path))
+        except OBEXError as e:
+            print("Failed to fetch", handle, e)
+            continue
+        index[handle] = attrs
+
+    with open(index_file, 'w') as f:
+        json.dump(index, f)
+    return fetched
+
+def _pop_option(argv, name, has_value=True):
+    """Removes an option and its value from argv, returning the value, or
+    True for an option without one, or None if it is absent."""
+    if name not in argv[1:]:
+        return None
+    i = argv.index(name)
+    if not has_value:
+        del argv[i]
+        return True
+    value = argv[i+1] if i + 1 < len(argv) else None
+    del argv[i:i+2]
+    return value
 
 def main():
-    if len(sys.argv) != 3:
-        sys.stderr.write("Usage: %s <device address> <dest directory>\n" % sys.argv[0])
+    argv = list(sys.argv)
+    # write the message listings to a columnar file as well
+    export_path = _pop_option(argv, "--export")
+    # only fetch what changed since the last run into dest directory
+    sync = _pop_option(argv, "--sync", False)
+    budget = _pop_option(argv, "--budget")
+    order = _pop_option(argv, "--order") or ORDER_NEWEST
+
+    if len(argv) != 3 or order not in (ORDER_NEWEST, ORDER_OLDEST, ORDER_LISTING) \
+            or (budget is not None and not budget.isdigit()):
+        sys.stderr.write("Usage: %s [--export <file>] [--sync [--budget <bytes>] "
+                "[--order newest|oldest|listing]] <device address> <dest directory>\n"
+                % sys.argv[0])
         return 1
+    if budget is not None:
+        budget = int(budget)
+
+    device_address = argv[1]
+    dest_dir = os.path.abspath(argv[2]) + "/"
 
-    device_address = sys.argv[1]
-    dest_dir = os.path.abspath(sys.argv[2]) + "/"
+    writer = None
+    if export_path is not None:
+        writer = export.Writer(export_path, device=device_address)
 
     c = MAPClient(device_address)
     c.connect()
-    c.setpath("telecom")
-    c.setpath("msg")
+    c.chdir("/telecom/msg")
 
     # dump every folder
     dirs, _ = c.listdir()
     for d in dirs:
-        dump_dir(c, d, dest_dir + "telecom/msg/" + d)
+        if not sync:
+            dump_dir(c, "telecom/msg/" + d, dest_dir + "telecom/msg/" + d, writer)
+            continue
+        fetched = sync_dir(c, "telecom/msg/" + d, dest_dir + "telecom/msg/" + d,
+                budget, order, writer)
+        if budget is not None:
+            budget = max(budget - fetched, 0)
 
     c.disconnect()
+    if writer is not None:
+        writer.close()
     return 0
 
 if __name__ == "__main__":
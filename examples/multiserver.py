@@ -10,35 +10,48 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
-import os, signal, sys, traceback
+import logging, os, signal, sys
 from servers.hfp import HFPServer
 from servers.map import MAPServer
 from servers.pbap import PBAPServer
 from servers.opp import OPPServer
 from servers.ftp import FTPServer
+from nOBEX.replay import SessionRecorder
+from nOBEX import metrics
 from threading import Thread
 
-def thread_serve(serv_class, arg):
-    t = Thread(target=serve, args=(serv_class, arg), daemon=True)
+def thread_serve(serv_class, arg, record_dir=None, registry=None):
+    t = Thread(target=serve, args=(serv_class, arg),
+            kwargs={"record_dir": record_dir, "registry": registry},
+            daemon=True)
     t.start()
     return t
 
 def serve(serv_class, *args, **kwargs):
+    record_dir = kwargs.pop("record_dir", None)
+    registry = kwargs.pop("registry", None)
     server = serv_class(*args, **kwargs)
+    if record_dir:
+        server.session_recorder = SessionRecorder(record_dir,
+                serv_class.__name__)
+    if registry is not None:
+        server.enable_metrics(registry)
     socket = server.start_service()
     while True:
         try:
             server.serve(socket)
         except:
-            traceback.print_exc()
+            logging.exception("%s failed", serv_class.__name__)
 
 def usage(argv):
-    sys.stderr.write("Usage: %s " % argv[0])
+    sys.stderr.write("Usage: %s [-v] " % argv[0])
     sys.stderr.write("[--hfp [config]] ")
     sys.stderr.write("[--pbap pbap_root] ")
     sys.stderr.write("[--map map_root] ")
     sys.stderr.write("[--ftp ftp_root] ")
-    sys.stderr.write("[--opp opp_root]\n")
+    sys.stderr.write("[--opp opp_root] ")
+    sys.stderr.write("[--record record_dir] ")
+    sys.stderr.write("[--metrics port]\n")
 
 def signal_handler(signal, frame):
     print() # newline to move ^C onto its own line on display
@@ -59,6 +72,10 @@ def main(argv):
     pbap_conf = None
     ftp_conf = None
     opp_conf = None
+    record_dir = None
+    registry = None
+    metrics_port = None
+    log_level = logging.INFO
 
     args = argv[1:]
     while len(args):
@@ -79,11 +96,20 @@ def main(argv):
         elif a == "--opp":
             en_opp = True
             opp_conf = args.pop(0)
+        elif a == "--record":
+            record_dir = args.pop(0)
+        elif a == "--metrics":
+            metrics_port = int(args.pop(0))
+        elif a == "-v":
+            log_level = logging.DEBUG
         else:
             sys.stderr.write("unknown parameter %s\n" % a)
             usage(argv)
             return -1
 
+    logging.basicConfig(level=log_level,
+            format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
     signal.signal(signal.SIGINT, signal_handler)
 
     # obexd conflicts with our own OBEX servers
@@ -91,20 +117,25 @@ def main(argv):
 
     threads = []
 
+    if metrics_port is not None:
+        registry = metrics.Registry()
+        metrics.start_http_server(registry, metrics_port)
+        logging.info("Serving metrics on http://127.0.0.1:%i/metrics", metrics_port)
+
     if en_hfp:
         threads.append(thread_serve(HFPServer, hfp_conf))
 
     if en_map:
-        threads.append(thread_serve(MAPServer, map_conf))
+        threads.append(thread_serve(MAPServer, map_conf, record_dir, registry))
 
     if en_pbap:
-        threads.append(thread_serve(PBAPServer, pbap_conf))
+        threads.append(thread_serve(PBAPServer, pbap_conf, record_dir, registry))
 
     if en_ftp:
-        threads.append(thread_serve(FTPServer, ftp_conf))
+        threads.append(thread_serve(FTPServer, ftp_conf, record_dir, registry))
 
     if en_opp:
-        threads.append(thread_serve(OPPServer, opp_conf))
+        threads.append(thread_serve(OPPServer, opp_conf, record_dir, registry))
 
     # wait for completion (never)
     for t in threads:
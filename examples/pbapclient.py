@@ -10,16 +10,17 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
-import os, struct, sys
+import binascii, json, os, struct, sys
 from xml.etree import ElementTree
 from xml.dom import minidom
-from nOBEX import headers, responses
+from nOBEX import export, headers, responses, vcard
 from nOBEX.common import OBEXError
 from nOBEX.xml_helper import parse_xml
 from clients.pbap import PBAPClient
 
 def usage():
-    sys.stderr.write("Usage: %s <device address> <dest directory> [SIM]\n" % sys.argv[0])
+    sys.stderr.write("Usage: %s [--sync] [--export <file>] <device address> <dest directory> [SIM]\n"
+            % sys.argv[0])
 
 def dump_xml(element, file_name):
     rough_string = ElementTree.tostring(element, 'utf-8')
@@ -29,7 +30,21 @@ def dump_xml(element, file_name):
         fd.write('<?xml version="1.0"?>\n<!DOCTYPE vcard-listing SYSTEM "vcard-listing.dtd">\n')
         fd.write(pretty_string[23:]) # skip xml declaration
 
-def get_file(c, src_path, dest_path, verbose=True, folder_name=None, book=False):
+def _saved(chunks, f):
+    """Writes each chunk to f as it is passed on"""
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+
+def _file_chunks(f, size=65536):
+    return iter(lambda: f.read(size), b'')
+
+def get_file(c, src_path, dest_path, verbose=True, folder_name=None, book=False,
+        on_card=None):
+    """Streams a vCard or phone book to dest_path as it arrives, calling
+    on_card with each nOBEX.vcard.VCard parsed on the way if given, so that
+    only one packet and one vCard are held in memory. Returns the number of
+    bytes fetched."""
     if verbose:
         if folder_name is not None:
             print("Fetching %s/%s" % (folder_name, src_path))
@@ -41,11 +56,24 @@ def get_file(c, src_path, dest_path, verbose=True, folder_name=None, book=False)
     else:
         mimetype = b'x-bt/vcard'
 
-    hdrs, card = c.get(src_path, header_list=[headers.Type(mimetype)])
+    chunks = c.get_chunks(src_path, header_list=[headers.Type(mimetype)])
+    size = 0
     with open(dest_path, 'wb') as f:
-        f.write(card)
+        if on_card is None:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        else:
+            for card in vcard.parse_stream(_saved(chunks, f)):
+                on_card(card)
+            size = f.tell()
+    return size
 
-def dump_dir(c, src_path, dest_path):
+def dump_dir(c, src_path, dest_path, writer=None):
+    """Saves the listing and every vCard of a phone book folder, given
+    relative to the root folder, and leaves the client in that folder. If
+    writer is an nOBEX.export.Writer, each vCard is also added to its
+    contacts or calls table as it arrives."""
     src_path = src_path.strip("/")
 
     # since some people may still be holding back progress with Python 2, I'll support
@@ -56,7 +84,8 @@ def dump_dir(c, src_path, dest_path):
         pass
 
     # Access the list of vcards in the directory
-    hdrs, cards = c.get(src_path, header_list=[headers.Type(b'x-bt/vcard-listing')])
+    c.chdir("/" + src_path)
+    hdrs, cards = c.get("", header_list=[headers.Type(b'x-bt/vcard-listing')])
 
     if len(cards) == 0:
         print("WARNING: %s is empty, skipping", src_path)
@@ -70,22 +99,164 @@ def dump_dir(c, src_path, dest_path):
     for card in root.findall("card"):
         names.append(card.attrib["handle"])
 
-    c.setpath(src_path)
-
-    # get all the files
+    # get all the files, adding each vCard to the export as it is parsed
     for name in names:
+        fname = "/".join([dest_path, name])
+        on_card = None
+        if writer is not None:
+            on_card = lambda card: writer.add_contact(src_path, name, card)
+        try:
+            get_file(c, name, fname, folder_name=src_path, on_card=on_card)
+        except OBEXError as e:
+            print("Failed to fetch", fname, e)
+
+# PBAP 1.2 application parameters identifying the state of a phone book
+SYNC_PARAMS = ("DatabaseIdentifier", "PrimaryVersionCounter",
+        "SecondaryVersionCounter")
+
+# per folder sync state, next to listing.xml
+SYNC_STATE = "sync.json"
+
+def _read_listing(fname):
+    """Returns the (handle, name) pairs of a saved listing.xml, in order"""
+    try:
+        with open(fname, 'rb') as f:
+            root = parse_xml(f.read())
+    except (IOError, OSError, ElementTree.ParseError):
+        return []
+    return [(card.attrib.get("handle", ""), card.attrib.get("name", ""))
+            for card in root.findall("card")]
+
+def _sync_params(hdrs):
+    for h in hdrs:
+        if isinstance(h, headers.App_Parameters):
+            params = h.decode(headers.PBAP_APP_PARAMS)
+            return dict((name, binascii.hexlify(params[name]).decode())
+                    for name in SYNC_PARAMS
+                    if isinstance(params.get(name), bytes))
+    return {}
+
+def sync_dir(c, src_path, dest_path, writer=None):
+    """Brings a folder saved by dump_dir() up to date, fetching only the
+    vCards that are new or changed since the last run and deleting those
+    removed from the phone.
+
+    If the phone provides the PBAP 1.2 version counters and they have not
+    moved, nothing but missing files is fetched. If either has moved, any
+    vCard may have been edited in place, which neither the counters nor the
+    listing can locate, so every vCard is fetched again. Without counters,
+    changes are found by comparing the listing with the saved listing.xml.
+    A new database identifier means the handles were reassigned, and
+    everything is fetched again too.
+
+    The folder is given relative to the root folder, and the client is left
+    in it. Returns the list of handles in the listing."""
+    src_path = src_path.strip("/")
+
+    try:
+        os.makedirs(dest_path)
+    except OSError:
+        pass
+
+    c.chdir("/" + src_path)
+    hdrs, cards = c.get("", header_list=[headers.Type(b'x-bt/vcard-listing')])
+
+    if len(cards) == 0:
+        print("WARNING: %s is empty, skipping" % src_path)
+        return []
+
+    root = parse_xml(cards)
+    entries = [(card.attrib["handle"], card.attrib.get("name", ""))
+            for card in root.findall("card")]
+    names = [handle for handle, name in entries]
+
+    listing_file = "/".join([dest_path, "listing.xml"])
+    state_file = "/".join([dest_path, SYNC_STATE])
+    saved = dict(_read_listing(listing_file))
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (IOError, OSError, ValueError):
+        state = {}
+
+    params = _sync_params(hdrs)
+    counters = ("PrimaryVersionCounter", "SecondaryVersionCounter")
+    # a new database identifier means the saved handles say nothing about
+    # the vCards now behind them, so every vCard is fetched
+    reassigned = params.get("DatabaseIdentifier") != \
+            state.get("DatabaseIdentifier")
+    previous = {} if reassigned else saved
+    current = dict(entries)
+    missing = set(handle for handle in names
+            if not os.path.exists("/".join([dest_path, handle])))
+    if not reassigned and params and all(name in params for name in counters):
+        if all(params[name] == state.get(name) for name in counters):
+            fetch = [handle for handle in names if handle in missing]
+        else:
+            fetch = names
+    else:
+        fetch = [handle for handle, name in entries
+                if handle in missing or previous.get(handle) != name]
+
+    # delete vCards no longer on the phone; handles are sent by the phone,
+    # so only plain file names are trusted
+    for handle in saved:
+        if handle not in current and os.path.basename(handle) == handle:
+            try:
+                os.remove("/".join([dest_path, handle]))
+            except OSError:
+                pass
+
+    print("Syncing %s: %i of %i vCards changed, %i removed" % (src_path,
+            len(fetch), len(names), len(set(saved) - set(current))))
+
+    for name in fetch:
         fname = "/".join([dest_path, name])
         try:
             get_file(c, name, fname, folder_name=src_path)
         except OBEXError as e:
             print("Failed to fetch", fname, e)
 
-    # return to the root directory
-    depth = len([f for f in src_path.split("/") if len(f)])
-    for i in range(depth):
-        c.setpath(to_parent=True)
+    # only record the new state once the vCards are saved, so that an
+    # interrupted sync is retried
+    dump_xml(root, listing_file)
+    with open(state_file, 'w') as f:
+        json.dump(params, f)
+
+    if writer is not None:
+        for name in names:
+            try:
+                with open("/".join([dest_path, name]), 'rb') as f:
+                    for card in vcard.parse_stream(_file_chunks(f)):
+                        writer.add_contact(src_path, name, card)
+            except (IOError, OSError):
+                pass
+    return names
+
+def write_combined(src_dir, handles, dest_path):
+    """Rebuilds a combined phone book .vcf from the saved vCards of a
+    folder, in listing order, instead of pulling it again"""
+    with open(dest_path, 'wb') as out:
+        for handle in handles:
+            try:
+                with open("/".join([src_dir, handle]), 'rb') as f:
+                    out.write(f.read())
+            except (IOError, OSError):
+                pass
 
 def main(argv):
+    argv = list(argv)
+    sync = "--sync" in argv
+    if sync:
+        # only fetch what changed since the last run into dest directory
+        argv.remove("--sync")
+    export_path = None
+    if "--export" in argv[:-1]:
+        # write the phone books and call history to a columnar file as well
+        i = argv.index("--export")
+        export_path = argv[i+1]
+        del argv[i:i+2]
+
     if not 3 <= len(argv) <= 4:
         usage()
         return -1
@@ -103,18 +274,33 @@ def main(argv):
     device_address = argv[1]
     dest_dir = os.path.abspath(argv[2]) + "/"
 
+    writer = None
+    if export_path is not None:
+        writer = export.Writer(export_path, device=device_address)
+
     c = PBAPClient(device_address)
     c.connect()
 
+    if sync:
+        # sync the folders, and rebuild the combined vcards from them
+        for book in ("pb", "ich", "och", "mch", "cch"):
+            folder = dest_dir + prefix + "telecom/" + book
+            handles = sync_dir(c, prefix + "telecom/" + book, folder, writer)
+            write_combined(folder, handles, folder + ".vcf")
+        c.disconnect()
+        if writer is not None:
+            writer.close()
+        return 0
+
     # dump the phone book and other folders
-    dump_dir(c, prefix+"telecom/pb", dest_dir+prefix+"telecom/pb")
-    dump_dir(c, prefix+"telecom/ich", dest_dir+prefix+"telecom/ich")
-    dump_dir(c, prefix+"telecom/och", dest_dir+prefix+"telecom/och")
-    dump_dir(c, prefix+"telecom/mch", dest_dir+prefix+"telecom/mch")
-    dump_dir(c, prefix+"telecom/cch", dest_dir+prefix+"telecom/cch")
+    dump_dir(c, prefix+"telecom/pb", dest_dir+prefix+"telecom/pb", writer)
+    dump_dir(c, prefix+"telecom/ich", dest_dir+prefix+"telecom/ich", writer)
+    dump_dir(c, prefix+"telecom/och", dest_dir+prefix+"telecom/och", writer)
+    dump_dir(c, prefix+"telecom/mch", dest_dir+prefix+"telecom/mch", writer)
+    dump_dir(c, prefix+"telecom/cch", dest_dir+prefix+"telecom/cch", writer)
 
     # dump the combined vcards
-    c.setpath(prefix + "telecom")
+    c.chdir("/" + prefix + "telecom")
     get_file(c, "pb.vcf", dest_dir+prefix+"telecom/pb.vcf",
             folder_name=prefix+"telecom", book=True)
     get_file(c, "ich.vcf", dest_dir+prefix+"telecom/ich.vcf",
@@ -127,6 +313,8 @@ def main(argv):
             folder_name=prefix+"telecom", book=True)
 
     c.disconnect()
+    if writer is not None:
+        writer.close()
     return 0
 
 if __name__ == "__main__":
@@ -15,12 +15,12 @@ from nOBEX.common import OBEXError
 from clients.opp import OPPClient
 
 def main(argv):
-    if len(argv) != 3:
-        sys.stderr.write("Usage: %s <device address> <file name>\n" % argv[0])
+    if len(argv) < 3:
+        sys.stderr.write("Usage: %s <device address> <file name>...\n" % argv[0])
         return -1
 
     device_address = sys.argv[1]
-    file_name = sys.argv[2]
+    file_names = sys.argv[2:]
 
     c = OPPClient(device_address)
 
@@ -31,10 +31,20 @@ def main(argv):
         traceback.print_exc()
         return -1
 
-    c.put(file_name, open(file_name, 'rb').read())
+    report = c.push_many(file_names)
     c.disconnect()
 
-    return 0
+    for r in report.results:
+        if r.ok:
+            print("%s: %i bytes in %.2f s (%.1f KiB/s)" % (r.path, r.size,
+                r.seconds, r.rate / 1024))
+        else:
+            print("%s: failed (%s)" % (r.path, r.error))
+    print("%i of %i files, %i bytes in %.2f s (%.1f KiB/s)" % (
+        len(report.results) - len(report.failed), len(report.results),
+        report.size, report.seconds, report.rate / 1024))
+
+    return 1 if report.failed else 0
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
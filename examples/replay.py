@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+# Replays sessions recorded with "multiserver.py --record" against a local
+# server instance from many concurrent connections, and reports throughput,
+# latency percentiles and response mismatches.
+
+import json, sys
+from nOBEX.replay import Recording, replay
+from servers.ftp import FTPServer
+from servers.map import MAPServer
+from servers.pbap import PBAPServer
+
+server_classes = {
+    "--ftp": FTPServer,
+    "--map": MAPServer,
+    "--pbap": PBAPServer
+}
+
+def usage(argv):
+    sys.stderr.write("Usage: %s (--ftp|--map|--pbap) root " % argv[0])
+    sys.stderr.write("[-n connections] [-r repeat] recording...\n")
+
+def main(argv):
+    args = argv[1:]
+    serv_class = None
+    root = None
+    connections = 1
+    repeat = 1
+    paths = []
+
+    try:
+        while len(args):
+            a = args.pop(0)
+            if a in server_classes:
+                serv_class = server_classes[a]
+                root = args.pop(0)
+            elif a == "-n":
+                connections = int(args.pop(0))
+            elif a == "-r":
+                repeat = int(args.pop(0))
+            else:
+                paths.append(a)
+    except (IndexError, ValueError):
+        usage(argv)
+        return -1
+
+    if serv_class is None or len(paths) == 0:
+        usage(argv)
+        return -1
+
+    recordings = [Recording.load(p) for p in paths]
+    report = replay(lambda: serv_class(root), recordings, connections, repeat)
+    print(json.dumps(report.summary(), indent=2, sort_keys=True))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -8,9 +8,12 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
-import os, stat, sys
+import logging, os, stat, sys
 from nOBEX import headers, requests, responses, server
 from datetime import datetime
+from xml.sax.saxutils import quoteattr
+
+logger = logging.getLogger(__name__)
 
 def unix2bluetime(unix_time):
     t = datetime.fromtimestamp(unix_time)
@@ -22,13 +25,15 @@ def gen_folder_listing(path):
 
     for i in l:
         objpath = os.path.join(path, i)
-        if os.path.isdir(objpath):
-            args = (i, unix2bluetime(os.stat(objpath)[stat.ST_CTIME]))
-            s += '  <folder name="%s" created="%s" />' % args
+        st = os.stat(objpath)
+        if stat.S_ISDIR(st.st_mode):
+            args = (quoteattr(i), unix2bluetime(st.st_ctime),
+                    unix2bluetime(st.st_mtime))
+            s += '  <folder name=%s created="%s" modified="%s" />' % args
         else:
-            args = (i, unix2bluetime(os.stat(objpath)[stat.ST_CTIME]),
-                    os.stat(objpath)[stat.ST_SIZE])
-            s += '  <file name="%s" created="%s" size="%s" />' % args
+            args = (quoteattr(i), unix2bluetime(st.st_ctime),
+                    unix2bluetime(st.st_mtime), st.st_size)
+            s += '  <file name=%s created="%s" modified="%s" size="%s" />' % args
 
     s += "</folder-listing>\n"
 
@@ -37,66 +42,102 @@ def gen_folder_listing(path):
 
     return s
 
+def gen_body_headers(data, csize=65500):
+    """Generate a list of body headers (to encapsulate large data)"""
+    hdrs = []
+    i = 0
+    while i < len(data):
+        chunk = data[i:i+csize]
+        if len(data) - i > csize:
+            hdrs.append(headers.Body(chunk))
+        else:
+            hdrs.append(headers.End_Of_Body(chunk))
+        i += csize
+    return hdrs
+
 class FTPServer(server.Server):
     """OBEX File Transfer Profile Server"""
 
     def __init__(self, directory, address=None):
         super(FTPServer, self).__init__(address)
-        self.directory = os.path.abspath(directory)
+        self.directory = os.path.abspath(directory).rstrip(os.sep)
         if not os.path.exists(self.directory):
             os.mkdir(self.directory)
+        self.cur_directory = self.directory
 
     def start_service(self, port=None):
         return super(FTPServer, self).start_service("ftp", port)
 
+    def _inside(self, path):
+        return path == self.directory or \
+                path.startswith(self.directory + os.sep)
+
+    def connect(self, socket, request):
+        self.cur_directory = self.directory
+        super(FTPServer, self).connect(socket, request)
+
     def get(self, socket, request):
         name = ""
-        type = ""
+        type = b""
 
+        debug = logger.isEnabledFor(logging.DEBUG)
         for header in request.header_data:
-            print(header)
+            if debug:
+                logger.debug("%r", header)
             if isinstance(header, headers.Name):
-                name = header.decode().strip(b"\x00")
-                print("Receiving request for %s" % name)
+                name = header.decode().strip("\x00")
+                logger.debug("Receiving request for %s", name)
 
             elif isinstance(header, headers.Type):
                 type = header.decode().strip(b"\x00")
-                print("Type %s" % type)
+                logger.debug("Type %s", type)
 
-        path = os.path.abspath(os.path.join(self.directory, name))
-
-        if os.path.isdir(path) or type == "x-obex/folder-listing":
-            if path.startswith(self.directory):
-                s = gen_folder_listing(path)
-                print(s)
+        path = os.path.abspath(os.path.join(self.cur_directory, name))
+        if not self._inside(path):
+            self._reject(socket)
+            return
 
-                response = responses.Success()
-                response_headers = [headers.Name(name),
-                        headers.Length(len(s)),
-                        headers.Body(s.encode("utf8"))]
-                self.send_response(socket, response, response_headers)
-            else:
+        if os.path.isdir(path) or type == b"x-obex/folder-listing":
+            try:
+                s = gen_folder_listing(path).encode("utf8")
+            except OSError:
+                self._reject(socket)
+                return
+            logger.debug("%s", s)
+        elif os.path.isfile(path):
+            try:
+                with open(path, "rb") as f:
+                    s = f.read()
+            except IOError:
+                logger.error("failed to open file %s", path)
                 self._reject(socket)
+                return
         else:
-            self._reject(socket)
+            self.send_response(socket, responses.Not_Found())
+            return
+
+        response = responses.Success()
+        response_headers = [headers.Name(name), headers.Length(len(s))] + \
+                gen_body_headers(s, self._max_length() - 50)
+        self.send_response(socket, response, response_headers)
 
     def put(self, socket, request):
         name = ""
         length = 0
-        body = ""
+        body = []
 
         while True:
             for header in request.header_data:
                 if isinstance(header, headers.Name):
-                    name = header.decode()
-                    print("Receiving", name)
+                    name = header.decode().strip("\x00")
+                    logger.debug("Receiving %s", name)
                 elif isinstance(header, headers.Length):
                     length = header.decode()
-                    print("Length", length)
+                    logger.debug("Length %i", length)
                 elif isinstance(header, headers.Body):
-                    body += header.decode()
+                    body.append(header.decode())
                 elif isinstance(header, headers.End_Of_Body):
-                    body += header.decode()
+                    body.append(header.decode())
 
             if request.is_final():
                 break
@@ -106,12 +147,51 @@ class FTPServer(server.Server):
 
             # Get the next part of the data.
             request = self.request_handler.decode(socket)
+            if self._aborted(socket, request):
+                return
+
+        name = os.path.basename(name)
+        path = os.path.join(self.cur_directory, name)
+        if not name or not self._inside(path):
+            self._reject(socket)
+            return
 
         self.send_response(socket, responses.Success())
+        logger.debug("Writing %r", path)
+        with open(path, "wb") as f:
+            f.write(b"".join(body))
+
+    def set_path(self, socket, request):
+        name = ""
+        for header in request.header_data:
+            if isinstance(header, headers.Name):
+                name = header.decode().strip("\x00")
+
+        if request.flags & requests.Set_Path.NavigateToParent:
+            # back up a level, then enter the named folder if there is one
+            path = os.path.dirname(self.cur_directory)
+            if name:
+                path = os.path.abspath(os.path.join(path, name))
+        elif len(name) == 0:
+            path = self.directory
+        else:
+            path = os.path.abspath(os.path.join(self.cur_directory, name))
 
-        name = name.strip(b"\x00").encode(sys.getfilesystemencoding())
-        name = os.path.split(name)[1]
-        path = os.path.join(self.directory, name)
-        print("Writing", repr(path))
+        path = path.rstrip(os.sep)
+        if not self._inside(path):
+            self._reject(socket)
+            return
+
+        if not os.path.isdir(path):
+            if request.flags & requests.Set_Path.DontCreateDir:
+                self.send_response(socket, responses.Not_Found())
+                return
+            try:
+                os.mkdir(path)
+            except OSError:
+                self._reject(socket)
+                return
 
-        open(path, "wb").write(body)
+        logger.debug("moving to %s", path)
+        self.cur_directory = path
+        self.send_response(socket, responses.Success())
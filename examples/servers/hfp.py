@@ -9,9 +9,11 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
-import re, socket, threading, time
+import logging, re, socket, threading, time
 from nOBEX import server, bluez_helper
 
+logger = logging.getLogger(__name__)
+
 error_resp = b'ERROR'
 
 default_beast_table = {
@@ -63,6 +65,135 @@ regex_beast_table = {
     b'AT\+CREG=[0-9]+': None
 }
 
+class ATDispatcher(object):
+    """Maps AT commands to their automatic responses.
+
+    Exact commands are looked up in a dictionary. Regex commands are compiled
+    into a single alternation, so an unknown command costs one regex match
+    rather than one per pattern. The tables are replaced as a whole on every
+    update, so lookups never need to take the lock.
+
+    Match latency is accumulated per table entry, and per command for
+    commands nothing matched, and can be read back with stats(). Each thread
+    keeps its own counters, merged when they are read, so counting does not
+    take the lock either.
+    """
+
+    # distinct unknown commands counted per thread before the rest are
+    # counted together, so a flood of junk commands cannot grow the stats
+    # without bound
+    max_unknown = 1024
+
+    def __init__(self, exact_table=default_beast_table,
+            regex_table=regex_beast_table):
+        self._lock = threading.Lock()
+        self._exact = dict(exact_table)
+        self._regex = dict(regex_table)
+        self._tables = None
+        self._local = threading.local()
+        self._thread_stats = []
+        self._compile()
+
+    def _compile(self):
+        patterns = list(self._regex)
+        if patterns:
+            alts = [b'(?P<r%i>%s)' % (i, p) for i, p in enumerate(patterns)]
+            combined = re.compile(b'|'.join(alts))
+        else:
+            combined = None
+        resps = dict(("r%i" % i, (p, self._regex[p]))
+                for i, p in enumerate(patterns))
+        self._tables = (dict(self._exact), combined, resps)
+
+    def set_response(self, cmd, resp):
+        """Set the response for an exact AT command"""
+        with self._lock:
+            self._exact[cmd] = resp
+            self._compile()
+
+    def set_regex_response(self, pattern, resp):
+        """Set the response for all AT commands matching a regex"""
+        re.compile(pattern) # raise on bad patterns before installing them
+        with self._lock:
+            self._regex[pattern] = resp
+            self._compile()
+
+    def lookup(self, cmd):
+        """Returns a tuple of (entry, response) for the command. The entry is
+        the exact command or regex pattern that matched, or None if nothing
+        matched."""
+        t = time.perf_counter()
+        exact, combined, resps = self._tables
+        if cmd in exact:
+            entry, resp = cmd, exact[cmd]
+        else:
+            m = combined.match(cmd) if combined else None
+            if m:
+                entry, resp = resps[m.lastgroup]
+            else:
+                entry, resp = None, None
+        self._record(entry, cmd, time.perf_counter() - t)
+        return entry, resp
+
+    def is_regex(self, entry):
+        return entry is not None and entry not in self._tables[0]
+
+    def _record(self, entry, cmd, elapsed):
+        stats = getattr(self._local, "stats", None)
+        if stats is None:
+            stats = self._local.stats = {}
+            self._local.unknown = 0
+            with self._lock:
+                self._thread_stats.append(stats)
+
+        key = entry
+        if entry is None:
+            key = (None, cmd)
+            if key not in stats:
+                if self._local.unknown >= self.max_unknown:
+                    key = (None, None)
+                else:
+                    self._local.unknown += 1
+
+        st = stats.get(key)
+        if st is None:
+            st = stats[key] = [0, 0.0, 0.0]
+        st[0] += 1
+        st[1] += elapsed
+        if elapsed > st[2]: st[2] = elapsed
+
+    def stats(self):
+        """Returns a dict of entry -> (count, mean seconds, max seconds).
+        Commands nothing matched appear under (None, command), or once too
+        many distinct ones were seen, together under (None, None)."""
+        with self._lock:
+            thread_stats = list(self._thread_stats)
+        merged = {}
+        for stats in thread_stats:
+            for e, (c, tot, mx) in stats.copy().items():
+                m = merged.get(e)
+                if m is None:
+                    merged[e] = [c, tot, mx]
+                else:
+                    m[0] += c
+                    m[1] += tot
+                    m[2] = max(m[2], mx)
+        return dict((e, (c, tot / c, mx))
+                for e, (c, tot, mx) in merged.items() if c)
+
+    def format_stats(self):
+        lines = []
+        for e, (c, mean, mx) in sorted(self.stats().items(),
+                key=lambda i: -i[1][0]):
+            if isinstance(e, tuple):
+                name = b'<unknown> ' + (e[1] if e[1] is not None else
+                        b'<other>')
+            else:
+                name = e
+            lines.append(b'%s count=%i mean_us=%.1f max_us=%.1f\n' % (
+                name, c, mean * 1e6, mx * 1e6))
+        return b''.join(lines)
+
 class HFPMessageHandler(object):
     def decode(self, sock):
         msg = bytearray()
@@ -70,7 +201,7 @@ class HFPMessageHandler(object):
             try:
                 msg.extend(sock.recv(1))
             except ConnectionResetError:
-                print("connection reset")
+                logger.info("connection reset")
                 return None
         return bytes(msg)
 
@@ -79,17 +210,17 @@ class HFPServer(server.Server):
         """beast_file is a bbeast format AT command response table file"""
         super(HFPServer, self).__init__(address)
         self.request_handler = HFPMessageHandler()
-        self.resp_dict = default_beast_table
+        self.dispatcher = ATDispatcher()
         if beast_file: self._load_beast(beast_file)
         self.conn = None
         self.write_lock = threading.Lock()
-        self.commander = ATCommander(self.external_sock_send)
+        self.commander = ATCommander(self.external_sock_send, self.dispatcher)
         self.commander.start()
 
     def start_service(self, port=3):
         # we don't actually listen on a socket for HFP
         bluez_helper.advertise_service("hfag", port)
-        print("Advertising HFP on port %i" % port)
+        logger.info("Advertising HFP on port %i", port)
         return None
 
     def _load_beast(self, beast_file):
@@ -97,8 +228,8 @@ class HFPServer(server.Server):
         for l in lines:
             cmd, resp = l.strip().split(b'\t')
             if resp == b'OK': resp = None
-            self.resp_dict[cmd] = resp
-        print(self.resp_dict)
+            self.dispatcher.set_response(cmd, resp)
+        logger.info("Loaded %i AT responses from %s", len(lines), beast_file)
 
     @staticmethod
     def _connect_hfp(address, port=None, control_chan=True, audio_chan=True):
@@ -108,7 +239,7 @@ class HFPServer(server.Server):
         if control_chan:
             if port is None:
                 port = bluez_helper.find_service("hf", address)
-            print("HFP connecting to %s on port %i" % (address, port))
+            logger.info("HFP connecting to %s on port %i", address, port)
             connection = bluez_helper.BluetoothSocket()
             time.sleep(0.5)
             connection.connect((address, port))
@@ -119,9 +250,9 @@ class HFPServer(server.Server):
             try:
                 asock.connect(bytes(address, encoding="UTF-8"))
             except ConnectionRefusedError:
-                print("Connection refused for audio socket")
+                logger.warning("Connection refused for audio socket")
             else:
-                print("HFP SCO audio socket established")
+                logger.info("HFP SCO audio socket established")
 
         return connection
 
@@ -144,12 +275,12 @@ class HFPServer(server.Server):
         while True:
             devs = bluez_helper.list_paired_devices()
             for address in devs:
-                print("hfp trying", address)
+                logger.info("hfp trying %s", address)
                 try:
                     port = bluez_helper.find_service("hf", address)
                 except bluez_helper.SDPException:
                     continue
-                print("HFP HF found on port %i of %s" % (port, address))
+                logger.info("HFP HF found on port %i of %s", port, address)
                 connection = self._connect_hfp(address, port)
                 self.conn = connection
 
@@ -171,31 +302,25 @@ class HFPServer(server.Server):
             self._reply(self.conn, msg, False)
 
     def process_request(self, sock, cmd):
-        print("received AT cmd: %s" % cmd)
+        logger.debug("received AT cmd: %r", cmd)
         cmd = cmd.strip()
 
         # We connected to wrong device or at wrong time, need to re-connect
         if len(cmd) == 0:
             return
         elif cmd == b'ERROR':
-            print("Peer reports AT ERROR, wants reconnect. Be patient.")
+            logger.warning("Peer reports AT ERROR, wants reconnect. Be patient.")
             self.connected = False
             return
 
-        if cmd in self.resp_dict:
-            print("known command, resp: %s" % repr(self.resp_dict[cmd]))
-            self._reply(sock, self.resp_dict[cmd])
+        entry, resp = self.dispatcher.lookup(cmd)
+        if entry is None:
+            logger.debug("new command, no response (just OK)")
+        elif self.dispatcher.is_regex(entry):
+            logger.debug("known regex command, resp %r", resp)
         else:
-            match_found = False
-            for rx in regex_beast_table:
-                if re.match(rx, cmd):
-                    print("known regex command, resp %s" % repr(regex_beast_table[rx]))
-                    self._reply(sock, regex_beast_table[rx])
-                    match_found = True
-                    break
-            if not match_found:
-                print("new command, no response (just OK)")
-                self._reply(sock, None)
+            logger.debug("known command, resp: %r", resp)
+        self._reply(sock, resp)
 
     def _reply(self, sock, resp, ok=True):
         try:
@@ -206,10 +331,10 @@ class HFPServer(server.Server):
                 msg += b'\r\nOK\r\n'
             sock.sendall(msg)
         except BaseException as e:
-            print("failure writing AT cmd response")
+            logger.error("failure writing AT cmd response")
 
 class ATCommander(threading.Thread):
-    def __init__(self, write_cback):
+    def __init__(self, write_cback, dispatcher):
         super(ATCommander, self).__init__(daemon=True)
         self._sock = socket.socket()
         self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -217,6 +342,7 @@ class ATCommander(threading.Thread):
         self._conn = None
         self._conn_lock = threading.Lock()
         self.wcb = write_cback
+        self.dispatcher = dispatcher
 
     def run(self):
         self._sock.listen(0)
@@ -229,7 +355,7 @@ class ATCommander(threading.Thread):
                 while True:
                     self.process_cmd(conn_file.readline().strip())
             except IOError as e:
-                print(e) # handle connection close
+                logger.info("%s", e) # handle connection close
 
     def process_cmd(self, cmd):
         if cmd.startswith(b'send'):
@@ -243,10 +369,23 @@ class ATCommander(threading.Thread):
             try:
                 atcmd = cmd.split(b' ')[1]
                 atrsp = cmd[5 + len(atcmd) + 1:]
-                default_beast_table[atcmd] = atrsp
+                self.dispatcher.set_response(atcmd, atrsp)
             except:
                 with self._conn_lock:
                     self._conn.sendall(b'syntax error!\n')
+        elif cmd.startswith(b'urgx'): # update regex auto response
+            """syntax: urgx AT_CMD_REGEX AT_RSP
+            same as ursp, but the command is a regex like in regex_beast_table"""
+            try:
+                atcmd = cmd.split(b' ')[1]
+                atrsp = cmd[5 + len(atcmd) + 1:]
+                self.dispatcher.set_regex_response(atcmd, atrsp)
+            except:
+                with self._conn_lock:
+                    self._conn.sendall(b'syntax error!\n')
+        elif cmd.startswith(b'stat'): # report match latency
+            with self._conn_lock:
+                self._conn.sendall(self.dispatcher.format_stats())
         else:
             with self._conn_lock:
                 self._conn.sendall(b'unknown command!\n')
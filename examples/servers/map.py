@@ -9,9 +9,12 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
-import os, socket, sys
+import logging, os, sys, time
 from nOBEX import headers, requests, responses, server
 from .ftp import gen_folder_listing
+from .messages import MessageStore
+
+logger = logging.getLogger(__name__)
 
 def gen_handle():
     """Generate a random 64 bit hex handle"""
@@ -36,11 +39,28 @@ def gen_body_headers(data, csize=65500):
     return hdrs
 
 
+# listing parameters that need the message store to answer
+_listing_params = ("MaxListCount", "StartOffset", "FilterMessageType",
+        "FilterPeriodBegin", "FilterPeriodEnd", "FilterReadStatus",
+        "FilterRecipient", "FilterOriginator", "FilterPriority",
+        "SubjectLength")
+
 class MAPServer(server.Server):
-    def __init__(self, directory, address=None):
+    """MAPServer(directory, address=None, store=None)
+
+    Serves the messages saved under directory. Message listings requested
+    with paging or filter application parameters are answered from a
+    MessageStore, while plain requests get mlisting.xml exactly as saved.
+    Pass store to share one MessageStore between several servers.
+    """
+
+    def __init__(self, directory, address=None, store=None):
         super(MAPServer, self).__init__(address)
         self.directory = os.path.abspath(directory).rstrip(os.sep)
         self.cur_directory = self.directory
+        if store is None:
+            store = MessageStore(self.directory)
+        self.store = store
 
     def start_service(self, port=4):
         return super(MAPServer, self).start_service("map", port)
@@ -48,29 +68,37 @@ class MAPServer(server.Server):
     def get(self, socket, request):
         name = ''
         mimetype = b''
+        params = {}
 
-        print("\nget")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("get")
         for header in request.header_data:
-            print(header)
+            if debug:
+                logger.debug("%r", header)
             if isinstance(header, headers.Name):
                 name = header.decode().strip('\x00')
-                print("Receiving request for %s" % name)
+                logger.debug("Receiving request for %s", name)
             elif isinstance(header, headers.Type):
                 mimetype = header.decode().strip(b'\x00')
-                print("Type %s" % mimetype)
+                logger.debug("Type %s", mimetype)
             elif isinstance(header, headers.App_Parameters):
-                print("App parameters: %s" % header.data)
+                params = header.decode(headers.MAP_APP_PARAMS)
+                logger.debug("App parameters: %r", params)
 
         path = os.path.abspath(os.path.join(self.cur_directory, name))
         if not path.startswith(self.directory):
             self._reject(socket)
             return
 
-        if os.path.isdir(path) and mimetype == b'x-bt/MAP-msg-listing':
+        if os.path.isdir(path) and mimetype == b'x-bt/MAP-msg-listing' and \
+                any(p in params for p in _listing_params):
+            self._send_listing(socket, path, params)
+        elif os.path.isdir(path) and mimetype == b'x-bt/MAP-msg-listing':
             try:
                 listing = open(path + "/mlisting.xml", 'rb')
             except IOError:
-                sys.stderr.write("failed to open listing for %s\n" % path)
+                logger.error("failed to open listing for %s", path)
                 self._reject(socket)
                 return
             s = listing.read()
@@ -90,7 +118,7 @@ class MAPServer(server.Server):
             try:
                 fd = open(path, 'rb')
             except IOError:
-                sys.stderr.write("failed to open message %s" % path)
+                logger.error("failed to open message %s", path)
                 self._reject(socket)
                 return
             s = fd.read()
@@ -103,28 +131,51 @@ class MAPServer(server.Server):
         else:
             self._reject(socket)
 
+    def _send_listing(self, socket, path, params):
+        folder = os.path.relpath(path, self.directory).replace(os.sep, "/")
+        result = self.store.listing(folder, params)
+        if result is None:
+            self._reject(socket)
+            return
+        s, size, new_message = result
+
+        app_params = headers.App_Parameters({
+            "NewMessage": new_message,
+            "MessagesListingSize": min(size, 0xFFFF),
+            "MSETime": time.strftime("%Y%m%dT%H%M%S%z")
+        }, tags=headers.MAP_APP_PARAMS)
+
+        response = responses.Success()
+        if params.get("MaxListCount") == 0:
+            # only the listing size was asked for
+            self.send_response(socket, response, [app_params])
+        else:
+            response_headers = [app_params, headers.Length(len(s))] + \
+                    gen_body_headers(s, self._max_length() - 100)
+            self.send_response(socket, response, response_headers)
+
     def put(self, socket, request):
         name = ""
         length = 0
         body = b''
         mimetype = b''
 
-        print("\nput")
+        logger.debug("put")
         while True:
             for header in request.header_data:
                 if isinstance(header, headers.Name):
                     name = header.decode()
-                    print("Receiving", name)
+                    logger.debug("Receiving %s", name)
                 elif isinstance(header, headers.Length):
                     length = header.decode()
-                    print("Length", length)
+                    logger.debug("Length %i", length)
                 elif isinstance(header, headers.Body):
                     body += header.decode()
                 elif isinstance(header, headers.End_Of_Body):
                     body += header.decode()
                 elif isinstance(header, headers.Type):
                     mimetype = header.decode().strip(b'\x00')
-                    print("Type %s" % mimetype)
+                    logger.debug("Type %s", mimetype)
 
             if request.is_final():
                 break
@@ -134,47 +185,54 @@ class MAPServer(server.Server):
 
             # Get the next part of the data.
             request = self.request_handler.decode(socket)
+            if self._aborted(socket, request):
+                return
 
         resp_headers = []
 
         if mimetype == b'x-bt/MAP-event-report':
-            print("MAP event", body)
+            logger.info("MAP event %r", body)
         elif mimetype == b'x-bt/MAP-NotificationRegistration':
-            print("MAP register for notifications")
+            logger.info("MAP register for notifications")
         elif mimetype == b'x-bt/messageStatus':
-            print("set message status")
+            logger.info("set message status")
         elif mimetype == b'x-bt/message':
             name = name.strip('\x00')
             name = os.path.split(name)[-1]
             path = os.path.join(self.cur_directory, name)
             path = os.path.join(path, gen_handle())
             path = os.path.abspath(path)
-            print("Push message", repr(path))
+            logger.info("Push message %r", path)
             open(path, "wb").write(body)
             resp_headers.append(headers.Name(name))
         elif mimetype == b'x-bt/MAP-messageUpdate':
-            print("MAP inbox update requested")
+            logger.info("MAP inbox update requested")
 
         self.send_response(socket, responses.Success(), resp_headers)
 
     def set_path(self, socket, request):
+        name = ''
+        for header in request.header_data:
+            if isinstance(header, headers.Name):
+                name = header.decode().strip('\x00')
+
         if request.flags & requests.Set_Path.NavigateToParent:
+            # back up a level, then enter the named folder if there is one
             path = os.path.dirname(self.cur_directory)
+            if name:
+                path = os.path.abspath(os.path.join(path, name))
+        elif len(name) == 0 and (
+                request.flags & requests.Set_Path.DontCreateDir):
+            # see bluetooth PBAP spec section 5.3 PullvCardListing Function
+            path = self.directory
         else:
-            header = request.header_data[0]
-            name = header.decode().strip('\x00')
-            if len(name) == 0 and (
-                    request.flags & requests.Set_Path.DontCreateDir):
-                # see bluetooth PBAP spec section 5.3 PullvCardListing Function
-                path = self.directory
-            else:
-                path = os.path.abspath(os.path.join(self.cur_directory, name))
+            path = os.path.abspath(os.path.join(self.cur_directory, name))
 
         path = path.rstrip(os.sep)
         if not path.startswith(self.directory):
             self._reject(socket)
             return
 
-        print("moving to %s" % path)
+        logger.debug("moving to %s", path)
         self.cur_directory = path
         self.send_response(socket, responses.Success())
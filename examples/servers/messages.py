@@ -0,0 +1,387 @@
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+import html, logging, os, re, sqlite3, threading, time
+from xml.sax.saxutils import quoteattr
+from nOBEX import bmessage
+
+logger = logging.getLogger(__name__)
+
+# FilterMessageType bits, each excluding one message type when set
+MESSAGE_TYPE_BITS = (("SMS_GSM", 0x01), ("SMS_CDMA", 0x02), ("EMAIL", 0x04),
+        ("MMS", 0x08), ("IM", 0x10))
+
+READ_STATUS_UNREAD = 1
+READ_STATUS_READ = 2
+
+PRIORITY_HIGH = 1
+PRIORITY_NON_HIGH = 2
+
+# MaxListCount when a request leaves it out
+DEFAULT_MAX_LIST_COUNT = 1024
+
+# page end positions remembered per listing query
+_MAX_PAGE_MARKS = 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    dir_mtime REAL,
+    listing_mtime REAL,
+    head BLOB,
+    tail BLOB,
+    sep BLOB
+);
+CREATE TABLE IF NOT EXISTS messages (
+    folder TEXT,
+    handle TEXT,
+    datetime TEXT,
+    type TEXT,
+    read INTEGER,
+    priority INTEGER,
+    subject TEXT,
+    sender TEXT,
+    recipient TEXT,
+    element BLOB,
+    listed INTEGER,
+    file_mtime REAL,
+    file_size INTEGER,
+    PRIMARY KEY (folder, handle)
+);
+CREATE INDEX IF NOT EXISTS messages_by_date
+    ON messages (folder, datetime DESC, handle, type, read, priority);
+CREATE INDEX IF NOT EXISTS messages_by_read
+    ON messages (folder, read, datetime DESC, handle, type, priority);
+"""
+
+_msg_elem_re = re.compile(rb'<msg\b[^>]*/>|<msg\b.*?</msg>', re.S)
+_attr_re = re.compile(r'([\w-]+)\s*=\s*"([^"]*)"')
+_subject_re = re.compile(rb'(\bsubject\s*=\s*)("[^"]*"|\'[^\']*\')')
+
+_default_head = b'<MAP-msg-listing version="1.0">\n    '
+_default_tail = b'\n</MAP-msg-listing>\n'
+_default_sep = b'\n    '
+
+def _yes(value):
+    return 1 if value.strip().lower() == "yes" else 0
+
+def _card_details(card):
+    return " ".join(prop.value.strip() for prop in card
+            if prop.name in ("N", "FN", "TEL", "EMAIL")
+            and isinstance(prop.value, str))
+
+def parse_bmessage(data):
+    """Extracts listing details from a raw bMessage: its type, read status,
+    originator, recipient, length and a subject. Missing details are left
+    empty, since saved messages may be malformed on purpose."""
+    info = {"type": "", "read": 0, "sender": "", "recipient": "",
+            "size": "0", "subject": ""}
+    msg = bmessage.parse(data)
+    if msg is None:
+        return info
+
+    info["type"] = msg.type.strip()
+    info["read"] = 1 if msg.status.strip().upper() == "READ" else 0
+    info["size"] = msg.body.get("LENGTH", "0")
+
+    # the first vCard is the originator, the last one the recipient
+    vcards = msg.originators + [c for env in msg.envelopes for c in env]
+    if vcards:
+        info["sender"] = _card_details(vcards[0])
+    if len(vcards) > 1:
+        info["recipient"] = _card_details(vcards[-1])
+    body = [line.strip() for line in msg.text.splitlines()]
+    for line in body:
+        if line.lower().startswith("subject:"):
+            info["subject"] = line[8:].strip()
+            break
+    else:
+        info["subject"] = body[0] if body else ""
+    return info
+
+class MessageStore(object):
+    """MessageStore(directory, db_path=":memory:")
+
+    Indexes the messages under a MAP root directory (as saved by
+    mapclient.py) into a SQLite database, so that filtered and paged message
+    listings are answered by indexed queries.
+
+    Messages come from the mlisting.xml of each folder, with their listing
+    elements kept byte for byte, and from bMessage files missing from the
+    listing, whose details are read from the bMessage itself. Pass a file
+    as db_path to keep the index between runs; only folders and files that
+    changed since are indexed again.
+
+    Before each listing, the folder and its mlisting.xml are checked for
+    changes with two stat calls, and reindexed if needed. This catches
+    messages being added or removed, such as by a push from the client.
+    Messages edited in place are only picked up by refresh().
+    """
+
+    def __init__(self, directory, db_path=":memory:"):
+        self.directory = os.path.abspath(directory)
+        self._lock = threading.Lock()
+        # listing size and page end positions by query, per folder, dropped
+        # whenever the folder is reindexed
+        self._queries = {}
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript(_SCHEMA)
+        self.refresh()
+
+    def refresh(self):
+        """Indexes every folder that changed since it was last indexed"""
+        seen = set()
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            folder = os.path.relpath(dirpath, self.directory).replace(os.sep, "/")
+            if folder == ".":
+                continue
+            seen.add(folder)
+            self.sync_folder(folder, True)
+
+        with self._lock, self.db:
+            for (folder,) in self.db.execute("SELECT folder FROM folders").fetchall():
+                if folder not in seen:
+                    self.db.execute("DELETE FROM folders WHERE folder = ?", (folder,))
+                    self.db.execute("DELETE FROM messages WHERE folder = ?", (folder,))
+
+    def _stat_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def sync_folder(self, folder, check_files=False):
+        """Reindexes a folder if it or its listing changed, and with
+        check_files, any message files whose size or modification time
+        changed. Returns False if the folder does not exist."""
+        path = os.path.join(self.directory, folder)
+        dir_mtime = self._stat_mtime(path)
+        if dir_mtime is None:
+            return False
+        listing_path = os.path.join(path, "mlisting.xml")
+        listing_mtime = self._stat_mtime(listing_path)
+
+        with self._lock:
+            row = self.db.execute("SELECT dir_mtime, listing_mtime FROM folders "
+                    "WHERE folder = ?", (folder,)).fetchone()
+        if row is not None and row == (dir_mtime, listing_mtime):
+            if check_files:
+                self._sync_files(folder, path)
+            return True
+
+        head, tail, sep = _default_head, _default_tail, _default_sep
+        listed = {}
+        if listing_mtime is not None:
+            with open(listing_path, "rb") as f:
+                raw = f.read()
+            matches = list(_msg_elem_re.finditer(raw))
+            if matches:
+                head = raw[:matches[0].start()]
+                tail = raw[matches[-1].end():]
+                if len(matches) > 1:
+                    sep = raw[matches[0].end():matches[1].start()]
+            for m in matches:
+                attrs = dict(_attr_re.findall(
+                    m.group(0).decode("utf-8", "replace")))
+                if "handle" in attrs and attrs["handle"] not in listed:
+                    listed[attrs["handle"]] = (m.group(0), attrs)
+
+        rows = []
+        for handle, (element, attrs) in listed.items():
+            rows.append((folder, handle, attrs.get("datetime", ""),
+                attrs.get("type", ""), _yes(attrs.get("read", "no")),
+                _yes(attrs.get("priority", "no")), attrs.get("subject", ""),
+                " ".join((attrs.get("sender_name", ""),
+                    attrs.get("sender_addressing", ""))),
+                " ".join((attrs.get("recipient_name", ""),
+                    attrs.get("recipient_addressing", ""))),
+                element, 1, None, None))
+
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM messages WHERE folder = ? AND listed = 1",
+                    (folder,))
+            self.db.executemany("INSERT OR REPLACE INTO messages VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.execute("INSERT OR REPLACE INTO folders VALUES "
+                    "(?, ?, ?, ?, ?, ?)", (folder, dir_mtime, listing_mtime,
+                        head, tail, sep))
+            self._queries.pop(folder, None)
+        self._sync_files(folder, path)
+        logger.debug("indexed %s", folder)
+        return True
+
+    def _sync_files(self, folder, path):
+        """Indexes the bMessage files not covered by the listing whose size
+        or modification time changed"""
+        with self._lock:
+            known = dict((h, (m, s)) for h, m, s in self.db.execute(
+                "SELECT handle, file_mtime, file_size FROM messages "
+                "WHERE folder = ? AND listed = 0", (folder,)))
+
+        rows = []
+        present = set()
+        for fname in os.listdir(path):
+            if fname.startswith(".") or fname == "mlisting.xml":
+                continue
+            fpath = os.path.join(path, fname)
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                continue
+            if not os.path.isfile(fpath):
+                continue
+            present.add(fname)
+            if known.get(fname) == (st.st_mtime, st.st_size):
+                continue
+            with self._lock:
+                if fname not in known and self.db.execute("SELECT 1 FROM "
+                        "messages WHERE folder = ? AND handle = ?",
+                        (folder, fname)).fetchone():
+                    # described by the listing
+                    continue
+            with open(fpath, "rb") as f:
+                info = parse_bmessage(f.read())
+            dt = time.strftime("%Y%m%dT%H%M%S", time.localtime(st.st_mtime))
+            element = b'<msg handle=%s subject=%s datetime="%s" type=%s ' \
+                b'size="%s" read="%s"/>' % (
+                    quoteattr(fname).encode("utf-8"),
+                    quoteattr(info["subject"]).encode("utf-8"),
+                    dt.encode(), quoteattr(info["type"]).encode("utf-8"),
+                    info["size"].encode("utf-8", "replace"),
+                    b"yes" if info["read"] else b"no")
+            rows.append((folder, fname, dt, info["type"], info["read"], 0,
+                info["subject"], info["sender"], info["recipient"], element, 0,
+                st.st_mtime, st.st_size))
+
+        gone = [(folder, h) for h in known if h not in present]
+        if rows or gone:
+            with self._lock, self.db:
+                self.db.executemany("INSERT OR REPLACE INTO messages VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.db.executemany("DELETE FROM messages WHERE folder = ? "
+                        "AND handle = ?", gone)
+                self._queries.pop(folder, None)
+
+    def _where(self, folder, params):
+        clauses = ["folder = ?"]
+        args = [folder]
+
+        type_mask = params.get("FilterMessageType")
+        if isinstance(type_mask, int) and type_mask:
+            excluded = [t for t, bit in MESSAGE_TYPE_BITS if type_mask & bit]
+            clauses.append("type NOT IN (%s)" % ",".join("?" * len(excluded)))
+            args.extend(excluded)
+
+        # timestamps are YYYYMMDDTHHMMSS, optionally with a UTC offset, so
+        # the first 15 characters compare correctly as strings
+        begin = params.get("FilterPeriodBegin")
+        if begin:
+            clauses.append("datetime >= ?")
+            args.append(begin.decode("utf-8", "replace").strip("\x00")[:15])
+        end = params.get("FilterPeriodEnd")
+        if end:
+            clauses.append("datetime < ?")
+            args.append(end.decode("utf-8", "replace").strip("\x00")[:15])
+
+        read_status = params.get("FilterReadStatus")
+        if read_status == READ_STATUS_UNREAD:
+            clauses.append("read = 0")
+        elif read_status == READ_STATUS_READ:
+            clauses.append("read = 1")
+
+        priority = params.get("FilterPriority")
+        if priority == PRIORITY_HIGH:
+            clauses.append("priority = 1")
+        elif priority == PRIORITY_NON_HIGH:
+            clauses.append("priority = 0")
+
+        for name, column in (("FilterRecipient", "recipient"),
+                ("FilterOriginator", "sender")):
+            value = params.get(name)
+            if value:
+                clauses.append("%s LIKE ?" % column)
+                args.append("%%%s%%" % value.decode("utf-8", "replace").strip("\x00"))
+
+        return " AND ".join(clauses), args
+
+    def listing(self, folder, params):
+        """listing(folder, params)
+
+        Returns a tuple of (listing XML, MessagesListingSize, NewMessage) for
+        a GetMessagesListing request on a folder, relative to the MAP root.
+        params is a mapping of MAP application parameters by name, such as
+        the AppParams decoded from an App_Parameters header. Messages are
+        listed newest first. Returns None if the folder does not exist.
+        """
+
+        folder = folder.strip("/")
+        if not self.sync_folder(folder):
+            return None
+
+        offset = params.get("StartOffset")
+        count = params.get("MaxListCount")
+        if not isinstance(offset, int):
+            offset = 0
+        if not isinstance(count, int):
+            count = DEFAULT_MAX_LIST_COUNT
+        subject_length = params.get("SubjectLength")
+
+        where, args = self._where(folder, params)
+        with self._lock:
+            head, tail, sep = self.db.execute("SELECT head, tail, sep FROM "
+                    "folders WHERE folder = ?", (folder,)).fetchone()
+            cached = self._queries.setdefault(folder, {}).setdefault(
+                    (where, tuple(args)), [None, {}])
+            if cached[0] is None:
+                cached[0] = self.db.execute("SELECT COUNT(*) FROM messages "
+                        "WHERE " + where, args).fetchone()[0]
+            size, marks = cached
+            new_message = self.db.execute("SELECT EXISTS (SELECT 1 FROM "
+                    "messages WHERE folder = ? AND read = 0)",
+                    (folder,)).fetchone()[0]
+
+            # Resume from the nearest page end seen so far, so that paging
+            # through a listing in order doesn't rescan the skipped rows.
+            start = max([o for o in marks if o <= offset] or [0])
+            keyset = ""
+            page_args = list(args)
+            if start:
+                keyset = " AND datetime <= ? AND NOT (datetime = ? AND " \
+                        "handle <= ?)"
+                dt, handle = marks[start]
+                page_args += [dt, dt, handle]
+            page = self.db.execute("SELECT rowid, datetime, handle FROM "
+                    "messages WHERE " + where + keyset + " ORDER BY datetime "
+                    "DESC, handle LIMIT ? OFFSET ?",
+                    page_args + [count, offset - start]).fetchall()
+            if page:
+                if len(marks) >= _MAX_PAGE_MARKS:
+                    marks.clear()
+                marks[offset + len(page)] = page[-1][1:]
+
+            rowids = [r[0] for r in page]
+            found = dict(self.db.execute("SELECT rowid, element FROM messages "
+                    "WHERE rowid IN (%s)" % ",".join("?" * len(rowids)),
+                    rowids))
+            elements = [found[r] for r in rowids]
+
+        if isinstance(subject_length, int) and subject_length > 0:
+            elements = [self._truncate_subject(e, subject_length)
+                    for e in elements]
+        return head + sep.join(elements) + tail, size, new_message
+
+    @staticmethod
+    def _truncate_subject(element, length):
+        # cut the unescaped text, so a cut never lands inside an entity
+        def truncate(m):
+            subject = html.unescape(m.group(2)[1:-1].decode("utf-8",
+                "replace"))[:length]
+            return m.group(1) + quoteattr(subject).encode("utf-8")
+        return _subject_re.sub(truncate, element, 1)
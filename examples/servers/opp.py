@@ -8,9 +8,11 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
-import os
+import logging, os
 from nOBEX import headers, responses, server
 
+logger = logging.getLogger(__name__)
+
 class OPPServer(server.Server):
     """OBEX Object Push Profile Server"""
 
@@ -27,15 +29,17 @@ class OPPServer(server.Server):
         name = b""
         length = 0
         body = b""
+        single = self._single_response(request)
+        first = True
 
         while True:
             for header in request.header_data:
                 if isinstance(header, headers.Name):
                     name = header.decode()
-                    print("Receiving %s" % name)
+                    logger.debug("Receiving %s", name)
                 elif isinstance(header, headers.Length):
                     length = header.decode()
-                    print("Length %i" % length)
+                    logger.debug("Length %i", length)
                 elif isinstance(header, headers.Body):
                     body += header.decode()
                 elif isinstance(header, headers.End_Of_Body):
@@ -44,17 +48,26 @@ class OPPServer(server.Server):
             if request.is_final():
                 break
 
-            # Ask for more data.
-            self.send_response(socket, responses.Continue())
+            # Ask for more data. With SRM, the client sends the rest
+            # without waiting for further responses.
+            if first:
+                srm = [headers.Single_Response_Mode(headers.SRM_ENABLE)] \
+                        if single else []
+                self.send_response(socket, responses.Continue(), srm)
+            elif not single:
+                self.send_response(socket, responses.Continue())
+            first = False
 
             # Get the next part of the data.
             request = self.request_handler.decode(socket)
+            if self._aborted(socket, request):
+                return
 
         self.send_response(socket, responses.Success())
 
         name = name.strip("\x00")
         name = os.path.split(name)[1]
         path = os.path.join(self.directory, name)
-        print("Writing %s" % repr(path))
+        logger.debug("Writing %r", path)
 
         open(path, "wb").write(body)
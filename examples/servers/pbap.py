@@ -8,8 +8,11 @@
 # Released under GPLv3, a full copy of which can be found in COPYING.
 #
 
-import os, socket, sys
+import logging, os
 from nOBEX import headers, requests, responses, server
+from .phonebook import PhonebookStore
+
+logger = logging.getLogger(__name__)
 
 def gen_body_headers(data, csize=65500):
     """Generate a list of body headers (to encapsulate large data)"""
@@ -26,10 +29,22 @@ def gen_body_headers(data, csize=65500):
 
 
 class PBAPServer(server.Server):
-    def __init__(self, directory, address=None):
+    """PBAPServer(directory, address=None, store=None)
+
+    Serves the phone books saved under directory. Listings, phone book pulls
+    and vCard entries are answered from an in memory PhonebookStore, which
+    handles the paging, ordering, search and property filter application
+    parameters. Pass store to share one already loaded store between several
+    servers.
+    """
+
+    def __init__(self, directory, address=None, store=None):
         super(PBAPServer, self).__init__(address)
         self.directory = os.path.abspath(directory).rstrip(os.sep)
         self.cur_directory = self.directory
+        if store is None:
+            store = PhonebookStore(self.directory)
+        self.store = store
 
     def start_service(self, port=19):
         return super(PBAPServer, self).start_service("pbap", port)
@@ -37,74 +52,124 @@ class PBAPServer(server.Server):
     def get(self, socket, request):
         name = ''
         mimetype = b''
+        params = {}
 
+        debug = logger.isEnabledFor(logging.DEBUG)
         for header in request.header_data:
-            print(header)
+            if debug:
+                logger.debug("%r", header)
             if isinstance(header, headers.Name):
                 name = header.decode().strip('\x00')
-                print("Receiving request for %s" % name)
+                logger.debug("Receiving request for %s", name)
 
             elif isinstance(header, headers.Type):
                 mimetype = header.decode().strip(b'\x00')
-                print("Type %s" % mimetype)
+                logger.debug("Type %s", mimetype)
+
+            elif isinstance(header, headers.App_Parameters):
+                params = header.decode(headers.PBAP_APP_PARAMS)
+                logger.debug("App parameters: %r", params)
 
         path = os.path.abspath(os.path.join(self.cur_directory, name))
         if not path.startswith(self.directory):
             self._reject(socket)
             return
 
+        if self._get_from_store(socket, name, mimetype, path, params):
+            return
+
         if os.path.isdir(path) or mimetype == b'x-bt/vcard-listing':
             try:
                 listing = open(path + "/listing.xml", 'rb')
             except IOError:
-                sys.stderr.write("failed to open listing for %s\n" % path)
+                logger.error("failed to open listing for %s", path)
                 self._reject(socket)
                 return
             s = listing.read()
             listing.close()
-
-            response = responses.Success()
-            response_headers = [headers.Name(name), headers.Length(len(s))] + \
-                    gen_body_headers(s, self._max_length() - 50)
-            self.send_response(socket, response, response_headers)
+            self._send_object(socket, name, s)
         elif os.path.isfile(path):
             try:
                 fd = open(path, 'rb')
             except IOError:
-                sys.stderr.write("failed to open vcard %s" % path)
+                logger.error("failed to open vcard %s", path)
                 self._reject(socket)
                 return
             s = fd.read()
             fd.close()
-
-            response = responses.Success()
-            response_headers = [headers.Name(name), headers.Length(len(s))] + \
-                    gen_body_headers(s, self._max_length() - 50)
-            self.send_response(socket, response, response_headers)
+            self._send_object(socket, name, s)
         else:
             self._reject(socket)
 
+    def _get_from_store(self, socket, name, mimetype, path, params):
+        """Answers listing, phone book and vCard requests from the store.
+        Returns False if the store does not hold the requested object."""
+        key = os.path.relpath(path, self.directory).replace(os.sep, "/")
+
+        if mimetype == b'x-bt/vcard-listing':
+            book = self.store.get(key)
+            if book is None:
+                return False
+            s, size = book.listing(params)
+        elif mimetype == b'x-bt/phonebook':
+            if not key.endswith(".vcf"):
+                return False
+            book = self.store.get(key[:-4])
+            if book is None:
+                return False
+            s, size = book.pull(params)
+        elif mimetype == b'x-bt/vcard':
+            book = self.store.get(os.path.dirname(key))
+            s = book.entry(os.path.basename(key), params) if book else None
+            if s is None:
+                return False
+            self._send_object(socket, name, s)
+            return True
+        else:
+            return False
+
+        # a MaxListCount of zero asks for the phone book size alone
+        if params.get("MaxListCount") == 0:
+            app_params = headers.App_Parameters(
+                    {"PhonebookSize": min(size, 0xFFFF)},
+                    tags=headers.PBAP_APP_PARAMS)
+            self.send_response(socket, responses.Success(), [app_params])
+        else:
+            self._send_object(socket, name, s)
+        return True
+
+    def _send_object(self, socket, name, s):
+        response = responses.Success()
+        response_headers = [headers.Name(name), headers.Length(len(s))] + \
+                gen_body_headers(s, self._max_length() - 50)
+        self.send_response(socket, response, response_headers)
+
     def put(self, socket, request):
         self.send_response(socket, responses.Bad_Request())
 
     def set_path(self, socket, request):
+        name = ''
+        for header in request.header_data:
+            if isinstance(header, headers.Name):
+                name = header.decode().strip('\x00')
+
         if request.flags & requests.Set_Path.NavigateToParent:
+            # back up a level, then enter the named folder if there is one
             path = os.path.dirname(self.cur_directory)
+            if name:
+                path = os.path.abspath(os.path.join(path, name))
+        elif len(name) == 0 and (
+                request.flags & requests.Set_Path.DontCreateDir):
+            # see bluetooth PBAP spec section 5.3 PullvCardListing Function
+            path = self.directory
         else:
-            header = request.header_data[0]
-            name = header.decode().strip('\x00')
-            if len(name) == 0 and (
-                    request.flags & requests.Set_Path.DontCreateDir):
-                # see bluetooth PBAP spec section 5.3 PullvCardListing Function
-                path = self.directory
-            else:
-                path = os.path.abspath(os.path.join(self.cur_directory, name))
+            path = os.path.abspath(os.path.join(self.cur_directory, name))
 
         path = path.rstrip(os.sep)
         if not path.startswith(self.directory):
             self._reject(socket)
             return
 
-        print("moving to %s" % path)
+        logger.debug("moving to %s", path)
         self.cur_directory = path
         self.send_response(socket, responses.Success())
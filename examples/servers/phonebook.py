@@ -0,0 +1,304 @@
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+import bisect, logging, os, re
+from xml.sax.saxutils import quoteattr
+from nOBEX.vcard import VCardIndex, FORMAT_21
+
+logger = logging.getLogger(__name__)
+
+ORDER_INDEXED = 0
+ORDER_ALPHANUMERIC = 1
+ORDER_PHONETIC = 2
+
+SEARCH_NAME = 0
+SEARCH_NUMBER = 1
+SEARCH_SOUND = 2
+
+# phone book objects defined by PBAP, each a folder and a combined .vcf file
+PHONEBOOK_NAMES = ("pb", "ich", "och", "mch", "cch", "spd", "fav")
+
+def _param_int(params, name, default):
+    """Returns an integer parameter, or default if it is absent or has a
+    malformed length"""
+    value = params.get(name)
+    return value if isinstance(value, int) else default
+
+_vcard_re = re.compile(rb'BEGIN:VCARD.*?END:VCARD[ \t]*(?:\r?\n)?', re.S | re.I)
+_card_elem_re = re.compile(rb'<card\b.*?(?:/>|</card>)', re.S)
+_attr_re = re.compile(rb'\b(handle|name)\s*=\s*"([^"]*)"')
+
+_prop_re = re.compile(rb'^(?:[^:;\r\n]*\.)?(FN|N|TEL|SOUND)(?:;[^:\r\n]*)?:(.*?)\r?$',
+        re.M | re.I)
+
+def _vcard_props(vcard):
+    """Returns a dict of upper case property name -> list of values, for the
+    few properties the indexes need."""
+    props = {}
+    if b'\n ' in vcard or b'\n\t' in vcard:
+        vcard = re.sub(rb'\r?\n[ \t]', b'', vcard)
+    for name, value in _prop_re.findall(vcard):
+        props.setdefault(name.upper(), []).append(value.strip())
+    return props
+
+def _handle_key(handle):
+    stem = handle.split(".")[0]
+    return (0, int(stem), handle) if stem.isdigit() else (1, 0, handle)
+
+class Card(object):
+    __slots__ = ("handle", "name", "sort_name", "sound", "numbers",
+            "listing", "vcard", "index")
+
+    def __init__(self, handle, name, listing=None, vcard=None):
+        self.handle = handle
+        self.name = name
+        self.listing = listing
+        self.vcard = vcard
+        self.index = None
+        self.sound = ""
+        self.numbers = []
+
+        if vcard is not None:
+            props = _vcard_props(vcard)
+            if not self.name:
+                fn = props.get(b'FN') or props.get(b'N') or [b'']
+                self.name = fn[0].replace(b';', b' ').strip().decode(
+                        "utf-8", "replace")
+            self.sound = props.get(b'SOUND', [b''])[0].decode("utf-8", "replace")
+            self.numbers = [re.sub(rb'[^0-9+*#]', b'', n).decode("ascii")
+                    for n in props.get(b'TEL', [])]
+
+        self.sort_name = self.name.lower()
+
+    def listing_element(self):
+        if self.listing is None:
+            self.listing = b'<card handle=%s name=%s/>' % (
+                    quoteattr(self.handle).encode("utf-8"),
+                    quoteattr(self.name).encode("utf-8"))
+        return self.listing
+
+class Phonebook(object):
+    """Phonebook(folder, combined_file=None)
+
+    One PBAP phone book object (such as telecom/pb), loaded into memory with
+    indexes by handle, name, phonetic name and number.
+
+    Cards come from the per-card .vcf files and listing.xml in the folder, or
+    are split out of the combined .vcf file if the folder has no cards.
+    The raw bytes of every vCard and listing element are kept exactly as
+    saved, so hand-modified data is served unchanged. When a request carries
+    a property filter, the property offsets of each vCard are computed on
+    first use and kept, so later filtered pulls only slice and join.
+
+    Requests take params, a mapping of PBAP application parameters by name,
+    such as the AppParams decoded from an App_Parameters header.
+    """
+
+    listing_head = (b'<?xml version="1.0"?>\n'
+            b'<!DOCTYPE vcard-listing SYSTEM "vcard-listing.dtd">\n'
+            b'<vCard-listing version="1.0">\n')
+    listing_tail = b'\n</vCard-listing>\n'
+    listing_sep = b'\n\t'
+
+    def __init__(self, folder, combined_file=None):
+        self.raw_listing = None
+        self.raw_combined = None
+        cards = []
+
+        if folder is not None and os.path.isdir(folder):
+            cards = self._load_folder(folder)
+        if combined_file is not None and os.path.isfile(combined_file):
+            with open(combined_file, "rb") as f:
+                self.raw_combined = f.read()
+            combined = [m.group(0) for m in _vcard_re.finditer(self.raw_combined)]
+            if not cards:
+                cards = [Card("%i.vcf" % i, "", vcard=v)
+                        for i, v in enumerate(combined)]
+        else:
+            combined = None
+
+        cards.sort(key=lambda c: _handle_key(c.handle))
+        self.cards = cards
+        self.by_handle = dict((c.handle, c) for c in cards)
+
+        # vCards in handle order for pulling the whole phone book
+        if combined is None:
+            combined = [c.vcard for c in cards if c.vcard is not None]
+        self.combined = combined
+        self.combined_indexes = [None] * len(combined)
+
+        self.orders = {
+            ORDER_INDEXED: cards,
+            ORDER_ALPHANUMERIC: sorted(cards, key=lambda c: c.sort_name),
+            ORDER_PHONETIC: sorted(cards,
+                key=lambda c: (c.sound or c.name).lower())
+        }
+        self.positions = dict((o, dict((id(c), i) for i, c in enumerate(l)))
+                for o, l in self.orders.items())
+
+        # sorted keys for prefix searches
+        alpha = self.orders[ORDER_ALPHANUMERIC]
+        phonetic = self.orders[ORDER_PHONETIC]
+        self.search_keys = {
+            SEARCH_NAME: ([c.sort_name for c in alpha], alpha),
+            SEARCH_SOUND: ([(c.sound or c.name).lower() for c in phonetic],
+                phonetic)
+        }
+        numbers = sorted((n, c.handle) for c in cards for n in c.numbers)
+        self.search_keys[SEARCH_NUMBER] = ([n for n, h in numbers],
+                [self.by_handle[h] for n, h in numbers])
+
+    def _load_folder(self, folder):
+        listing_path = os.path.join(folder, "listing.xml")
+        elements = []
+        if os.path.isfile(listing_path):
+            with open(listing_path, "rb") as f:
+                self.raw_listing = f.read()
+            matches = list(_card_elem_re.finditer(self.raw_listing))
+            if matches:
+                self.listing_head = self.raw_listing[:matches[0].start()]
+                self.listing_tail = self.raw_listing[matches[-1].end():]
+                if len(matches) > 1:
+                    self.listing_sep = self.raw_listing[
+                            matches[0].end():matches[1].start()]
+            for m in matches:
+                attrs = dict((k.decode(), v.decode("utf-8", "replace"))
+                        for k, v in _attr_re.findall(m.group(0)))
+                if "handle" in attrs:
+                    elements.append((attrs["handle"], attrs.get("name", ""),
+                        m.group(0)))
+
+        cards = []
+        seen = set()
+        for handle, name, elem in elements:
+            cards.append(Card(handle, name, elem, self._read_card(folder, handle)))
+            seen.add(handle)
+
+        for fname in os.listdir(folder):
+            if fname.lower().endswith(".vcf") and fname not in seen:
+                cards.append(Card(fname, "", vcard=self._read_card(folder, fname)))
+        return cards
+
+    @staticmethod
+    def _read_card(folder, handle):
+        path = os.path.join(folder, os.path.basename(handle))
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def select(self, params):
+        """Returns the list of cards matching the search parameters, in the
+        requested order."""
+        order = _param_int(params, "Order", ORDER_INDEXED)
+        ordered = self.orders.get(order, self.cards)
+
+        if "SearchValue" not in params:
+            return ordered
+
+        prop = _param_int(params, "SearchProperty", SEARCH_NAME)
+        value = params["SearchValue"].rstrip(b'\x00').decode("utf-8", "replace")
+        if prop == SEARCH_NUMBER:
+            value = re.sub(r'[^0-9+*#]', '', value)
+        else:
+            value = value.lower()
+        keys, cards = self.search_keys.get(prop, self.search_keys[SEARCH_NAME])
+
+        # prefix match using the sorted keys
+        lo = bisect.bisect_left(keys, value)
+        hi = bisect.bisect_left(keys, value + u"\U0010ffff")
+        matches = dict((id(c), c) for c in cards[lo:hi])
+        positions = self.positions.get(order, self.positions[ORDER_INDEXED])
+        return sorted(matches.values(), key=lambda c: positions[id(c)])
+
+    def listing(self, params):
+        """Returns a tuple of (listing XML, phone book size) for a
+        PullvCardListing request"""
+        default = not any(p in params for p in ("Order", "SearchValue",
+            "MaxListCount", "ListStartOffset"))
+        if default and self.raw_listing is not None:
+            return self.raw_listing, len(self.cards)
+
+        cards = self.select(params)
+        offset = _param_int(params, "ListStartOffset", 0)
+        count = _param_int(params, "MaxListCount", len(cards))
+        page = cards[offset:offset+count]
+        body = self.listing_head + self.listing_sep.join(
+                c.listing_element() for c in page) + self.listing_tail
+        return body, len(cards)
+
+    def pull(self, params):
+        """Returns a tuple of (vCards, phone book size) for a PullPhoneBook
+        request"""
+        offset = _param_int(params, "ListStartOffset", 0)
+        count = _param_int(params, "MaxListCount", len(self.combined))
+        mask = _param_int(params, "Filter", 0)
+        size = len(self.combined)
+
+        if not mask:
+            if offset == 0 and count >= size and self.raw_combined is not None:
+                return self.raw_combined, size
+            return b''.join(self.combined[offset:offset+count]), size
+
+        fmt = _param_int(params, "Format", FORMAT_21)
+        indexes = self.combined_indexes
+        out = []
+        for i in range(offset, min(offset + count, size)):
+            index = indexes[i]
+            if index is None:
+                index = indexes[i] = VCardIndex(self.combined[i])
+            out.append(index.filter(mask, fmt))
+        return b''.join(out), size
+
+    def entry(self, handle, params=None):
+        """Returns the vCard for a handle, filtered as requested, or None"""
+        if params is None:
+            params = {}
+        card = self.by_handle.get(handle)
+        if card is None or card.vcard is None:
+            return None
+        mask = _param_int(params, "Filter", 0)
+        if not mask:
+            return card.vcard
+        if card.index is None:
+            card.index = VCardIndex(card.vcard)
+        return card.index.filter(mask, _param_int(params, "Format", FORMAT_21))
+
+class PhonebookStore(object):
+    """PhonebookStore(directory)
+
+    Loads every PBAP phone book object under a PBAP root directory (as saved
+    by pbapclient.py) into memory once. Phone books are keyed by their path
+    relative to the root, such as "telecom/pb" or "SIM1/telecom/ich".
+
+    The store is read only after loading, so one instance can be shared by
+    several PBAPServer instances.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.books = {}
+        self.load()
+
+    def load(self):
+        books = {}
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for name in PHONEBOOK_NAMES:
+                folder = os.path.join(dirpath, name)
+                combined = folder + ".vcf"
+                if name in dirnames or name + ".vcf" in filenames:
+                    key = os.path.relpath(folder, self.directory)
+                    books[key.replace(os.sep, "/")] = Phonebook(folder, combined)
+        self.books = books
+        logger.info("Loaded %i phone books from %s", len(books), self.directory)
+
+    def get(self, key):
+        return self.books.get(key.strip("/"))
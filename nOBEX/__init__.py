@@ -21,6 +21,8 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-__all__ = ["bluez_helper", "client", "common", "headers", "requests",
-        "responses", "server"]
+__all__ = ["bluez_helper", "bmessage", "client", "common", "devicecache",
+        "export", "headers", "instrument", "metrics", "pool", "reliable",
+        "replay", "requests", "responses", "scheduler", "server", "sizing",
+        "transport", "vcard"]
 __version__ = "1.0.0"
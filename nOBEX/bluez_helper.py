@@ -26,7 +26,9 @@ def BluetoothSocket():
     return socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM,
             socket.BTPROTO_RFCOMM)
 
-BDADDR_ANY = socket.BDADDR_ANY
+# Python builds without Bluetooth support lack this constant, but the rest of
+# nOBEX is still usable over other transports
+BDADDR_ANY = getattr(socket, "BDADDR_ANY", "00:00:00:00:00:00")
 
 class SDPException(Exception):
     pass
@@ -108,7 +110,33 @@ def find_service(name, bdaddr):
     h, c = _search_record(name, bdaddr)
     return c
 
+def find_service_record(name, bdaddr):
+    """Returns a dict describing the service on the remote device, holding
+    its RFCOMM channel, the L2CAP PSM advertised for OBEX over L2CAP with
+    SRM (GOEP 2.0), and the profile's SupportedFeatures bitmask. The PSM and
+    features are None for devices that do not advertise them."""
+
+    tree = _search_tree(name, bdaddr)
+    channel = int(_find_attr(tree, "0x0004")[0][1][1].attrib["value"], 16)
+    return {"channel": channel,
+            "l2cap_psm": _find_uint(tree, "0x0200"),
+            "features": _find_uint(tree, "0x0317")}
+
+def _find_uint(xml_tree, attr_id):
+    try:
+        return int(_find_attr(xml_tree, attr_id)[0].attrib["value"], 16)
+    except (SDPException, IndexError, KeyError, ValueError):
+        return None
+
 def _search_record(name, bdaddr):
+    tree = _search_tree(name, bdaddr)
+
+    # this code is probably fragile
+    handle = _find_attr(tree, "0x0000")[0].attrib["value"]
+    channel = int(_find_attr(tree, "0x0004")[0][1][1].attrib["value"], 16)
+    return handle, channel
+
+def _search_tree(name, bdaddr):
     val = subrun(
             ["sdptool", "search", "--xml", "--bdaddr=%s" % bdaddr, name],
             stdout=subprocess.PIPE)
@@ -143,10 +171,7 @@ def _search_record(name, bdaddr):
         if 0x111f in serv_classes:
             raise SDPException("HF on %s is HFAG" % bdaddr)
 
-    # this code is probably fragile
-    handle = _find_attr(tree, "0x0000")[0].attrib["value"]
-    channel = int(_find_attr(tree, "0x0004")[0][1][1].attrib["value"], 16)
-    return handle, channel
+    return tree
 
 def _find_attr(xml_tree, attr_id):
     for elem in xml_tree:
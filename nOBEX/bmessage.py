@@ -0,0 +1,189 @@
+"""
+bmessage.py - streaming MAP bMessage parsing
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+from nOBEX import vcard
+
+# bMessages are often indented for readability, so a line starting with
+# whitespace only continues a vCard property if it does not look like a
+# property of its own
+_property_line = re.compile(rb'[ \t]*[A-Za-z0-9_.-]+[;:]')
+
+class BMessage(object):
+    """BMessage()
+
+    A parsed bMessage. properties holds the bMessage properties (VERSION,
+    STATUS, TYPE, FOLDER and any extended ones) keyed by upper case name.
+    originators holds the vCards of the sender, and envelopes the vCards of
+    each nested BENV, outermost first, the last being the final recipients.
+    body holds the BBODY properties (ENCODING, CHARSET, LENGTH and so on),
+    and content the raw bytes of each MSG part.
+    """
+
+    __slots__ = ("properties", "originators", "envelopes", "body", "content")
+
+    def __init__(self):
+        self.properties = {}
+        self.originators = []
+        self.envelopes = []
+        self.body = {}
+        self.content = []
+
+    @property
+    def status(self):
+        return self.properties.get("STATUS", "")
+
+    @property
+    def type(self):
+        return self.properties.get("TYPE", "")
+
+    @property
+    def folder(self):
+        return self.properties.get("FOLDER", "")
+
+    @property
+    def recipients(self):
+        return self.envelopes[-1] if self.envelopes else []
+
+    @property
+    def text(self):
+        """The message content decoded as text, with its parts joined"""
+        data = b"".join(self.content)
+        try:
+            return data.decode(self.body.get("CHARSET") or "utf-8", "replace")
+        except LookupError:
+            return data.decode("utf-8", "replace")
+
+    def __repr__(self):
+        return "<BMessage %s %s>" % (self.type, self.status)
+
+def _lines(chunks):
+    """Yields the lines of a stream of byte chunks with their line endings,
+    holding only the line currently being received."""
+
+    buf = b""
+    for chunk in chunks:
+        buf += chunk
+        pos = 0
+        while True:
+            newline = buf.find(b"\n", pos)
+            if newline < 0:
+                break
+            yield buf[pos:newline + 1]
+            pos = newline + 1
+        buf = buf[pos:]
+    if buf:
+        yield buf
+
+def parse_stream(chunks):
+    """parse_stream(chunks)
+
+    Parses a stream of one or more bMessages arriving as an iterable of byte
+    chunks, such as Client.get_chunks() pulling a message, yielding a
+    BMessage as soon as each is complete. Embedded vCards are parsed with
+    nOBEX.vcard, so folded and quoted-printable properties are decoded.
+
+    Harvested messages may be malformed on purpose, so nothing is rejected:
+    unknown lines are skipped, and a message cut short is still yielded
+    with whatever was received.
+    """
+
+    msg = None
+    container = None
+    card = None
+    qp = False
+    part = None
+    in_body = False
+
+    for line in _lines(chunks):
+        if part is not None:
+            if line.strip().upper() == b"END:MSG":
+                msg.content.append(b"".join(part))
+                part = None
+            else:
+                part.append(line)
+            continue
+
+        if card is not None:
+            if (qp and card[-1].rstrip(b"\r\n").endswith(b"=")) or \
+                    not _property_line.match(line):
+                # a continuation line, kept as is
+                card.append(line)
+                continue
+            line = line.lstrip()
+            card.append(line)
+            qp = b"QUOTED-PRINTABLE" in line.partition(b":")[0].upper()
+            if line.rstrip().upper() == b"END:VCARD":
+                container.append(vcard.parse_card(b"".join(card)))
+                card = None
+            continue
+
+        key, sep, value = line.strip().partition(b":")
+        key = key.strip().upper().decode("utf-8", "replace")
+        value = value.strip().decode("utf-8", "replace")
+        if key == "BEGIN":
+            value = value.upper()
+            if value == "BMSG":
+                if msg is not None:
+                    yield msg
+                msg = BMessage()
+                container = msg.originators
+            elif msg is None:
+                continue
+            elif value == "VCARD":
+                card = [line.lstrip()]
+                qp = False
+            elif value == "BENV":
+                container = []
+                msg.envelopes.append(container)
+            elif value == "BBODY":
+                in_body = True
+            elif value == "MSG":
+                part = []
+        elif key == "END":
+            value = value.upper()
+            if value == "BMSG" and msg is not None:
+                yield msg
+                msg = None
+            elif value == "BBODY":
+                in_body = False
+        elif msg is not None and sep:
+            if in_body:
+                msg.body[key] = value
+            elif not msg.envelopes:
+                msg.properties[key] = value
+
+    # a message cut short
+    if msg is not None:
+        if part is not None:
+            msg.content.append(b"".join(part))
+        yield msg
+
+def parse(data):
+    """parse(data)
+
+    Parses a complete bMessage held in memory, returning a BMessage, or
+    None if there is none.
+    """
+
+    for msg in parse_stream((data,)):
+        return msg
+    return None
@@ -21,14 +21,115 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import sys
-from nOBEX.common import OBEX_Version, OBEXError
+import concurrent.futures, contextlib, functools, io, logging, posixpath
+import queue, select, socket, threading, time
+from nOBEX.common import OBEX_Version, OBEXError, OperationAborted
 from nOBEX.bluez_helper import BluetoothSocket
+from nOBEX.instrument import SENT
+from nOBEX.sizing import PacketSizer
 from nOBEX import headers
+from nOBEX import reliable
 from nOBEX import requests
 from nOBEX import responses
 from nOBEX.xml_helper import parse_xml
 
+logger = logging.getLogger(__name__)
+
+def _instrumented(name, size=None):
+    """Decorator reporting a client operation to the client's instrument.
+    size is a function of the call arguments and the result giving the
+    number of body bytes transferred."""
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.instrument is None:
+                return method(self, *args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                result = method(self, *args, **kwargs)
+            except Exception as e:
+                self.instrument.operation(name, time.perf_counter() - start,
+                        0, e)
+                raise
+            nbytes = size(args, kwargs, result) if size else 0
+            self.instrument.operation(name, time.perf_counter() - start,
+                    nbytes)
+            return result
+        return wrapper
+    return decorator
+
+# how often an operation with a cancellation token checks it while waiting
+# for a response
+_CANCEL_POLL = 0.05
+
+class CancelToken(object):
+    """CancelToken()
+
+    Passed to a client operation to allow cancelling it from another
+    thread. Once cancel() is called, operations given the token are aborted
+    between packets.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+class _Interrupted(Exception):
+    """Stops an operation once its deadline passes or it is cancelled.
+    pending is true if a response to the last request is still to come,
+    and lost if the response was cut short, so the session is unusable."""
+
+    def __init__(self, reason, pending=False, lost=False):
+        super(_Interrupted, self).__init__(reason)
+        self.reason = reason
+        self.pending = pending
+        self.lost = lost
+
+class _Limit(object):
+    """The deadline and cancellation token of an operation"""
+
+    def __init__(self, timeout, cancel):
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = time.monotonic() + timeout
+        self.cancel = cancel
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def reason(self):
+        """Returns why the operation should stop, or None to carry on"""
+        if self.cancel is not None and self.cancel.cancelled:
+            return "cancelled"
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return "timed out"
+        return None
+
+    def check(self):
+        reason = self.reason()
+        if reason is not None:
+            raise _Interrupted(reason)
+
+def _srm_enabled(response):
+    for header in response.header_data:
+        if isinstance(header, headers.Single_Response_Mode):
+            return header.decode() == headers.SRM_ENABLE
+    return False
+
+def _body_length(response):
+    return sum(len(h.data) for h in response.header_data
+            if isinstance(h, (headers.Body, headers.End_Of_Body)))
+
 class Client(object):
     """Client
 
@@ -53,8 +154,216 @@ class Client(object):
         self.socket = None
         self._external_socket = False
         self.connection_id = None
+        self.instrument = None
+        self.cache = None
+        self.profile = None
+        self.reliable = None
+        self.sizers = None
+        self._get_size = None
+        self._deferred = None
+
+        # how long to wait for the server to answer an Abort sent after an
+        # operation's deadline passes or it is cancelled
+        self.abort_timeout = 2.0
+
+        # the server's current directory as a tuple of folder names, or None
+        # if it is unknown
+        self.cwd = None
+
+    def set_instrument(self, instrument):
+        """set_instrument(self, instrument)
+
+        Reports connections, packets and operations to the given
+        nOBEX.instrument.Instrument, or stops reporting if it is None.
+        """
+
+        self.instrument = instrument
+        self.response_handler.instrument = instrument
+
+    def set_cache(self, cache, profile):
+        """set_cache(self, cache, profile)
+
+        Records the parameters of each successful connection in the given
+        nOBEX.devicecache.DeviceCache under the profile name, and uses what
+        was cached on later connections. If connecting to the cached
+        channel fails, the device's SDP records are searched again for the
+        profile's current channel.
+        """
+
+        self.cache = cache
+        self.profile = profile
 
-    def _send_headers(self, request, header_list, max_length):
+    def set_adaptive(self, enabled=True):
+        """set_adaptive(self, enabled=True)
+
+        Chooses packet lengths from the throughput measured with the device
+        (see nOBEX.sizing.PacketSizer). PUT bodies are sent in whichever
+        packet length within the server's limit has done best so far, with
+        other lengths tried from time to time. GET response packets are
+        sized by the server, so the length offered to it when connecting
+        is the one that did best in earlier sessions. With a cache set by
+        set_cache(), the measurements are kept for later sessions with the
+        device.
+        """
+
+        if enabled:
+            self.sizers = {"get": PacketSizer(probe_interval=4),
+                    "put": PacketSizer()}
+        else:
+            self.sizers = None
+
+    def set_reliable(self, reconnect=None, timeout=None, attempts=3):
+        """set_reliable(self, reconnect=None, timeout=None, attempts=3)
+
+        Asks the server for a reliable session on each connection, so that
+        if the link drops part way through an operation, the session is
+        resumed over a new link and the operation carries on from the last
+        packet acknowledged rather than starting over. reconnect is called
+        for each new connected socket, and defaults to connecting a new
+        Bluetooth socket to the same address and channel. Up to attempts
+        reconnections are tried, and timeout is how many seconds the server
+        should wait for one. Servers without reliable session support are
+        used as before.
+        """
+
+        self.reliable = (reconnect, timeout, attempts)
+
+    def _reconnect(self):
+        socket = BluetoothSocket()
+        socket.connect((self.address, self.port))
+        return socket
+
+    def _create_session(self):
+        reconnect, timeout, attempts = self.reliable
+        try:
+            self.socket = reliable.ClientSession(self.socket,
+                    reconnect or self._reconnect, timeout, attempts)
+        except ConnectionRefusedError:
+            logger.info("server does not support reliable sessions")
+
+    def _close_session(self):
+        if isinstance(self.socket, reliable.ClientSession):
+            self.socket.close_session()
+            self.socket = self.socket.transport
+
+    def _send_request(self, request, limit=None):
+        """Sends a single request packet and returns the response. With a
+        limit, waiting for the response is cut short by its deadline or
+        cancellation."""
+
+        data = request.encode()
+        if self.instrument is not None:
+            self.instrument.packet(SENT, request.code, len(data),
+                    time.perf_counter())
+        self.socket.sendall(data)
+        if self._deferred is not None:
+            self._finish_deferred()
+
+        if limit is not None:
+            self._await_response(limit)
+            try:
+                return self.response_handler.decode(self.socket)
+            except (socket.timeout, ConnectionAbortedError):
+                raise _Interrupted("timed out", lost=True)
+
+        if isinstance(request, requests.Connect):
+            return self.response_handler.decode_connection(self.socket)
+        else:
+            return self.response_handler.decode(self.socket)
+
+    def _await_response(self, limit):
+        """Waits for a response to start arriving, raising _Interrupted if
+        the limit is reached first."""
+
+        while True:
+            reason = limit.reason()
+            if reason is not None:
+                raise _Interrupted(reason, pending=True)
+            wait = limit.remaining()
+            if limit.cancel is not None:
+                wait = _CANCEL_POLL if wait is None else min(wait, _CANCEL_POLL)
+            readable, _, _ = select.select([self.socket], [], [], wait)
+            if readable:
+                break
+
+        # a server stalling part way through the response still has to
+        # meet the deadline
+        remaining = limit.remaining()
+        if remaining is not None:
+            self.socket.settimeout(max(remaining, 0.001))
+
+    @contextlib.contextmanager
+    def _limited(self, timeout, cancel):
+        """Runs an operation with an optional deadline of timeout seconds
+        and cancellation token, yielding the _Limit to pass to requests, or
+        None if there is neither. If the operation is interrupted, it is
+        aborted and OperationAborted raised."""
+
+        if timeout is None and cancel is None:
+            yield None
+            return
+
+        limit = _Limit(timeout, cancel)
+        reason = limit.reason()
+        if reason is not None:
+            raise OperationAborted(reason)
+
+        old_timeout = self.socket.gettimeout()
+        try:
+            yield limit
+        except _Interrupted as e:
+            self._abandon(e)
+        finally:
+            try:
+                self.socket.settimeout(old_timeout)
+            except OSError:
+                pass
+
+    def _abandon(self, interrupted):
+        """Sends an Abort for the interrupted operation and raises
+        OperationAborted. If the server does not answer within
+        abort_timeout, the connection is closed."""
+
+        reason = interrupted.reason
+        if interrupted.lost or not self._send_abort(interrupted.pending):
+            logger.warning("operation %s and the server stopped responding, "
+                    "closing the connection", reason)
+            self._drop_connection()
+            raise OperationAborted(reason, closed=True)
+
+        logger.info("operation %s, aborted", reason)
+        raise OperationAborted(reason)
+
+    def _send_abort(self, pending=False):
+        """Sends an Abort for the operation in progress, first reading the
+        response to the last request if it is still pending. Returns False
+        if the server does not answer within abort_timeout."""
+
+        old_timeout = self.socket.gettimeout()
+        try:
+            self.socket.settimeout(self.abort_timeout)
+            if pending:
+                # the response to the last request is still on its way
+                self.response_handler.decode(self.socket)
+            self._send_headers(requests.Abort(), [],
+                    self.remote_info.max_packet_length)
+        except OSError:
+            return False
+        finally:
+            try:
+                self.socket.settimeout(old_timeout)
+            except OSError:
+                pass
+        return True
+
+    def _drop_connection(self):
+        self.socket.close()
+        self.connection_id = None
+        self.cwd = None
+        if self.instrument is not None:
+            self.instrument.session_end()
+
+    def _send_headers(self, request, header_list, max_length, limit=None):
         """Convenience method to add headers to a request and send one or
         more requests with those headers."""
 
@@ -66,17 +375,14 @@ class Client(object):
             if request.add_header(header_list[0], max_length):
                 header_list.pop(0)
             else:
-                self.socket.sendall(request.encode())
-
-                if isinstance(request, requests.Connect):
-                    response = self.response_handler.decode_connection(self.socket)
-                else:
-                    response = self.response_handler.decode(self.socket)
+                response = self._send_request(request, limit)
 
                 if not isinstance(response, responses.Continue):
                     return response
 
                 request.reset_headers()
+                if limit is not None:
+                    limit.check()
 
         # Always send at least one request.
         if isinstance(request, requests.Get):
@@ -84,14 +390,7 @@ class Client(object):
             # Get_Final request.
             request.code = requests.Get_Final.code
 
-        self.socket.sendall(request.encode())
-
-        if isinstance(request, requests.Connect):
-            response = self.response_handler.decode_connection(self.socket)
-        else:
-            response = self.response_handler.decode(self.socket)
-
-        return response
+        return self._send_request(request, limit)
 
     def _collect_parts(self, header_list):
         body = []
@@ -126,6 +425,7 @@ class Client(object):
         else:
             self._external_socket = True
 
+    @_instrumented("connect")
     def connect(self, header_list = ()):
         """connect(self, header_list = ())
 
@@ -137,15 +437,53 @@ class Client(object):
         header_list keyword argument.
         """
 
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(self.address, self.profile)
+
         if not self._external_socket:
             self.socket = BluetoothSocket()
 
-        self.socket.connect((self.address, self.port))
+        try:
+            self.socket.connect((self.address, self.port))
+        except OSError:
+            if cached is None or self._external_socket:
+                raise
+            # the service may have moved to another channel since it was
+            # cached, so look it up again
+            self.socket.close()
+            port = self.cache.discover(self.address, self.profile).channel
+            if port == self.port:
+                raise
+            logger.info("%s moved from channel %i to %i", self.profile,
+                    self.port, port)
+            self.port = port
+            self.socket = BluetoothSocket()
+            self.socket.connect((self.address, self.port))
+
+        if self.reliable is not None:
+            self._create_session()
+
+        if self.instrument is not None:
+            self.instrument.session_start((self.address, self.port))
+
+        offered = self.max_packet_length
+        if self.sizers is not None:
+            if cached is not None and cached.goodput:
+                for direction, sizer in self.sizers.items():
+                    if not sizer.goodput:
+                        sizer.goodput = dict((int(size), rate) for size, rate
+                                in cached.goodput.get(direction, {}).items())
+            offered = self._get_size = self.sizers["get"].next_size(offered)
 
         flags = 0
-        data = (self.obex_version.to_byte(), flags, self.max_packet_length)
+        data = (self.obex_version.to_byte(), flags, offered)
 
+        # the server's limit is only known once it responds, unless it was
+        # cached from an earlier connection
         max_length = self.max_packet_length
+        if cached is not None and cached.remote_max_packet_length:
+            max_length = min(max_length, cached.remote_max_packet_length)
         request = requests.Connect(data)
 
         header_list = list(header_list)
@@ -153,17 +491,26 @@ class Client(object):
 
         if isinstance(response, responses.ConnectSuccess):
             self.remote_info = response
+            self.cwd = ()
+            if self.cache is not None:
+                self.cache.connected(self.address, self.profile, self.port,
+                        response, offered)
             for header in response.header_data:
                 if isinstance(header, headers.Connection_ID):
                     # Recycle the Connection ID data to create a new header
                     # for future use.
                     self.connection_id = headers.Connection_ID(header.decode())
-        elif not self._external_socket:
-            self.socket.close()
+        else:
+            self._close_session()
+            if not self._external_socket:
+                self.socket.close()
 
         if not isinstance(response, responses.ConnectSuccess):
+            if self.instrument is not None:
+                self.instrument.session_end()
             raise OBEXError(response)
 
+    @_instrumented("disconnect")
     def disconnect(self, header_list = ()):
         """disconnect(self, header_list = ())
 
@@ -180,19 +527,35 @@ class Client(object):
         max_length = self.remote_info.max_packet_length
         request = requests.Disconnect()
 
+        self._close_session()
         header_list = list(header_list)
         response = self._send_headers(request, header_list, max_length)
 
+        if self.sizers is not None:
+            logger.debug("packet sizing for %s: %r", self.address, self.sizers)
+            if self.cache is not None:
+                self.cache.measured(self.address, self.profile, dict(
+                    (direction, sizer.goodput)
+                    for direction, sizer in self.sizers.items()))
+
         if not self._external_socket:
             self.socket.close()
 
         self.connection_id = None
+        self.cwd = None
+
+        if self.instrument is not None:
+            self.instrument.session_end()
 
         if not isinstance(response, responses.Success):
             raise OBEXError(response)
 
-    def put(self, name, file_data, header_list = ()):
-        """put(self, name, file_data, header_list = ())
+    @_instrumented("put", lambda args, kwargs, result:
+            len(args[1] if len(args) > 1 else kwargs["file_data"]))
+    def put(self, name, file_data, header_list = (), timeout = None,
+            cancel = None):
+        """put(self, name, file_data, header_list = (), timeout = None,
+               cancel = None)
 
         Performs an OBEX PUT request to send a file with the given name,
         containing the file_data specified, to the server for storage in
@@ -203,50 +566,84 @@ class Client(object):
         file length information associated with the name and file_data
         supplied.
 
+        If the transfer takes longer than timeout seconds, or the
+        CancelToken given as cancel is cancelled, the PUT is aborted and
+        OperationAborted is raised. The session remains usable unless the
+        server fails to answer the Abort.
+
         This function does not return anything. If a failure response is
         received, an OBEXError will be raised with the error response as
         its argument.
         """
 
-        for response in self._put(name, file_data, header_list):
-            if isinstance(response, responses.Continue) or \
-                    isinstance(response, responses.Success):
-                continue
-            else:
-                raise OBEXError(response)
+        with self._limited(timeout, cancel) as limit:
+            for response in self._put(name, file_data, header_list, limit):
+                if isinstance(response, responses.Continue) or \
+                        isinstance(response, responses.Success):
+                    continue
+                else:
+                    raise OBEXError(response)
+
+    def _put(self, name, file_data, header_list = (), limit = None):
+        return self._put_stream(name, io.BytesIO(file_data).read,
+                len(file_data), header_list, limit)
+
+    def _put_stream(self, name, read, length, header_list = (), limit = None,
+            srm = False, defer_final = False):
+        """Sends a PUT of length bytes returned by read(size), yielding the
+        responses. With srm, Single Response Mode is requested, and if the
+        server enables it, the body is sent without waiting for a response
+        to each packet. With defer_final, the response to the last packet
+        is not waited for, and None is yielded in its place; the next
+        request sent reads it, passing it to self._deferred."""
 
-    def _put(self, name, file_data, header_list = ()):
         header_list = [
                 headers.Name(name),
-                headers.Length(len(file_data))
+                headers.Length(length)
                 ] + list(header_list)
+        if srm:
+            header_list.append(
+                    headers.Single_Response_Mode(headers.SRM_ENABLE))
 
         max_length = self.remote_info.max_packet_length
         request = requests.Put()
 
-        response = self._send_headers(request, header_list, max_length)
+        response = self._send_headers(request, header_list, max_length, limit)
         yield response
 
         if not isinstance(response, responses.Continue):
             return
+        single = srm and _srm_enabled(response)
 
         # Send the file data.
 
         # The optimum size is the maximum packet length accepted by the
         # remote device minus three bytes for the header ID and length
         # minus three bytes for the request.
-        optimum_size = max_length - 3 - 3
-
-        i = 0
-        while i < len(file_data):
-            data = file_data[i:i+optimum_size]
-            i += len(data)
-            if i < len(file_data):
+        sizer = not single and self.sizers and self.sizers["put"]
+        packet_size = max_length
+
+        sent = 0
+        while True:
+            if limit is not None:
+                limit.check()
+            if sizer:
+                packet_size = sizer.next_size(max_length)
+            data = read(min(packet_size - 3 - 3, length - sent))
+            sent += len(data)
+            if data and sent < length:
                 request = requests.Put()
                 request.add_header(headers.Body(data, False), max_length)
-                self.socket.sendall(request.encode())
 
-                response = self.response_handler.decode(self.socket)
+                if single:
+                    self._send_unanswered(request)
+                    continue
+
+                start = time.perf_counter()
+                response = self._send_request(request, limit)
+                if sizer:
+                    sizer.record(packet_size, len(data),
+                            time.perf_counter() - start)
                 yield response
 
                 if not isinstance(response, responses.Continue):
@@ -255,16 +652,41 @@ class Client(object):
             else:
                 request = requests.Put_Final()
                 request.add_header(headers.End_Of_Body(data, False), max_length)
-                self.socket.sendall(request.encode())
 
-                response = self.response_handler.decode(self.socket)
-                yield response
+                if defer_final:
+                    self._send_unanswered(request)
+                    yield None
+                else:
+                    yield self._send_request(request, limit)
+                return
 
-                if not isinstance(response, responses.Success):
-                    return
+    def _send_unanswered(self, request):
+        """Sends a request packet without waiting for a response, raising
+        OBEXError if the server has already answered with an error, as it
+        may part way through a Single Response Mode operation."""
+
+        readable, _, _ = select.select([self.socket], [], [], 0)
+        if readable:
+            raise OBEXError(self.response_handler.decode(self.socket))
+
+        data = request.encode()
+        if self.instrument is not None:
+            self.instrument.packet(SENT, request.code, len(data),
+                    time.perf_counter())
+        self.socket.sendall(data)
+
+    def _finish_deferred(self):
+        """Reads the response to a request sent by _put_stream() with
+        defer_final, passing it to the callback in self._deferred"""
 
-    def get(self, name = None, header_list = ()):
-        """get(self, name = None, header_list = (), callback = None)
+        callback, self._deferred = self._deferred, None
+        callback(self.response_handler.decode(self.socket))
+
+    @_instrumented("get", lambda args, kwargs, result: len(result[1]))
+    def get(self, name = None, header_list = (), timeout = None,
+            cancel = None):
+        """get(self, name = None, header_list = (), timeout = None,
+               cancel = None)
 
         Performs an OBEX GET request to retrieve a file with the given name
         from the server's current directory for the session.
@@ -273,6 +695,11 @@ class Client(object):
         header_list keyword argument. These will be sent after the name
         information.
 
+        If the transfer takes longer than timeout seconds, or the
+        CancelToken given as cancel is cancelled, the GET is aborted and
+        OperationAborted is raised. The session remains usable unless the
+        server fails to answer the Abort.
+
         This method returns a tuple of the form (resp_header_list, body)
         where resp_header_list is a list of all non-body response headers,
         and body is a reconstructed byte string of the response body.
@@ -280,19 +707,74 @@ class Client(object):
 
         returned_headers = []
 
-        for response in self._get(name, header_list):
-            if isinstance(response, responses.Continue) or \
-                    isinstance(response, responses.Success):
-                # collect responses for processing at end
-                returned_headers += response.header_data
-            else:
-                # Raise an exception for the failure
-                raise OBEXError(response)
+        with self._limited(timeout, cancel) as limit:
+            for response in self._get(name, header_list, limit):
+                if isinstance(response, responses.Continue) or \
+                        isinstance(response, responses.Success):
+                    # collect responses for processing at end
+                    returned_headers += response.header_data
+                else:
+                    # Raise an exception for the failure
+                    raise OBEXError(response)
 
         # Finally, return the collected responses
         return self._collect_parts(returned_headers)
 
-    def _get(self, name = None, header_list = ()):
+    def get_chunks(self, name = None, header_list = ()):
+        """get_chunks(self, name = None, header_list = ())
+
+        Performs an OBEX GET request like get(), but as a generator yielding
+        the body data of each response packet as it arrives, so that large
+        objects can be processed while they are still being received.
+
+        Raises an OBEXError with the response if the server refuses the
+        request. The generator returns the list of non-body response headers
+        (available through "yield from"). If it is closed before the body
+        is complete, the transfer is aborted between packets, so the rest of
+        the object is never sent. If the server does not answer the Abort,
+        the connection is closed.
+        """
+
+        start = time.perf_counter()
+        returned_headers = []
+        size = 0
+        response = None
+        responses_left = self._get(name, header_list)
+        try:
+            for response in responses_left:
+                if not (isinstance(response, responses.Continue) or
+                        isinstance(response, responses.Success)):
+                    raise OBEXError(response)
+                for header in response.header_data:
+                    if isinstance(header, (headers.Body, headers.End_Of_Body)):
+                        if header.data:
+                            size += len(header.data)
+                            yield header.data
+                    else:
+                        returned_headers.append(header)
+        except GeneratorExit:
+            # the consumer stopped early; no Get_Final is outstanding between
+            # packets, so the server is waiting for the next request
+            responses_left.close()
+            if isinstance(response, responses.Continue):
+                if self._send_abort():
+                    logger.info("get of %s closed early, aborted", name)
+                else:
+                    logger.warning("get of %s closed early and the server "
+                            "stopped responding, closing the connection", name)
+                    self._drop_connection()
+            raise
+        except Exception as e:
+            if self.instrument is not None:
+                self.instrument.operation("get", time.perf_counter() - start,
+                        0, e)
+            raise
+
+        if self.instrument is not None:
+            self.instrument.operation("get", time.perf_counter() - start, size)
+        return returned_headers
+
+    def _get(self, name = None, header_list = (), limit = None):
         header_list = list(header_list)
         if name is not None:
             header_list = [headers.Name(name)] + header_list
@@ -300,7 +782,7 @@ class Client(object):
         max_length = self.remote_info.max_packet_length
         request = requests.Get()
 
-        response = self._send_headers(request, header_list, max_length)
+        response = self._send_headers(request, header_list, max_length, limit)
         yield response
 
         if not (isinstance(response, responses.Continue) or
@@ -310,12 +792,21 @@ class Client(object):
         # Retrieve the file data.
         file_data = []
         request = requests.Get_Final()
+        sizer = self.sizers and self.sizers["get"]
 
         while isinstance(response, responses.Continue):
-            self.socket.sendall(request.encode())
-            response = self.response_handler.decode(self.socket)
+            if limit is not None:
+                limit.check()
+            start = time.perf_counter()
+            response = self._send_request(request, limit)
+            if sizer and isinstance(response, responses.Continue):
+                # the last packet is usually partly filled, so only the
+                # ones before it show what the packet length can do
+                sizer.record(self._get_size, _body_length(response),
+                        time.perf_counter() - start)
             yield response
 
+    @_instrumented("setpath")
     def setpath(self, name = "", create_dir = False, to_parent = False, header_list = ()):
         """setpath(self, name = "", create_dir = False, to_parent = False, header_list = ())
 
@@ -351,6 +842,89 @@ class Client(object):
         if not isinstance(response, responses.Success):
             raise OBEXError(response)
 
+        self.cwd = self._setpath_target(name, to_parent)
+
+    def _setpath_target(self, name, to_parent):
+        """Returns the directory reached by a successful SETPATH, or None if
+        it cannot be known."""
+
+        if name == "" and not to_parent:
+            # an empty name resets to the root directory
+            return ()
+        cwd = self.cwd
+        if cwd is None or (name is None and not to_parent):
+            return None
+        if to_parent:
+            cwd = cwd[:-1]
+        if name:
+            parts = [p for p in name.split("/") if p]
+            if any(p in (".", "..") for p in parts):
+                return None
+            cwd = cwd + tuple(parts)
+        return cwd
+
+    def chdir(self, path):
+        """chdir(self, path)
+
+        Changes the server's current directory for the session to the given
+        path, with as few SETPATH requests as possible. Paths starting with
+        "/" are relative to the root directory, others to the current
+        directory, and ".." names the parent directory.
+
+        Nothing is sent if the server is already in that directory. A move
+        to a sibling directory backs up a level and enters it in a single
+        request, and moves to distant directories reset to the root first
+        when that is shorter. Raises an OBEXError with the response if any
+        step fails, leaving cwd at the last directory reached.
+        """
+
+        parts = [p for p in path.split("/") if p and p != "."]
+        if self.cwd is None and not path.startswith("/"):
+            # without a known starting point, take the steps as given
+            for p in parts:
+                if p == "..":
+                    self.setpath(to_parent=True)
+                else:
+                    self.setpath(p)
+            return
+
+        target = [] if path.startswith("/") else list(self.cwd)
+        for p in parts:
+            if p == "..":
+                if target:
+                    target.pop()
+            else:
+                target.append(p)
+        target = tuple(target)
+
+        if self.cwd is None:
+            self.setpath("")
+        if self.cwd == target:
+            return
+
+        common = 0
+        for a, b in zip(self.cwd, target):
+            if a != b:
+                break
+            common += 1
+        ups = len(self.cwd) - common
+        downs = target[common:]
+        # the last step up and the first step down share a request
+        relative_cost = ups + len(downs) - (1 if ups and downs else 0)
+
+        if 1 + len(target) < relative_cost:
+            self.setpath("")
+            downs = target
+        else:
+            for i in range(ups - 1 if downs else ups):
+                self.setpath(to_parent=True)
+            if ups and downs:
+                self.setpath(downs[0], to_parent=True)
+                downs = downs[1:]
+        for d in downs:
+            self.setpath(d)
+
+    @_instrumented("delete")
     def delete(self, name, header_list = ()):
         """delete(self, name, header_list = ())
 
@@ -371,6 +945,7 @@ class Client(object):
         if not isinstance(response, responses.Success):
             raise OBEXError(response)
 
+    @_instrumented("abort")
     def abort(self, header_list = ()):
         """abort(self, header_list = ())
 
@@ -394,8 +969,8 @@ class Client(object):
         if not isinstance(response, responses.Success):
             raise OBEXError(response)
 
-    def listdir(self, name = "", xml=False):
-        """listdir(self, name = "")
+    def listdir(self, name = "", xml=False, timeout=None, cancel=None):
+        """listdir(self, name = "", xml=False, timeout=None, cancel=None)
 
         Requests information about the contents of the directory with the
         specified name relative to the current directory for the session.
@@ -408,10 +983,13 @@ class Client(object):
         Else, this function will parse the XML and return a tuple of two lists,
         the first list being the folder names, and the second list being
         file names.
+
+        timeout and cancel limit the GET of the listing as for get().
         """
 
         hdrs, data = self.get(name,
-                header_list=[headers.Type(b"x-obex/folder-listing", False)])
+                header_list=[headers.Type(b"x-obex/folder-listing", False)],
+                timeout=timeout, cancel=cancel)
 
         if xml:
             return data
@@ -427,6 +1005,106 @@ class Client(object):
             elif e.tag == "parent-folder":
                 pass # ignore it
             else:
-                sys.stderr.write("Unknown listing element %s\n" % e.tag)
+                logger.warning("Unknown listing element %s", e.tag)
 
         return folders, files
+
+class SharedClient(object):
+    """SharedClient(client)
+
+    Lets many threads share one connected client. Operations are queued
+    and performed one at a time on the session by a worker thread, and
+    each returns a concurrent.futures.Future of its result.
+
+    Each thread has its own current directory, starting at the root and
+    changed with chdir(), which only affects that thread's later
+    operations. Before an operation runs, the session is moved to the
+    directory of the thread that queued it using Client.chdir(), which
+    sends nothing if the session is already there.
+
+    The wrapped client must not be used directly while shared. close()
+    waits for the queued operations to finish, and by default disconnects.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def getcwd(self):
+        """Returns the calling thread's current directory"""
+        return getattr(self._local, "cwd", "/")
+
+    def chdir(self, path):
+        """chdir(self, path)
+
+        Changes the calling thread's current directory. Paths starting with
+        "/" are absolute, and ".." refers to the parent directory. The
+        directory is not checked until an operation is performed in it.
+        """
+
+        self._local.cwd = posixpath.normpath(
+                posixpath.join(self.getcwd(), path))
+
+    def submit(self, function, *args, **kwargs):
+        """submit(self, function, *args, **kwargs)
+
+        Queues function(client, *args, **kwargs), to be called in the
+        calling thread's current directory, and returns a Future of its
+        result.
+        """
+
+        future = concurrent.futures.Future()
+        self._queue.put((future, self.getcwd(), function, args, kwargs))
+        return future
+
+    def get(self, name = None, header_list = (), timeout = None,
+            cancel = None):
+        return self.submit(Client.get, name, header_list, timeout, cancel)
+
+    def put(self, name, file_data, header_list = (), timeout = None,
+            cancel = None):
+        return self.submit(Client.put, name, file_data, header_list, timeout,
+                cancel)
+
+    def delete(self, name, header_list = ()):
+        return self.submit(Client.delete, name, header_list)
+
+    def listdir(self, name = "", xml=False, timeout=None, cancel=None):
+        return self.submit(Client.listdir, name, xml, timeout, cancel)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, cwd, function, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self.client.chdir(cwd)
+                result = function(self.client, *args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def close(self, disconnect=True):
+        """close(self, disconnect=True)
+
+        Waits for the queued operations to be performed, then stops the
+        worker thread and disconnects the client if disconnect is true.
+        """
+
+        self._queue.put(None)
+        self._worker.join()
+        if disconnect:
+            self.client.disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -22,12 +22,23 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import socket, struct, sys
+import socket, struct, sys, time
 from nOBEX import headers
+from nOBEX.instrument import RECEIVED
 
 class OBEXError(Exception):
     pass
 
+class OperationAborted(OBEXError):
+    """Raised when an operation is abandoned because its deadline passed or
+    it was cancelled. closed is true if the server did not answer the Abort
+    in time, so the connection had to be closed."""
+
+    def __init__(self, reason, closed=False):
+        super(OperationAborted, self).__init__(reason)
+        self.reason = reason
+        self.closed = closed
+
 class OBEX_Version:
     major = 1
     minor = 0
@@ -82,7 +93,7 @@ class Message(object):
                 i += 3 + length
             elif ID_type == 0x80:
                 # 1 byte
-                data = header_data[i+1]
+                data = header_data[i+1:i+2]
                 i += 2
             elif ID_type == 0xc0:
                 # 4 bytes
@@ -108,22 +119,22 @@ class Message(object):
         # message format is >BH then data
         # let's first encode the data, then chunk it up
         # headers must not be split across packets
-        data_chunks = [struct.pack(self.format, *self.data)]
+        data_chunks = [struct.pack(">" + self.format.lstrip(">"), *self.data)]
         data_chunks.extend(map(lambda h: h.data, self.header_data))
 
         total_data = sum([len(c) for c in data_chunks])
         bytes_chunked = 0
         last_chunk = False
 
-        assert(multi_part or total_data < csize)
+        assert(multi_part or total_data <= csize - 3)
 
         msg_chunks = []
 
         # leave 3 bytes for message headers
         while (bytes_chunked < total_data) or (len(msg_chunks) == 0):
-            assert(len(data_chunks[0]) < csize - 3)
+            assert(len(data_chunks[0]) <= csize - 3)
             chunk = b''
-            while len(data_chunks) and (len(chunk) + len(data_chunks[0]) < csize - 3):
+            while len(data_chunks) and (len(chunk) + len(data_chunks[0]) <= csize - 3):
                 bytes_chunked += len(data_chunks[0])
                 chunk += data_chunks.pop(0)
                 if len(data_chunks) == 0: last_chunk = True
@@ -141,25 +152,40 @@ class Message(object):
             return msg_chunks[0]
 
 class MessageHandler:
+    # set to an nOBEX.instrument.Instrument to report received packets
+    instrument = None
+
     def _read_packet(self, socket_):
-        if hasattr(socket, "MSG_WAITALL"):
-            data = socket_.recv(3, socket.MSG_WAITALL)
-        else:
-            # Windows lacks MSG_WAITALL
-            data = b''
-            while len(data) < 3:
-                data += socket_.recv(3 - len(data))
-
-        type, length = struct.unpack(">BH", data)
-        body_len = length - 3
-        while body_len > 0:
-            read_len = 32767 if body_len > 32767 else body_len
-            data += socket_.recv(read_len, socket.MSG_WAITALL)
-            body_len -= read_len
-        return type, data
+        # Windows lacks MSG_WAITALL, and sockets with a timeout may return
+        # less than asked for even with it, so keep reading until the
+        # packet is complete
+        flags = getattr(socket, "MSG_WAITALL", 0)
+        data = b''
+        length = 3
+        try:
+            while len(data) < length:
+                read_len = min(length - len(data), 32767)
+                chunk = socket_.recv(read_len, flags)
+                if not chunk:
+                    raise ConnectionResetError("connection closed by peer")
+                data += chunk
+                if length == 3 and len(data) == 3:
+                    length = max(struct.unpack(">H", data[1:3])[0], 3)
+        except socket.timeout:
+            if data:
+                # the rest of the packet may still arrive, so the stream
+                # can no longer be followed
+                raise ConnectionAbortedError("timed out part way through "
+                        "a packet")
+            raise
+
+        return struct.unpack(">B", data[:1])[0], data
 
     def decode(self, socket_):
         code, data = self._read_packet(socket_)
+        if self.instrument is not None:
+            self.instrument.packet(RECEIVED, code, len(data),
+                    time.perf_counter())
         if code in self.message_dict:
             message = self.message_dict[code]()
             message.read_data(data)
@@ -0,0 +1,182 @@
+"""
+devicecache.py - persistent per-device service and connection parameters
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json, logging, os, threading, time
+from nOBEX.bluez_helper import find_service_record
+
+logger = logging.getLogger(__name__)
+
+class DeviceProfile(object):
+    """What is known about one profile on one device. channel, l2cap_psm
+    and features come from the SDP record, with srm true if the device
+    advertises OBEX over L2CAP, which requires SRM support. The remaining
+    fields describe the last successful connection: the OBEX version byte
+    and maximum packet length the server sent, the packet length that was
+    negotiated, and when it happened. goodput maps "get" and "put" to the
+    throughput measured for each packet length by adaptive clients (see
+    nOBEX.sizing)."""
+
+    __slots__ = ("channel", "l2cap_psm", "features", "obex_version",
+            "max_packet_length", "remote_max_packet_length", "connected",
+            "goodput")
+
+    def __init__(self, channel=None, l2cap_psm=None, features=None,
+            obex_version=None, max_packet_length=None,
+            remote_max_packet_length=None, connected=None, goodput=None):
+        self.channel = channel
+        self.l2cap_psm = l2cap_psm
+        self.features = features
+        self.obex_version = obex_version
+        self.max_packet_length = max_packet_length
+        self.remote_max_packet_length = remote_max_packet_length
+        self.connected = connected
+        self.goodput = goodput
+
+    @property
+    def srm(self):
+        return self.l2cap_psm is not None
+
+    def to_dict(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**dict((k, d.get(k)) for k in cls.__slots__))
+
+    def __repr__(self):
+        return "<DeviceProfile channel %s, max packet %s, srm %s>" % (
+                self.channel, self.max_packet_length, self.srm)
+
+class DeviceCache(object):
+    """DeviceCache(path=None)
+
+    Caches the SDP record and connection parameters of each profile on each
+    device, keyed by Bluetooth address and profile name (such as "pbap" or
+    "map"), so reconnecting to a device does not need another SDP search.
+    With a path, the cache is loaded from and saved to that JSON file
+    whenever it changes, so it persists between runs. It may be shared by
+    clients in several threads.
+
+    Pass the cache to a client with Client.set_cache() to have connect()
+    update it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for address, profiles in json.load(f).items():
+                    for profile, d in profiles.items():
+                        self._entries[(address, profile)] = \
+                                DeviceProfile.from_dict(d)
+
+    @staticmethod
+    def _key(address, profile):
+        return address.upper(), profile.lower()
+
+    def get(self, address, profile):
+        """Returns the cached DeviceProfile, or None if there is none"""
+        with self._lock:
+            return self._entries.get(self._key(address, profile))
+
+    def discover(self, address, profile):
+        """Searches the device's SDP records for the profile, replacing any
+        cached record, and returns the updated DeviceProfile"""
+
+        record = find_service_record(profile, address)
+        key = self._key(address, profile)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.channel != record["channel"]:
+                # the old connection parameters were for another service
+                entry = DeviceProfile()
+                self._entries[key] = entry
+            entry.channel = record["channel"]
+            entry.l2cap_psm = record["l2cap_psm"]
+            entry.features = record["features"]
+            self._save()
+        logger.info("discovered %s on %s: %r", profile, address, entry)
+        return entry
+
+    def channel(self, address, profile):
+        """Returns the RFCOMM channel of the profile, only searching SDP
+        records if it is not cached"""
+
+        entry = self.get(address, profile)
+        if entry is None or entry.channel is None:
+            entry = self.discover(address, profile)
+        return entry.channel
+
+    def connected(self, address, profile, channel, response, max_length):
+        """Records a successful connection on the given channel. response is
+        the ConnectSuccess received, and max_length the maximum packet
+        length offered to the server."""
+
+        key = self._key(address, profile)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.channel != channel:
+                entry = DeviceProfile(channel)
+                self._entries[key] = entry
+            entry.obex_version = response.obex_version.to_byte()
+            entry.remote_max_packet_length = response.max_packet_length
+            entry.max_packet_length = min(max_length,
+                    response.max_packet_length)
+            entry.connected = time.time()
+            self._save()
+
+    def measured(self, address, profile, goodput):
+        """Records the goodput measured for each packet length, as a dict
+        of "get" and "put" to the goodput attributes of PacketSizers"""
+
+        key = self._key(address, profile)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = DeviceProfile()
+                self._entries[key] = entry
+            entry.goodput = dict((direction, dict((str(size), rate)
+                for size, rate in sizes.items()))
+                for direction, sizes in goodput.items())
+            self._save()
+
+    def forget(self, address, profile=None):
+        """Drops what is cached for the device, or just one of its profiles"""
+
+        address, profile = self._key(address, profile or "")
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == address and (not profile or key[1] == profile):
+                    del self._entries[key]
+            self._save()
+
+    def _save(self):
+        if self.path is None:
+            return
+        data = {}
+        for (address, profile), entry in self._entries.items():
+            data.setdefault(address, {})[profile] = entry.to_dict()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -0,0 +1,351 @@
+"""
+export.py - columnar export of harvested PBAP and MAP data
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import array, json, struct, sys, zlib
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Column kinds: 64-bit signed integers, and strings stored as indices into
+# a per-chunk string table
+INT = "int"
+STR = "str"
+
+# The tables written for a harvested device
+TABLES = {
+    "contacts": (("folder", STR), ("handle", STR), ("name", STR),
+        ("structured_name", STR), ("tel", STR), ("email", STR), ("org", STR),
+        ("photo_bytes", INT)),
+    "calls": (("folder", STR), ("handle", STR), ("name", STR), ("tel", STR),
+        ("call_type", STR), ("datetime", STR)),
+    "messages": (("folder", STR), ("handle", STR), ("datetime", STR),
+        ("type", STR), ("subject", STR), ("sender_name", STR),
+        ("sender_addressing", STR), ("recipient_name", STR),
+        ("recipient_addressing", STR), ("size", INT),
+        ("attachment_size", INT), ("read", INT), ("priority", INT))
+}
+
+# phone book folders holding call history rather than contacts
+CALL_FOLDERS = ("ich", "och", "mch", "cch")
+
+_MAGIC = b"nOBEXcol\x01"
+_chunk_head = struct.Struct(">II")
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def _str(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return str(value) if value is not None else ""
+
+def _text(values):
+    # several TEL or EMAIL properties share a column, one per line
+    return "\n".join(v.strip() for v in values if isinstance(v, str))
+
+def _int_array(values):
+    a = array.array("q", values)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+def _encode_column(kind, values):
+    if kind == INT:
+        return _int_array(values).tobytes(), None
+
+    table = {}
+    indices = array.array("I", [table.setdefault(v, len(table))
+            for v in values])
+    strings = [s.encode("utf-8", "surrogateescape") for s in table]
+    ends = array.array("I")
+    end = 0
+    for s in strings:
+        end += len(s)
+        ends.append(end)
+    if sys.byteorder == "big":
+        indices.byteswap()
+        ends.byteswap()
+    return indices.tobytes() + ends.tobytes() + b"".join(strings), len(table)
+
+class Writer(object):
+    """Writer(path, device="", chunk_rows=4096)
+
+    Writes harvested records to a single compact columnar file. Rows are
+    buffered per table and written out as a compressed chunk every
+    chunk_rows rows, so the file is built incrementally as records stream
+    in and only one chunk per table is held in memory. Strings are
+    dictionary coded within each chunk, so repetitive columns such as the
+    folder or message type cost a few bytes per row.
+
+    Tables are those of TABLES, plus any registered with define(). Use as a
+    context manager, or call close() to write the last chunks.
+    """
+
+    def __init__(self, path, device="", chunk_rows=4096):
+        self.chunk_rows = chunk_rows
+        self.tables = dict(TABLES)
+        self._rows = {}
+        self._file = open(path, "wb")
+        meta = json.dumps({"device": device}).encode("utf-8")
+        self._file.write(_MAGIC + _chunk_head.pack(len(meta), 0) + meta)
+
+    def define(self, table, columns):
+        """Registers a table with columns given as (name, kind) pairs"""
+        self.tables[table] = tuple(columns)
+
+    def append(self, table, row):
+        """Adds a row, given as a dict keyed by column name. Missing
+        columns are left empty or zero."""
+        rows = self._rows.setdefault(table, [])
+        rows.append(row)
+        if len(rows) >= self.chunk_rows:
+            self._write_chunk(table)
+
+    def _write_chunk(self, table):
+        rows = self._rows.pop(table, None)
+        if not rows:
+            return
+        columns = []
+        payload = []
+        for name, kind in self.tables[table]:
+            if kind == INT:
+                values = [_int(row.get(name)) for row in rows]
+            else:
+                values = [_str(row.get(name)) for row in rows]
+            data, strings = _encode_column(kind, values)
+            columns.append([name, kind, len(data), strings])
+            payload.append(data)
+
+        head = json.dumps({"table": table, "rows": len(rows),
+            "columns": columns}).encode("utf-8")
+        payload = zlib.compress(b"".join(payload))
+        self._file.write(_chunk_head.pack(len(head), len(payload)))
+        self._file.write(head)
+        self._file.write(payload)
+
+    def flush(self):
+        for table in list(self._rows):
+            self._write_chunk(table)
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_contact(self, folder, handle, card):
+        """Adds a parsed nOBEX.vcard.VCard to the contacts table, or to the
+        calls table if the folder holds call history"""
+        name = card.get("FN") or card.get("N") or ""
+        tel = _text(card.get_all("TEL"))
+        if folder.rstrip("/").rsplit("/", 1)[-1] in CALL_FOLDERS:
+            call_type = ""
+            when = ""
+            for prop in card:
+                if prop.name == "X-IRMC-CALL-DATETIME":
+                    call_type = ",".join(prop.params.get("TYPE", ()))
+                    when = _str(prop.value).strip()
+                    break
+            self.append("calls", {"folder": folder, "handle": handle,
+                "name": name, "tel": tel, "call_type": call_type,
+                "datetime": when})
+        else:
+            photo = card.get("PHOTO", b"")
+            self.append("contacts", {"folder": folder, "handle": handle,
+                "name": name, "structured_name": card.get("N"),
+                "tel": tel, "email": _text(card.get_all("EMAIL")),
+                "org": card.get("ORG"), "photo_bytes": len(photo)})
+
+    def add_message(self, folder, attrib):
+        """Adds a MAP message listing entry, given as the attributes of its
+        <msg> element, to the messages table"""
+        row = dict(attrib)
+        row["folder"] = folder
+        row["read"] = 1 if attrib.get("read", "").lower() == "yes" else 0
+        row["priority"] = 1 if attrib.get("priority", "").lower() == "yes" \
+                else 0
+        self.append("messages", row)
+
+def _decode_column(kind, data, rows, strings):
+    if kind == INT:
+        if numpy is not None:
+            return numpy.frombuffer(data, dtype="<i8").copy()
+        a = array.array("q")
+        a.frombytes(data)
+        if sys.byteorder == "big":
+            a.byteswap()
+        return a
+
+    indices = array.array("I")
+    indices.frombytes(data[:rows * 4])
+    ends = array.array("I")
+    ends.frombytes(data[rows * 4:(rows + strings) * 4])
+    if sys.byteorder == "big":
+        indices.byteswap()
+        ends.byteswap()
+    blob = data[(rows + strings) * 4:]
+    table = []
+    start = 0
+    for end in ends:
+        table.append(blob[start:end].decode("utf-8", "surrogateescape"))
+        start = end
+    if numpy is not None:
+        values = numpy.empty(len(table), dtype=object)
+        values[:] = table
+        return values[numpy.frombuffer(indices.tobytes(), dtype="=u4")]
+    return [table[i] for i in indices]
+
+def read_chunks(path):
+    """read_chunks(path)
+
+    Reads a file written by Writer, returning the device name and a
+    generator of (table, columns) tuples, one per chunk, with columns
+    mapping column names to their values.
+    """
+
+    f = open(path, "rb")
+    if f.read(len(_MAGIC)) != _MAGIC:
+        f.close()
+        raise ValueError("%s is not a nOBEX columnar file" % path)
+    head_len, payload_len = _chunk_head.unpack(f.read(_chunk_head.size))
+    device = json.loads(f.read(head_len).decode("utf-8")).get("device", "")
+
+    def chunks():
+        with f:
+            while True:
+                head = f.read(_chunk_head.size)
+                if len(head) < _chunk_head.size:
+                    return
+                head_len, payload_len = _chunk_head.unpack(head)
+                head = json.loads(f.read(head_len).decode("utf-8"))
+                payload = zlib.decompress(f.read(payload_len))
+                rows = head["rows"]
+                columns = {}
+                pos = 0
+                for name, kind, size, strings in head["columns"]:
+                    columns[name] = _decode_column(kind,
+                            payload[pos:pos + size], rows, strings)
+                    pos += size
+                yield head["table"], columns
+
+    return device, chunks()
+
+def _concat(parts):
+    if not parts:
+        return numpy.empty(0, dtype=object) if numpy is not None else []
+    if numpy is not None:
+        return numpy.concatenate(parts)
+    result = parts[0][:]
+    for part in parts[1:]:
+        result.extend(part)
+    return result
+
+class Table(object):
+    """Table(columns)
+
+    Columns of equal length keyed by name. With NumPy installed, columns
+    are NumPy arrays (integers as int64, strings as object arrays), so
+    queries can be vectorized, for instance:
+
+        calls = load(paths, "calls")
+        missed = calls.where(calls["call_type"] == "MISSED")
+
+    Without NumPy, integer columns are array.array and string columns
+    lists, and where() takes any sequence of booleans.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @property
+    def names(self):
+        return list(self.columns)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        for values in self.columns.values():
+            return len(values)
+        return 0
+
+    def where(self, mask):
+        """Returns a Table holding the rows for which mask is true"""
+        if numpy is not None:
+            mask = numpy.asarray(mask, dtype=bool)
+            return Table(dict((k, v[mask]) for k, v in self.columns.items()))
+        keep = [i for i, m in enumerate(mask) if m]
+        columns = {}
+        for k, v in self.columns.items():
+            picked = [v[i] for i in keep]
+            columns[k] = array.array(v.typecode, picked) \
+                    if isinstance(v, array.array) else picked
+        return Table(columns)
+
+    def rows(self):
+        """Iterates over the rows as dicts"""
+        names = self.names
+        for values in zip(*[self.columns[n] for n in names]):
+            yield dict(zip(names, values))
+
+    def __repr__(self):
+        return "<Table %i rows: %s>" % (len(self), ", ".join(self.names))
+
+def load(paths, table):
+    """load(paths, table)
+
+    Loads one table from files written by Writer, typically one per
+    device, concatenated into a single Table. A "device" column records
+    which device each row came from.
+    """
+
+    parts = {}
+    names = None
+    for path in paths:
+        device, chunks = read_chunks(path)
+        for name, columns in chunks:
+            if name != table:
+                continue
+            rows = len(next(iter(columns.values()))) if columns else 0
+            if numpy is not None:
+                devices = numpy.empty(rows, dtype=object)
+                devices[:] = device
+            else:
+                devices = [device] * rows
+            columns["device"] = devices
+            if names is None:
+                names = list(columns)
+            for n in names:
+                parts.setdefault(n, []).append(columns[n])
+
+    if names is None:
+        names = [n for n, kind in TABLES.get(table, ())] + ["device"]
+    return Table(dict((n, _concat(parts.get(n, []))) for n in names))
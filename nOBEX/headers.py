@@ -32,6 +32,9 @@ class Header:
         else:
             self.data = self.encode(data)
 
+    def __repr__(self):
+        return "%s(data=%s)" % (type(self).__name__, repr(self.data))
+
 class UnicodeHeader(Header):
     def decode(self):
         if sys.version_info.major < 3:
@@ -106,8 +109,30 @@ class Connection_ID(FourByteHeader):
     code = 0xCB
 
 class App_Parameters(DataHeader):
+    """App_Parameters(data, encoded=False, tags=None)
+
+    data may be the raw tag-length-value bytes, or a dict mapping tags (or
+    their names in tags, such as PBAP_APP_PARAMS) to values. Encodings of
+    dicts are memoized, so building the same parameters repeatedly is cheap.
+    """
     code = 0x4C
 
+    def __init__(self, data, encoded=False, tags=None):
+        self.tags = tags
+        self.encoded = encoded
+        Header.__init__(self, data, encoded)
+
+    def encode(self, data):
+        if isinstance(data, dict):
+            return _encode_app_parameters(self.code, data, self.tags)
+        return DataHeader.encode(self, data)
+
+    def decode(self, tags=None):
+        """Returns an AppParams mapping of the parameters, with values
+        typed according to tags (or the tags given when constructed)"""
+        data = self.data if self.encoded else memoryview(self.data)[3:]
+        return AppParams(data, tags or self.tags)
+
 class Auth_Challenge(DataHeader):
     code = 0x4D
 
@@ -117,6 +142,241 @@ class Auth_Response(DataHeader):
 class Object_Class(DataHeader):
     code = 0x51
 
+class Session_Parameters(DataHeader):
+    code = 0x52
+
+class Session_Sequence_Number(ByteHeader):
+    code = 0x93
+
+class Single_Response_Mode(ByteHeader):
+    code = 0x97
+
+class SRM_Parameters(ByteHeader):
+    code = 0x98
+
+# Single_Response_Mode values
+SRM_DISABLE = 0x00
+SRM_ENABLE = 0x01
+SRM_SUPPORTED = 0x02
+
+class AppParam(object):
+    """AppParam(tag, name, fmt=None)
+
+    An application parameter tag. fmt is a struct format for fixed size
+    values, or None for variable length values, which decode as bytes.
+    """
+
+    def __init__(self, tag, name, fmt=None):
+        self.tag = tag
+        self.name = name
+        self.fmt = fmt
+        self.size = struct.calcsize(">" + fmt) if fmt else None
+
+    def decode(self, value):
+        if self.fmt is None or len(value) != self.size:
+            # leave malformed values as they are
+            return bytes(value)
+        value = struct.unpack(">" + self.fmt, value)[0]
+        return bytes(value) if isinstance(value, bytes) else value
+
+    def encode(self, value):
+        if self.fmt is None or isinstance(value, bytes):
+            if not isinstance(value, bytes):
+                value = value.encode("utf-8")
+            return value
+        return struct.pack(">" + self.fmt, value)
+
+class AppParamTags(object):
+    """A set of AppParam tags, such as those of a profile, looked up by tag
+    number or by name"""
+
+    def __init__(self, *params):
+        self.by_tag = dict((p.tag, p) for p in params)
+        self.by_name = dict((p.name, p) for p in params)
+
+    def lookup(self, key):
+        if isinstance(key, str):
+            return self.by_name[key]
+        return self.by_tag.get(key)
+
+PBAP_APP_PARAMS = AppParamTags(
+    AppParam(0x01, "Order", "B"),
+    AppParam(0x02, "SearchValue"),
+    AppParam(0x03, "SearchProperty", "B"),
+    AppParam(0x04, "MaxListCount", "H"),
+    AppParam(0x05, "ListStartOffset", "H"),
+    AppParam(0x06, "Filter", "Q"),
+    AppParam(0x07, "Format", "B"),
+    AppParam(0x08, "PhonebookSize", "H"),
+    AppParam(0x09, "NewMissedCalls", "B"),
+    AppParam(0x0A, "PrimaryVersionCounter", "16s"),
+    AppParam(0x0B, "SecondaryVersionCounter", "16s"),
+    AppParam(0x0C, "vCardSelector", "Q"),
+    AppParam(0x0D, "DatabaseIdentifier", "16s"),
+    AppParam(0x0E, "vCardSelectorOperator", "B"),
+    AppParam(0x0F, "ResetNewMissedCalls", "B"),
+    AppParam(0x10, "PbapSupportedFeatures", "I")
+)
+
+MAP_APP_PARAMS = AppParamTags(
+    AppParam(0x01, "MaxListCount", "H"),
+    AppParam(0x02, "StartOffset", "H"),
+    AppParam(0x03, "FilterMessageType", "B"),
+    AppParam(0x04, "FilterPeriodBegin"),
+    AppParam(0x05, "FilterPeriodEnd"),
+    AppParam(0x06, "FilterReadStatus", "B"),
+    AppParam(0x07, "FilterRecipient"),
+    AppParam(0x08, "FilterOriginator"),
+    AppParam(0x09, "FilterPriority", "B"),
+    AppParam(0x0A, "Attachment", "B"),
+    AppParam(0x0B, "Transparent", "B"),
+    AppParam(0x0C, "Retry", "B"),
+    AppParam(0x0D, "NewMessage", "B"),
+    AppParam(0x0E, "NotificationStatus", "B"),
+    AppParam(0x0F, "MASInstanceID", "B"),
+    AppParam(0x10, "ParameterMask", "I"),
+    AppParam(0x11, "FolderListingSize", "H"),
+    AppParam(0x12, "MessagesListingSize", "H"),
+    AppParam(0x13, "SubjectLength", "B"),
+    AppParam(0x14, "Charset", "B"),
+    AppParam(0x15, "FractionRequest", "B"),
+    AppParam(0x16, "FractionDeliver", "B"),
+    AppParam(0x17, "StatusIndicator", "B"),
+    AppParam(0x18, "StatusValue", "B"),
+    AppParam(0x19, "MSETime"),
+    AppParam(0x29, "MapSupportedFeatures", "I")
+)
+
+class AppParams(object):
+    """AppParams(data, tags=None)
+
+    Read only mapping over application parameter tag-length-value data.
+    Keys are tag numbers, or names when tags is given. Values of tags known
+    to tags are decoded to their types, others are returned as bytes.
+
+    Nothing is parsed until the first lookup, which indexes the tag offsets
+    over a memoryview of data without copying it.
+    """
+
+    def __init__(self, data, tags=None):
+        self.data = memoryview(data)
+        self.tags = tags
+        self._offsets = None
+
+    def _index(self):
+        offsets = {}
+        data = self.data
+        i = 0
+        while i + 2 <= len(data):
+            tag = data[i]
+            length = data[i+1]
+            # the first occurrence of a repeated tag wins
+            if tag not in offsets:
+                offsets[tag] = (i + 2, min(i + 2 + length, len(data)))
+            i += 2 + length
+        self._offsets = offsets
+        return offsets
+
+    def _lookup(self, key):
+        offsets = self._offsets
+        if offsets is None:
+            offsets = self._index()
+        if isinstance(key, str):
+            if self.tags is None:
+                raise KeyError(key)
+            param = self.tags.lookup(key)
+            key = param.tag
+        else:
+            param = self.tags.lookup(key) if self.tags else None
+        start, end = offsets[key]
+        return param, self.data[start:end]
+
+    def raw(self, key):
+        """Returns the undecoded bytes of a parameter"""
+        return bytes(self._lookup(key)[1])
+
+    def __getitem__(self, key):
+        param, value = self._lookup(key)
+        return param.decode(value) if param else bytes(value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self._lookup(key)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        offsets = self._offsets
+        if offsets is None:
+            offsets = self._index()
+        return iter(offsets)
+
+    def __len__(self):
+        offsets = self._offsets
+        if offsets is None:
+            offsets = self._index()
+        return len(offsets)
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def named(self):
+        """Returns a dict of the parameters keyed by name where known"""
+        named = {}
+        for tag in self:
+            param = self.tags.lookup(tag) if self.tags else None
+            named[param.name if param else tag] = self[tag]
+        return named
+
+    def __repr__(self):
+        return "AppParams(%r)" % self.named()
+
+def encode_app_params(params, tags=None):
+    """Encodes a dict of parameters, keyed by tag number or by name in tags,
+    into tag-length-value bytes. Values may be bytes, str, or integers for
+    tags with a fixed size format."""
+    out = []
+    for key, value in params.items():
+        param = tags.lookup(key) if tags else None
+        if param is None:
+            if isinstance(key, str):
+                raise KeyError(key)
+            param = AppParam(key, "0x%02X" % key)
+            if not isinstance(value, (bytes, str)):
+                raise TypeError("untyped parameter 0x%02X needs bytes" % key)
+        data = param.encode(value)
+        out.append(struct.pack(">BB", param.tag, len(data)) + data)
+    return b"".join(out)
+
+# memoized App_Parameters header encodings, keyed by parameter items
+_app_parameters_cache = {}
+_APP_PARAMETERS_CACHE_SIZE = 256
+
+def _encode_app_parameters(code, params, tags):
+    try:
+        key = (tuple(params.items()), id(tags))
+        cached = _app_parameters_cache.get(key)
+    except TypeError:
+        # unhashable values can't be memoized
+        key = cached = None
+    if cached is not None:
+        return cached
+
+    data = encode_app_params(params, tags)
+    encoded = struct.pack(">BH", code, len(data) + 3) + data
+    if key is not None:
+        if len(_app_parameters_cache) >= _APP_PARAMETERS_CACHE_SIZE:
+            _app_parameters_cache.clear()
+        _app_parameters_cache[key] = encoded
+    return encoded
+
 header_dict = {
         0xC0: Count,
         0x01: Name,
@@ -133,7 +393,11 @@ header_dict = {
         0x4C: App_Parameters,
         0x4D: Auth_Challenge,
         0x4E: Auth_Response,
-        0x51: Object_Class
+        0x51: Object_Class,
+        0x52: Session_Parameters,
+        0x93: Session_Sequence_Number,
+        0x97: Single_Response_Mode,
+        0x98: SRM_Parameters
 }
 
 def header_class(ID):
@@ -0,0 +1,245 @@
+"""
+instrument.py - optional instrumentation hooks for OBEX clients and servers
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import bisect, threading, time
+
+SENT = 0
+RECEIVED = 1
+
+class Instrument(object):
+    """Instrument
+
+    Base class for instrumentation hooks. Pass an instance to the
+    set_instrument() method of a Client or Server. Every hook does nothing
+    by default, so subclasses only need to override the ones they use.
+    When no instrument is set, the hooks cost a single attribute check.
+
+    Timestamps and durations are in seconds from time.perf_counter().
+    """
+
+    def accept(self, address, accepted):
+        """A server accepted or rejected an incoming connection"""
+        pass
+
+    def session_start(self, peer):
+        """A client connected, or a server started handling a connection.
+        peer is the remote address, if known."""
+        pass
+
+    def session_end(self):
+        """The session started by the last session_start() call ended"""
+        pass
+
+    def packet(self, direction, code, size, timestamp):
+        """An OBEX packet with the given opcode or response code and total
+        size in bytes was SENT or RECEIVED"""
+        pass
+
+    def operation(self, name, elapsed, size=0, error=None):
+        """A complete operation finished. Clients report connect, disconnect,
+        get, put, setpath, delete and abort, with size being the number of
+        body bytes transferred. Servers report the time spent handling each
+        request. error is the exception raised, if the operation failed."""
+        pass
+
+class Tee(Instrument):
+    """Forwards every hook to several instruments"""
+
+    def __init__(self, *instruments):
+        self.instruments = instruments
+
+    def accept(self, address, accepted):
+        for i in self.instruments:
+            i.accept(address, accepted)
+
+    def session_start(self, peer):
+        for i in self.instruments:
+            i.session_start(peer)
+
+    def session_end(self):
+        for i in self.instruments:
+            i.session_end()
+
+    def packet(self, direction, code, size, timestamp):
+        for i in self.instruments:
+            i.packet(direction, code, size, timestamp)
+
+    def operation(self, name, elapsed, size=0, error=None):
+        for i in self.instruments:
+            i.operation(name, elapsed, size, error)
+
+def exponential_buckets(start, factor, count):
+    return [start * factor ** i for i in range(count)]
+
+# 50 us to ~52 s
+LATENCY_BUCKETS = exponential_buckets(50e-6, 2, 21)
+
+# 1 KiB/s to 256 MiB/s
+THROUGHPUT_BUCKETS = exponential_buckets(1024, 2, 19)
+
+class Histogram(object):
+    """A histogram with fixed bucket upper bounds. Values larger than the
+    last bound are counted in an overflow bucket."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, pct):
+        """Returns the upper bound of the bucket holding the given
+        percentile, or infinity if it falls in the overflow bucket."""
+        if self.count == 0:
+            return 0.0
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def as_dict(self):
+        buckets = []
+        for i, c in enumerate(self.counts):
+            if c:
+                le = self.bounds[i] if i < len(self.bounds) else "+Inf"
+                buckets.append((le, c))
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": buckets
+        }
+
+class SessionStats(object):
+    """Statistics gathered for a single session"""
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.start = time.perf_counter()
+        self.end = None
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.rtt = Histogram(LATENCY_BUCKETS)
+        self.throughput = Histogram(THROUGHPUT_BUCKETS)
+        self.operations = {}
+        self.errors = 0
+        self._pending = None
+
+    def as_dict(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "peer": self.peer,
+            "duration": end - self.start,
+            "packets_sent": self.packets_sent,
+            "packets_received": self.packets_received,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "errors": self.errors,
+            "rtt": self.rtt.as_dict(),
+            "throughput": self.throughput.as_dict(),
+            "operations": dict((n, h.as_dict())
+                for n, h in self.operations.items())
+        }
+
+class TransferStats(Instrument):
+    """TransferStats
+
+    Default collector producing per-session packet counts, byte counts, and
+    histograms of round trip times, get/put throughput in bytes per second,
+    and duration of each operation type.
+
+    On a client, the round trip time is the time from sending a request
+    packet to receiving its response. On a server, it is the time from
+    receiving a request packet to sending its response.
+
+    One collector can be shared by clients or servers running in different
+    threads, as long as each thread handles one session at a time.
+    """
+
+    def __init__(self):
+        self.sessions = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            # activity outside of a session, such as a failed connect
+            session = self.session_start(None)
+        return session
+
+    def session_start(self, peer):
+        session = SessionStats(peer)
+        self._local.session = session
+        with self._lock:
+            self.sessions.append(session)
+        return session
+
+    def session_end(self):
+        # the session stays current, so that the operation that ended it
+        # (such as a client disconnect) is still attributed to it
+        session = getattr(self._local, "session", None)
+        if session is not None:
+            session.end = time.perf_counter()
+
+    def packet(self, direction, code, size, timestamp):
+        session = self._session()
+        if direction == SENT:
+            session.packets_sent += 1
+            session.bytes_sent += size
+        else:
+            session.packets_received += 1
+            session.bytes_received += size
+
+        pending = session._pending
+        if pending is not None and pending[0] != direction:
+            session.rtt.observe(timestamp - pending[1])
+            session._pending = None
+        else:
+            session._pending = (direction, timestamp)
+
+    def operation(self, name, elapsed, size=0, error=None):
+        session = self._session()
+        hist = session.operations.get(name)
+        if hist is None:
+            hist = session.operations[name] = Histogram(LATENCY_BUCKETS)
+        hist.observe(elapsed)
+        if error is not None:
+            session.errors += 1
+        elif size and elapsed > 0:
+            session.throughput.observe(size / elapsed)
+
+    def summary(self):
+        with self._lock:
+            sessions = list(self.sessions)
+        return [s.as_dict() for s in sessions]
@@ -0,0 +1,232 @@
+"""
+metrics.py - metrics registry and text exposition endpoint for OBEX servers
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+from nOBEX.instrument import (Instrument, Histogram, LATENCY_BUCKETS,
+        RECEIVED)
+from nOBEX import requests, responses
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(l, "")) for l in self.labels)
+
+    def _label_str(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (k, v.replace('"', '\\"'))
+                for k, v in pairs)
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.doc),
+                "# TYPE %s %s" % (self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._expose_value(key, value))
+        return lines
+
+    def _expose_value(self, key, value):
+        return ["%s%s %s" % (self.name, self._label_str(key), value)]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class HistogramMetric(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), bounds=LATENCY_BUCKETS):
+        super(HistogramMetric, self).__init__(name, doc, labels)
+        self.bounds = bounds
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            hist = self._values.get(key)
+            if hist is None:
+                hist = self._values[key] = Histogram(self.bounds)
+            hist.observe(value)
+
+    def _expose_value(self, key, hist):
+        lines = []
+        cumulative = 0
+        for i, c in enumerate(hist.counts):
+            cumulative += c
+            le = "%g" % hist.bounds[i] if i < len(hist.bounds) else "+Inf"
+            lines.append("%s_bucket%s %i" % (self.name,
+                self._label_str(key, [("le", le)]), cumulative))
+        lines.append("%s_sum%s %s" % (self.name, self._label_str(key), hist.sum))
+        lines.append("%s_count%s %i" % (self.name, self._label_str(key),
+            hist.count))
+        return lines
+
+class Registry(object):
+    """A collection of named metrics that can be exposed as text in the
+    Prometheus exposition format"""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, doc, labels, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, doc, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("metric %s already registered as %s" % (
+                    name, metric.kind))
+            return metric
+
+    def counter(self, name, doc, labels=()):
+        return self._get(Counter, name, doc, labels)
+
+    def gauge(self, name, doc, labels=()):
+        return self._get(Gauge, name, doc, labels)
+
+    def histogram(self, name, doc, labels=(), bounds=LATENCY_BUCKETS):
+        return self._get(HistogramMetric, name, doc, labels, bounds=bounds)
+
+    def expose(self):
+        with self._lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for name, metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+def _code_names(message_dict):
+    return dict((code, cls.__name__.lower())
+            for code, cls in message_dict.items())
+
+_request_names = _code_names(requests.RequestHandler.message_dict)
+_response_names = _code_names(responses.ResponseHandler.message_dict)
+
+def _code_name(names, code):
+    return names.get(code, "0x%02x" % code)
+
+class ServerMetrics(Instrument):
+    """ServerMetrics(registry, server_name)
+
+    Instrument feeding server activity into a Registry. Every metric is
+    labelled with server_name, so several servers can share one registry.
+    """
+
+    def __init__(self, registry, server_name):
+        self.server = server_name
+        self.connections = registry.counter("obex_connections_total",
+                "Incoming connections by outcome", ("server", "outcome"))
+        self.requests = registry.counter("obex_requests_total",
+                "Request packets received by opcode", ("server", "opcode"))
+        self.responses = registry.counter("obex_responses_total",
+                "Response packets sent by response code", ("server", "code"))
+        self.bytes = registry.counter("obex_bytes_total",
+                "Packet bytes by direction", ("server", "direction"))
+        self.latency = registry.histogram("obex_request_seconds",
+                "Time spent handling each request", ("server", "operation"))
+        self.sessions = registry.gauge("obex_active_sessions",
+                "Sessions currently being served", ("server",))
+        self.errors = registry.counter("obex_request_errors_total",
+                "Requests whose handler raised an exception",
+                ("server", "operation"))
+
+    def accept(self, address, accepted):
+        self.connections.inc(server=self.server,
+                outcome="accepted" if accepted else "rejected")
+
+    def session_start(self, peer):
+        self.sessions.inc(server=self.server)
+
+    def session_end(self):
+        self.sessions.dec(server=self.server)
+
+    def packet(self, direction, code, size, timestamp):
+        if direction == RECEIVED:
+            self.requests.inc(server=self.server,
+                    opcode=_code_name(_request_names, code))
+            self.bytes.inc(size, server=self.server, direction="in")
+        else:
+            self.responses.inc(server=self.server,
+                    code=_code_name(_response_names, code))
+            self.bytes.inc(size, server=self.server, direction="out")
+
+    def operation(self, name, elapsed, size=0, error=None):
+        self.latency.observe(elapsed, server=self.server, operation=name)
+        if error is not None:
+            self.errors.inc(server=self.server, operation=name)
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.expose().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(registry, port=9137, address="127.0.0.1"):
+    """start_http_server(registry, port=9137, address="127.0.0.1")
+
+    Serves the registry's text exposition at /metrics from a daemon thread.
+    Listens on localhost only unless another address is given. Returns the
+    HTTPServer, whose shutdown() method stops it.
+    """
+
+    httpd = HTTPServer((address, port), _MetricsRequestHandler)
+    httpd.registry = registry
+    t = threading.Thread(target=httpd.serve_forever, daemon=True)
+    t.start()
+    return httpd
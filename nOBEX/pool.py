@@ -0,0 +1,244 @@
+"""
+pool.py - reuse of connected OBEX client sessions
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import contextlib, logging, select, threading, time
+from nOBEX.common import OBEXError
+
+logger = logging.getLogger(__name__)
+
+def _close(client):
+    try:
+        client.disconnect()
+    except (OBEXError, OSError, AttributeError):
+        pass
+    if client.socket is not None:
+        client.socket.close()
+
+def _alive(client):
+    # an idle session has nothing to read, so a readable socket means the
+    # server hung up or sent something out of turn
+    if client.socket is None:
+        return False
+    try:
+        readable, _, _ = select.select([client.socket], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+class SessionPool(object):
+    """SessionPool(idle_timeout=30.0, connect=None)
+
+    Hands out connected clients, reusing sessions instead of connecting
+    and disconnecting for every operation. Sessions are keyed by address,
+    channel and the client class's Target UUID (its target attribute), and
+    each is checked out by one caller at a time. Returned sessions are kept
+    connected for idle_timeout seconds, then disconnected.
+
+    The channel is the port the caller asked for, so a session opened with
+    port None, leaving the client to look up its channel, is reused by
+    callers also passing None.
+
+    A session found dead when it is checked out is replaced by a new
+    connection. connect is called with each new client to connect it,
+    and defaults to calling its connect() method; to pool sessions with
+    local servers, pass a function using nOBEX.transport.connect_local().
+
+    Sessions are handed out in whatever directory the last caller left
+    them, so callers should navigate with absolute paths, such as with
+    Client.chdir("/telecom").
+    """
+
+    def __init__(self, idle_timeout=30.0, connect=None):
+        self.idle_timeout = idle_timeout
+        self.connects = 0
+        self._connect = connect
+        self._idle = {}
+        # pool key of each checked out client, as asked for by its caller
+        self._keys = {}
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._closed = False
+
+    @staticmethod
+    def _key(cls, address, port):
+        return address.upper(), port, getattr(cls, "target", None)
+
+    def _new(self, cls, address, port):
+        client = cls(address, port)
+        if self._connect is not None:
+            self._connect(client)
+        else:
+            client.connect()
+        with self._cond:
+            self.connects += 1
+            self._keys[client] = self._key(cls, address, port)
+        return client
+
+    def _acquire(self, cls, address, port):
+        key = self._key(cls, address, port)
+        stale = []
+        client = None
+        with self._cond:
+            if self._closed:
+                raise ValueError("session pool is closed")
+            idle = self._idle.get(key, [])
+            while idle:
+                c, since = idle.pop()
+                if _alive(c):
+                    client = c
+                    self._keys[client] = key
+                    break
+                stale.append(c)
+        for c in stale:
+            logger.info("dropping dead session to %s", address)
+            _close(c)
+        if client is not None:
+            return client, True
+        return self._new(cls, address, port), False
+
+    def acquire(self, cls, address, port):
+        """acquire(self, cls, address, port)
+
+        Checks out a connected client of the given class, which must be
+        handed back with release() once done.
+        """
+
+        return self._acquire(cls, address, port)[0]
+
+    def release(self, client, discard=False):
+        """release(self, client, discard=False)
+
+        Returns a client to the pool. If discard is true, as it should be
+        when the session may be out of step with the server, it is
+        disconnected instead.
+        """
+
+        with self._cond:
+            key = self._keys.pop(client, None)
+            if key is None:
+                key = self._key(type(client), client.address, client.port)
+            if not discard and not self._closed:
+                self._idle.setdefault(key, []).append(
+                        (client, time.monotonic()))
+                if self._reaper is None:
+                    self._reaper = threading.Thread(target=self._reap,
+                            daemon=True)
+                    self._reaper.start()
+                self._cond.notify_all()
+                return
+        _close(client)
+
+    @contextlib.contextmanager
+    def session(self, cls, address, port):
+        """session(self, cls, address, port)
+
+        A context manager checking out a client for the duration of a with
+        block. The session goes back to the pool afterwards, unless the
+        block raised anything other than an OBEXError, which leaves the
+        session in step with the server.
+        """
+
+        client = self.acquire(cls, address, port)
+        try:
+            yield client
+        except OBEXError:
+            self.release(client)
+            raise
+        except BaseException:
+            self.release(client, discard=True)
+            raise
+        self.release(client)
+
+    def call(self, cls, address, port, function):
+        """call(self, cls, address, port, function)
+
+        Calls function with a checked out client and returns its result. If
+        a reused session fails with a connection error, function is retried
+        once with a new connection.
+        """
+
+        client, reused = self._acquire(cls, address, port)
+        while True:
+            try:
+                result = function(client)
+            except OBEXError:
+                self.release(client)
+                raise
+            except OSError as e:
+                self.release(client, discard=True)
+                if not reused:
+                    raise
+                logger.info("session to %s failed (%s), reconnecting",
+                        address, e)
+                client, reused = self._new(cls, address, port), False
+                continue
+            except BaseException:
+                self.release(client, discard=True)
+                raise
+            self.release(client)
+            return result
+
+    def _expired(self):
+        now = time.monotonic()
+        expired = []
+        wait = None
+        for idle in self._idle.values():
+            keep = []
+            for client, since in idle:
+                left = since + self.idle_timeout - now
+                if self._closed or left <= 0:
+                    expired.append(client)
+                else:
+                    keep.append((client, since))
+                    wait = left if wait is None else min(wait, left)
+            idle[:] = keep
+        return expired, wait
+
+    def _reap(self):
+        while True:
+            with self._cond:
+                expired, wait = self._expired()
+                if not expired:
+                    if wait is None:
+                        self._reaper = None
+                        return
+                    self._cond.wait(wait)
+                    continue
+            for client in expired:
+                _close(client)
+
+    def close(self):
+        """Disconnects every idle session. Sessions still checked out are
+        disconnected when released."""
+
+        with self._cond:
+            self._closed = True
+            expired, wait = self._expired()
+            self._idle.clear()
+            self._cond.notify_all()
+        for client in expired:
+            _close(client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
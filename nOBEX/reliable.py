@@ -0,0 +1,474 @@
+"""
+reliable.py - OBEX reliable sessions, resuming operations over a new link
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno, hashlib, logging, os, socket, struct, threading, time
+from nOBEX.common import MessageHandler
+from nOBEX import headers
+from nOBEX import requests
+from nOBEX import responses
+
+logger = logging.getLogger(__name__)
+
+# Session-Parameters tags
+DEVICE_ADDRESS = 0x00
+NONCE = 0x01
+SESSION_ID = 0x02
+NEXT_SEQUENCE_NUMBER = 0x03
+TIMEOUT = 0x04
+SESSION_OPCODE = 0x05
+
+# session opcodes
+CREATE_SESSION = 0x00
+CLOSE_SESSION = 0x01
+SUSPEND_SESSION = 0x02
+RESUME_SESSION = 0x03
+SET_TIMEOUT = 0x04
+
+# the Session-Sequence-Number header added to every packet in a session
+OVERHEAD = 2
+
+_LINK_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ENOTCONN,
+        errno.ETIMEDOUT, errno.EHOSTDOWN, errno.EHOSTUNREACH)
+
+_reader = MessageHandler()
+
+def link_lost(e):
+    """Returns True if the exception e means the transport link dropped,
+    as opposed to a local timeout or error."""
+    return isinstance(e, (ConnectionResetError, BrokenPipeError)) or \
+            getattr(e, "errno", None) in _LINK_ERRNOS
+
+def encode_parameters(params):
+    """Encodes a dict of tags to byte strings as Session-Parameters data"""
+    return b"".join(struct.pack(">BB", tag, len(value)) + value
+            for tag, value in sorted(params.items()))
+
+def decode_parameters(data):
+    params = {}
+    i = 0
+    while i + 2 <= len(data):
+        tag, length = struct.unpack(">BB", data[i:i + 2])
+        params[tag] = data[i + 2:i + 2 + length]
+        i += 2 + length
+    return params
+
+def session_id(client_address, client_nonce, server_address, server_nonce):
+    return hashlib.md5(client_address + client_nonce + server_address +
+            server_nonce).digest()
+
+def _local_address(sock):
+    try:
+        name = sock.getsockname()
+    except OSError:
+        return b""
+    if isinstance(name, tuple):
+        name = name[0]
+    if isinstance(name, bytes):
+        return name
+    return str(name).encode("ascii", "replace")
+
+def _fixed_length(code, request_code=None):
+    """Returns the length of the opcode, packet length and any fixed fields
+    of a packet with the given code, which come before the headers. For a
+    response, request_code is the code of the request it answers."""
+    if request_code is None:
+        if code == requests.Connect.code:
+            return 7
+        if code == requests.Set_Path.code:
+            return 5
+        return 3
+    return 7 if request_code == requests.Connect.code else 3
+
+def _add_sequence(packet, offset, seq):
+    length = struct.unpack(">H", packet[1:3])[0] + OVERHEAD
+    return packet[:1] + struct.pack(">H", length) + packet[3:offset] + \
+            struct.pack(">BB", headers.Session_Sequence_Number.code, seq) + \
+            packet[offset:]
+
+def _strip_sequence(packet, offset):
+    """Returns the sequence number of a packet and the packet without it,
+    or None and the packet unchanged if it is not numbered"""
+    if len(packet) < offset + OVERHEAD or \
+            packet[offset:offset + 1] != \
+            struct.pack(">B", headers.Session_Sequence_Number.code):
+        return None, packet
+    seq = struct.unpack(">B", packet[offset + 1:offset + 2])[0]
+    length = struct.unpack(">H", packet[1:3])[0] - OVERHEAD
+    return seq, packet[:1] + struct.pack(">H", length) + packet[3:offset] + \
+            packet[offset + OVERHEAD:]
+
+def _shrink_max_length(packet):
+    # make room for the sequence number header in every packet sent back
+    length = struct.unpack(">H", packet[5:7])[0]
+    return packet[:5] + struct.pack(">H", max(length - OVERHEAD, 255)) + \
+            packet[7:]
+
+def _command_packet(code, params):
+    header = headers.Session_Parameters(encode_parameters(params))
+    return struct.pack(">BH", code, 3 + len(header.data)) + header.data
+
+def _packet_parameters(packet, offset=3):
+    """Returns the Session-Parameters of a session command or response"""
+    i = offset
+    while i + 3 <= len(packet):
+        code = struct.unpack(">B", packet[i:i + 1])[0]
+        kind = code & 0xc0
+        if kind in (0x00, 0x40):
+            length = struct.unpack(">H", packet[i + 1:i + 3])[0]
+            if code == headers.Session_Parameters.code:
+                return decode_parameters(packet[i + 3:i + length])
+            i += max(length, 3)
+        elif kind == 0x80:
+            i += 2
+        else:
+            i += 5
+    return {}
+
+class _SessionSocket(object):
+    """Behaves as the socket of a session, forwarding to the transport
+    socket currently carrying it"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self._timeout = transport.gettimeout()
+        self._buffer = b""
+
+    def recv(self, size, flags=0):
+        if not self._buffer:
+            self._buffer = self._next_packet()
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+    def fileno(self):
+        return self.transport.fileno()
+
+    def gettimeout(self):
+        return self._timeout
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+        self.transport.settimeout(timeout)
+
+    def getsockname(self):
+        return self.transport.getsockname()
+
+    def _use(self, transport):
+        try:
+            self.transport.close()
+        except OSError:
+            pass
+        self.transport = transport
+        transport.settimeout(self._timeout)
+
+class ClientSession(_SessionSocket):
+    """ClientSession(transport, reconnect, timeout=None, attempts=3,
+                     retry_delay=1.0)
+
+    The client end of a reliable session, used by Client in place of its
+    socket once set_reliable() is called. Every request is numbered, and
+    the last one is kept until its response arrives. If the link drops,
+    reconnect() is called for a new connected transport socket, the session
+    is resumed over it, and the unanswered request is sent again, so the
+    operation in progress carries on from where it was interrupted.
+    timeout is the number of seconds the server should keep the session
+    waiting to be resumed, or None for the server's default.
+    """
+
+    def __init__(self, transport, reconnect, timeout=None, attempts=3,
+            retry_delay=1.0):
+        super(ClientSession, self).__init__(transport)
+        self.reconnect = reconnect
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.resumes = 0
+        self.seq = 0
+        self.session_id = None
+        self._pending = None
+        self._request_code = None
+        self._address = _local_address(transport)
+        self._nonce = os.urandom(16)
+
+        params = {SESSION_OPCODE: struct.pack(">B", CREATE_SESSION),
+                DEVICE_ADDRESS: self._address, NONCE: self._nonce}
+        if timeout is not None:
+            params[TIMEOUT] = struct.pack(">I", int(timeout))
+        reply = self._command(params)
+        self.session_id = reply.get(SESSION_ID) or session_id(self._address,
+                self._nonce, reply.get(DEVICE_ADDRESS, b""),
+                reply.get(NONCE, b""))
+        logger.debug("created reliable session %s",
+                self.session_id.hex())
+
+    def _command(self, params):
+        """Sends a session command on the transport and returns the
+        Session-Parameters of the reply"""
+        self.transport.sendall(_command_packet(requests.Session.code, params))
+        code, packet = _reader._read_packet(self.transport)
+        if code != responses.Success.code:
+            raise ConnectionRefusedError("session command refused with "
+                    "response 0x%02X" % code)
+        return _packet_parameters(packet)
+
+    def sendall(self, data):
+        code = struct.unpack(">B", data[:1])[0]
+        if self.session_id is None:
+            return self.transport.sendall(data)
+
+        self._pending = _add_sequence(data, _fixed_length(code), self.seq)
+        self._request_code = code
+        self.seq = (self.seq + 1) & 0xff
+        try:
+            self.transport.sendall(self._pending)
+        except OSError as e:
+            if not link_lost(e):
+                raise
+            self._resume(e)
+
+    def _next_packet(self):
+        while True:
+            try:
+                code, packet = _reader._read_packet(self.transport)
+            except OSError as e:
+                if self.session_id is None or not link_lost(e):
+                    raise
+                self._resume(e)
+                continue
+
+            if self.session_id is None or self._pending is None:
+                return packet
+            seq, packet = _strip_sequence(packet,
+                    _fixed_length(code, self._request_code))
+            self._pending = None
+            if self._request_code == requests.Connect.code:
+                packet = _shrink_max_length(packet)
+            return packet
+
+    def _resume(self, error):
+        pending_seq = (self.seq - 1) & 0xff if self._pending is not None \
+                else self.seq
+        for attempt in range(self.attempts):
+            logger.info("link lost (%s), resuming session", error)
+            if attempt:
+                time.sleep(self.retry_delay)
+            try:
+                self._use(self.reconnect())
+                reply = self._command({
+                    SESSION_OPCODE: struct.pack(">B", RESUME_SESSION),
+                    DEVICE_ADDRESS: self._address, NONCE: self._nonce,
+                    SESSION_ID: self.session_id,
+                    NEXT_SEQUENCE_NUMBER: struct.pack(">B", pending_seq)})
+                if self._pending is not None:
+                    # the server either missed the request or will answer
+                    # it again from its copy of the response
+                    self.transport.sendall(self._pending)
+            except ConnectionRefusedError:
+                raise
+            except OSError as e:
+                if isinstance(e, socket.timeout):
+                    raise
+                error = e
+                continue
+
+            expected = reply.get(NEXT_SEQUENCE_NUMBER)
+            logger.info("resumed session, server expects packet %s",
+                    struct.unpack(">B", expected)[0] if expected else "?")
+            self.resumes += 1
+            return
+
+        raise ConnectionResetError("could not resume session: %s" % error)
+
+    def close_session(self):
+        """Closes the session, after which packets are sent unnumbered and
+        the link is no longer resumed"""
+        if self.session_id is None:
+            return
+        try:
+            self._command({SESSION_OPCODE: struct.pack(">B", CLOSE_SESSION),
+                SESSION_ID: self.session_id})
+        except OSError:
+            pass
+        self.session_id = None
+
+    def close(self):
+        self.transport.close()
+
+class ServerSession(_SessionSocket):
+    """ServerSession(server, transport, params)
+
+    The server end of a reliable session, created by Server when a client
+    asks for one, and used in place of the connection socket. The last
+    response sent is kept, so if the client sends its last request again
+    after resuming, the response is repeated rather than the request being
+    handled twice. When the link drops, the server waits up to its
+    session_timeout for the client to resume the session over a new
+    connection before giving up on it.
+    """
+
+    def __init__(self, server, transport, params):
+        super(ServerSession, self).__init__(transport)
+        self.server = server
+        self.expected = 0
+        self.timeout = server.session_timeout
+        if TIMEOUT in params:
+            self.timeout = min(self.timeout,
+                    struct.unpack(">I", params[TIMEOUT])[0])
+        self._last_response = None
+        self._request_code = None
+        self._attached = threading.Condition()
+        self._released = None
+        self._closed = False
+
+        address = _local_address(transport)
+        nonce = os.urandom(16)
+        self.session_id = session_id(params.get(DEVICE_ADDRESS, b""),
+                params.get(NONCE, b""), address, nonce)
+        self._reply(transport, {DEVICE_ADDRESS: address, NONCE: nonce,
+            SESSION_ID: self.session_id,
+            TIMEOUT: struct.pack(">I", int(self.timeout))})
+
+    @staticmethod
+    def _reply(transport, params, code=responses.Success.code):
+        transport.sendall(_command_packet(code, params))
+
+    def sendall(self, data):
+        code = struct.unpack(">B", data[:1])[0]
+        if self.session_id is None:
+            return self.transport.sendall(data)
+
+        packet = _add_sequence(data, _fixed_length(code, self._request_code),
+                self.expected)
+        self._last_response = packet
+        try:
+            self.transport.sendall(packet)
+        except OSError as e:
+            if not link_lost(e):
+                raise
+            # the client will repeat its request once it resumes, and
+            # get the response kept above
+            self._suspend(e)
+
+    def _next_packet(self):
+        while True:
+            try:
+                code, packet = _reader._read_packet(self.transport)
+            except OSError as e:
+                if self.session_id is None or not link_lost(e):
+                    raise
+                self._suspend(e)
+                continue
+
+            if code == requests.Session.code:
+                self._command(packet)
+                continue
+            if self.session_id is None:
+                return packet
+
+            seq, packet = _strip_sequence(packet, _fixed_length(code))
+            if seq is not None and seq == (self.expected - 1) & 0xff and \
+                    self._last_response is not None:
+                logger.info("repeating the response to packet %i", seq)
+                self.sendall_raw(self._last_response)
+                continue
+            if seq is not None:
+                if seq != self.expected:
+                    logger.warning("expected packet %i, got %i",
+                            self.expected, seq)
+                self.expected = (seq + 1) & 0xff
+            self._request_code = code
+            if code == requests.Connect.code:
+                packet = _shrink_max_length(packet)
+            return packet
+
+    def sendall_raw(self, packet):
+        try:
+            self.transport.sendall(packet)
+        except OSError as e:
+            if not link_lost(e):
+                raise
+            self._suspend(e)
+
+    def _command(self, packet):
+        params = _packet_parameters(packet)
+        opcode = params.get(SESSION_OPCODE, b"\xff")
+        if opcode == struct.pack(">B", CLOSE_SESSION):
+            self._reply(self.transport, {})
+            self.server._forget_session(self)
+            self.session_id = None
+            logger.debug("reliable session closed")
+        else:
+            self._reply(self.transport, {}, responses.Forbidden.code)
+
+    def _suspend(self, error):
+        """Waits for the session to be resumed on a new transport, raising
+        ConnectionResetError if it is not resumed within the timeout"""
+
+        logger.info("link lost (%s), waiting up to %i s for the session to "
+                "be resumed", error, self.timeout)
+        deadline = time.monotonic() + self.timeout
+        old = self.transport
+        listener = self.server._listener
+        with self._attached:
+            while self.transport is old and not self._closed:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                if listener is not None:
+                    # this thread is the one accepting connections
+                    self._attached.release()
+                    try:
+                        self.server._accept_resume(listener, left)
+                    finally:
+                        self._attached.acquire()
+                else:
+                    self._attached.wait(left)
+            resumed = self.transport is not old
+
+        if not resumed:
+            self.close()
+            raise ConnectionResetError("reliable session was not resumed")
+
+    def resume(self, transport, params):
+        """Continues the session on transport, answering the client's
+        resume request. Returns an Event set once the session stops using
+        the transport."""
+
+        with self._attached:
+            self._reply(transport, {SESSION_ID: self.session_id,
+                NEXT_SEQUENCE_NUMBER: struct.pack(">B", self.expected)})
+            if self._released is not None:
+                self._released.set()
+            self._released = threading.Event()
+            self._use(transport)
+            self._attached.notify_all()
+            logger.info("session resumed, expecting packet %i",
+                    self.expected)
+            return self._released
+
+    def close(self):
+        """Ends the session, releasing the transport it was resumed on"""
+        with self._attached:
+            self._closed = True
+            self.server._forget_session(self)
+            if self._released is not None:
+                self._released.set()
+            self._attached.notify_all()
+        self.transport.close()
@@ -0,0 +1,288 @@
+"""
+replay.py - recording raw OBEX sessions and replaying them against servers
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import itertools, os, struct, threading, time
+from nOBEX.responses import ResponseHandler
+from nOBEX import transport
+
+REQUEST = 0
+RESPONSE = 1
+
+# Recording file format: the magic string, followed by one record per packet.
+# Each record is a direction byte (REQUEST or RESPONSE) followed by the raw
+# OBEX packet, whose own length field delimits the record.
+RECORDING_MAGIC = b"nOBEXrec\x01"
+
+class Recording(object):
+    """An ordered list of (direction, packet) tuples from one OBEX session"""
+
+    def __init__(self, packets=()):
+        self.packets = list(packets)
+
+    def add(self, direction, packet):
+        self.packets.append((direction, packet))
+
+    def exchanges(self):
+        """Returns a list of (request, responses) tuples, where responses is
+        the list of response packets that followed the request."""
+        exchanges = []
+        for direction, packet in self.packets:
+            if direction == REQUEST:
+                exchanges.append((packet, []))
+            elif exchanges:
+                exchanges[-1][1].append(packet)
+        return exchanges
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(RECORDING_MAGIC)
+            for direction, packet in self.packets:
+                f.write(struct.pack(">B", direction))
+                f.write(packet)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(RECORDING_MAGIC):
+            raise ValueError("%s is not an OBEX session recording" % path)
+
+        recording = cls()
+        i = len(RECORDING_MAGIC)
+        while i < len(data):
+            if i + 4 > len(data):
+                raise ValueError("truncated recording %s" % path)
+            direction = data[i]
+            length = struct.unpack(">H", data[i+2:i+4])[0]
+            if length < 3 or i + 1 + length > len(data):
+                raise ValueError("corrupt packet in recording %s" % path)
+            recording.add(direction, data[i+1:i+1+length])
+            i += 1 + length
+        return recording
+
+class _PacketSplitter(object):
+    """Reassembles OBEX packets from an arbitrarily chunked byte stream"""
+
+    def __init__(self, recording, direction):
+        self.recording = recording
+        self.direction = direction
+        self.buf = b""
+
+    def feed(self, data):
+        self.buf += data
+        while len(self.buf) >= 3:
+            length = struct.unpack(">H", self.buf[1:3])[0]
+            if length < 3 or len(self.buf) < length:
+                break
+            self.recording.add(self.direction, self.buf[:length])
+            self.buf = self.buf[length:]
+
+class RecordingSocket(object):
+    """Socket wrapper recording every OBEX packet that passes through it.
+
+    incoming is the direction of received packets: REQUEST when wrapping a
+    server connection, RESPONSE when wrapping a client socket.
+    """
+
+    def __init__(self, sock, recording=None, incoming=REQUEST):
+        if recording is None:
+            recording = Recording()
+        self.recording = recording
+        self._sock = sock
+        self._rx = _PacketSplitter(recording, incoming)
+        self._tx = _PacketSplitter(recording, incoming ^ 1)
+
+    def recv(self, bufsize, flags=0):
+        data = self._sock.recv(bufsize, flags)
+        self._rx.feed(data)
+        return data
+
+    def send(self, data, flags=0):
+        sent = self._sock.send(data, flags)
+        self._tx.feed(data[:sent])
+        return sent
+
+    def sendall(self, data, flags=0):
+        self._sock.sendall(data, flags)
+        self._tx.feed(data)
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+class SessionRecorder(object):
+    """Records each server session into its own file in a directory.
+
+    Set an instance as the session_recorder attribute of an
+    nOBEX.server.Server to record everything the server handles.
+    """
+
+    def __init__(self, directory, prefix="session"):
+        self.directory = directory
+        self.prefix = prefix
+        self._counter = itertools.count()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def wrap(self, connection, address=None):
+        return RecordingSocket(connection, Recording(), REQUEST)
+
+    def finish(self, connection):
+        if not connection.recording.packets:
+            return
+        name = "%s-%s-%04i.obexrec" % (self.prefix,
+                time.strftime("%Y%m%dT%H%M%S"), next(self._counter))
+        connection.recording.save(os.path.join(self.directory, name))
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    k = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[k]
+
+class ReplayReport(object):
+    """Aggregated results of a replay run"""
+
+    def __init__(self):
+        self.sessions = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.mismatches = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def merge(self, sessions, requests, sent, received, mismatches, errors,
+            latencies):
+        with self._lock:
+            self.sessions += sessions
+            self.requests += requests
+            self.bytes_sent += sent
+            self.bytes_received += received
+            self.mismatches += mismatches
+            self.errors += errors
+            self.latencies.extend(latencies)
+
+    def summary(self):
+        lat = sorted(self.latencies)
+        elapsed = self.elapsed or 1e-9
+        return {
+            "sessions": self.sessions,
+            "requests": self.requests,
+            "errors": self.errors,
+            "response_mismatches": self.mismatches,
+            "elapsed_s": self.elapsed,
+            "requests_per_s": self.requests / elapsed,
+            "bytes_per_s": (self.bytes_sent + self.bytes_received) / elapsed,
+            "latency_p50_ms": percentile(lat, 50) * 1e3,
+            "latency_p90_ms": percentile(lat, 90) * 1e3,
+            "latency_p99_ms": percentile(lat, 99) * 1e3,
+            "latency_max_ms": (lat[-1] if lat else 0.0) * 1e3
+        }
+
+def _replay_session(sock, exchanges, timeout=None):
+    handler = ResponseHandler()
+    requests = sent = received = mismatches = 0
+    latencies = []
+
+    # requests recorded without a response, such as the body packets of a
+    # Single Response Mode PUT or one cut off by a dropped link, are sent
+    # without waiting for one
+    sock.settimeout(timeout)
+    for request, expected in exchanges:
+        t = time.perf_counter()
+        sock.sendall(request)
+        actual = []
+        for i in range(len(expected)):
+            code, data = handler._read_packet(sock)
+            actual.append(data)
+        if expected:
+            latencies.append(time.perf_counter() - t)
+
+        requests += 1
+        sent += len(request)
+        received += sum(len(a) for a in actual)
+        if actual != expected:
+            mismatches += 1
+
+    return requests, sent, received, mismatches, latencies
+
+def replay(server_factory, recordings, connections=1, repeat=1,
+        timeout=10.0):
+    """replay(server_factory, recordings, connections=1, repeat=1,
+              timeout=10.0)
+
+    Replays the request streams of the given Recording objects against
+    servers over local socket pairs, from the given number of concurrent
+    connections. Connection i replays recordings[i % len(recordings)] repeat
+    times, each time against a fresh server returned by server_factory(),
+    since servers keep per-session state such as the current directory.
+    The servers are all created before timing starts.
+
+    After each request, as many responses are read as were recorded for
+    it. A session whose server sends nothing for timeout seconds while a
+    response is expected is counted as an error.
+
+    Responses that differ from the recorded ones are counted as mismatches.
+    Expect some if the server generates data such as random message handles.
+
+    Returns a ReplayReport.
+    """
+
+    report = ReplayReport()
+    streams = [r.exchanges() for r in recordings]
+
+    def run(exchanges, servers):
+        sessions = requests = sent = received = mismatches = errors = 0
+        latencies = []
+        for server in servers:
+            csock, ssock = transport.socketpair()
+            t = transport.serve_in_thread(server, ssock)
+            try:
+                q, s, r, m, l = _replay_session(csock, exchanges, timeout)
+            except OSError:
+                errors += 1
+            else:
+                sessions += 1
+                requests += q
+                sent += s
+                received += r
+                mismatches += m
+                latencies.extend(l)
+            finally:
+                csock.close()
+                t.join()
+        report.merge(sessions, requests, sent, received, mismatches, errors,
+                latencies)
+
+    threads = [threading.Thread(target=run, args=(streams[i % len(streams)],
+                [server_factory() for j in range(repeat)]))
+            for i in range(connections)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report.elapsed = time.perf_counter() - start
+
+    return report
@@ -91,6 +91,10 @@ class Set_Path(Request):
 
         Request.read_data(self, data)
 
+class Session(Request):
+    code = OBEX_Session = 0x87
+    format = ""
+
 class Abort(Request):
     code = OBEX_Abort = 0xff
     format = ""
@@ -112,6 +116,7 @@ class RequestHandler(MessageHandler):
             Get.code: Get,
             Get_Final.code: Get_Final,
             Set_Path.code: Set_Path,
+            Session.code: Session,
             Abort.code: Abort
     }
 
@@ -21,7 +21,8 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import struct
+import struct, time
+from nOBEX.instrument import RECEIVED
 from nOBEX.common import OBEX_Version, Message, MessageHandler
 
 class Response(Message):
@@ -86,6 +87,9 @@ class ResponseHandler(MessageHandler):
 
     def decode_connection(self, socket):
         code, data = self._read_packet(socket)
+        if self.instrument is not None:
+            self.instrument.packet(RECEIVED, code, len(data),
+                    time.perf_counter())
 
         if code == ConnectSuccess.code:
             message = ConnectSuccess(data)
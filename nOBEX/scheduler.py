@@ -0,0 +1,186 @@
+"""
+scheduler.py - running profile jobs against many devices in parallel
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging, threading, time
+
+logger = logging.getLogger(__name__)
+
+class JobResult(object):
+    """The outcome of one job on one device. elapsed is the duration of the
+    last attempt, and total the time from the first attempt starting to the
+    last one finishing, including any backoff in between."""
+
+    __slots__ = ("device", "job", "attempts", "elapsed", "total", "result",
+            "error", "_first", "_ready")
+
+    def __init__(self, device, job):
+        self.device = device
+        self.job = job
+        self.attempts = 0
+        self.elapsed = 0.0
+        self.total = 0.0
+        self.result = None
+        self.error = None
+        self._first = None
+        self._ready = 0.0
+
+    @property
+    def ok(self):
+        return self.attempts > 0 and self.error is None
+
+    def __repr__(self):
+        return "<JobResult %s %s %s after %i attempts, %.3f s>" % (
+                self.device, self.job, "ok" if self.ok else "failed",
+                self.attempts, self.elapsed)
+
+class Scheduler(object):
+    """Scheduler(max_connections=1, retries=2, backoff=1.0,
+                 backoff_factor=2.0, max_backoff=60.0, retry_on=(Exception,))
+
+    Runs a set of jobs against each of a list of devices, in parallel across
+    devices but with at most max_connections jobs running at once, to limit
+    the number of simultaneous radio connections. Jobs for the same device
+    never overlap, so a device only ever has one OBEX session open.
+
+    A job is a function taking the device address, which typically connects
+    a client, does its work and disconnects. A job raising one of retry_on
+    is retried up to retries more times, after waiting backoff seconds,
+    multiplied by backoff_factor for each further retry up to max_backoff.
+    Other jobs run while one is waiting to be retried.
+
+    Since jobs are plain functions, they can be pointed at local servers
+    with nOBEX.transport.connect_local() instead of real devices.
+    """
+
+    def __init__(self, max_connections=1, retries=2, backoff=1.0,
+            backoff_factor=2.0, max_backoff=60.0, retry_on=(Exception,)):
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_on = retry_on
+
+    def _delay(self, attempts):
+        return min(self.backoff * self.backoff_factor ** (attempts - 1),
+                self.max_backoff)
+
+    def run(self, devices, jobs, on_result=None):
+        """run(self, devices, jobs, on_result=None)
+
+        Runs every job against every device. jobs is a sequence of
+        (name, function) pairs, run for each device in the order given
+        unless a retry intervenes. on_result is called with each JobResult
+        once the job has succeeded or run out of retries, from the thread
+        that ran it.
+
+        Returns the list of JobResults in the order they finished.
+        """
+
+        pending = [JobResult(d, name) for d in devices for name, fn in jobs]
+        functions = dict(jobs)
+        finished = []
+        busy = set()
+        running = [0]
+        cond = threading.Condition()
+
+        def take():
+            with cond:
+                while True:
+                    if not pending and not running[0]:
+                        return None
+                    now = time.monotonic()
+                    wait = None
+                    for i, r in enumerate(pending):
+                        if r.device in busy:
+                            continue
+                        if r._ready <= now:
+                            del pending[i]
+                            busy.add(r.device)
+                            running[0] += 1
+                            return r
+                        if wait is None or r._ready - now < wait:
+                            wait = r._ready - now
+                    cond.wait(wait)
+
+        def worker():
+            while True:
+                r = take()
+                if r is None:
+                    return
+
+                start = time.monotonic()
+                if r._first is None:
+                    r._first = start
+                r.attempts += 1
+                retry = False
+                try:
+                    r.result = functions[r.job](r.device)
+                    r.error = None
+                except self.retry_on as e:
+                    r.error = e
+                    retry = r.attempts <= self.retries
+                except Exception as e:
+                    r.error = e
+                except BaseException as e:
+                    # this worker stops, but the job is still accounted for
+                    # so that the others don't wait for it forever
+                    r.error = e
+                    raise
+                finally:
+                    end = time.monotonic()
+                    r.elapsed = end - start
+                    r.total = end - r._first
+
+                    if retry:
+                        delay = self._delay(r.attempts)
+                        logger.warning("%s %s failed (%s), retrying in %.1f s",
+                                r.device, r.job, r.error, delay)
+                        r._ready = end + delay
+                    else:
+                        logger.info("%s %s %s in %.3f s after %i attempts",
+                                r.device, r.job, "done" if r.ok else "failed",
+                                r.total, r.attempts)
+
+                    with cond:
+                        busy.discard(r.device)
+                        running[0] -= 1
+                        if retry:
+                            pending.append(r)
+                        else:
+                            finished.append(r)
+                        cond.notify_all()
+
+                if not retry and on_result is not None:
+                    try:
+                        on_result(r)
+                    except Exception:
+                        logger.exception("on_result failed for %s %s",
+                                r.device, r.job)
+
+        count = max(1, min(self.max_connections, len(set(devices))))
+        threads = [threading.Thread(target=worker, daemon=True)
+                for i in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return finished
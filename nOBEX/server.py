@@ -21,12 +21,18 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import logging, threading, time
 from nOBEX.common import OBEX_Version
+from nOBEX.instrument import SENT, Tee
+from nOBEX.metrics import ServerMetrics
 from nOBEX import bluez_helper
 from nOBEX import headers
+from nOBEX import reliable
 from nOBEX import requests
 from nOBEX import responses
 
+logger = logging.getLogger(__name__)
+
 class Server(object):
     def __init__(self, address=None):
         if address is None:
@@ -36,6 +42,36 @@ class Server(object):
         self.max_packet_length = 0xffff
         self.obex_version = OBEX_Version()
         self.request_handler = requests.RequestHandler()
+        self.session_recorder = None
+        self.instrument = None
+
+        # whether to let clients use Single Response Mode when they ask
+        self.srm = True
+
+        # reliable sessions by session ID, and how long to wait for one to
+        # be resumed after its link drops
+        self.session_timeout = 30
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._listener = None
+
+    def set_instrument(self, instrument):
+        """Reports sessions, packets and request handling times to the given
+        nOBEX.instrument.Instrument, or stops reporting if it is None."""
+        self.instrument = instrument
+        self.request_handler.instrument = instrument
+
+    def enable_metrics(self, registry, name=None):
+        """Records connections, requests, responses, bytes, handler latency
+        and active sessions into the given nOBEX.metrics.Registry, labelled
+        with name (the class name by default). Any instrument already set
+        keeps receiving its callbacks."""
+        metrics = ServerMetrics(registry, name or type(self).__name__)
+        if self.instrument is None:
+            self.set_instrument(metrics)
+        else:
+            self.set_instrument(Tee(self.instrument, metrics))
+        return metrics
 
     def start_service(self, name, port=None):
         if port is None:
@@ -45,7 +81,7 @@ class Server(object):
         socket.bind((self.address, port))
         socket.listen(1)
 
-        print("Starting server for %s on port %i" % socket.getsockname())
+        logger.info("Starting server for %s on port %i", *socket.getsockname())
         bluez_helper.advertise_service(name, port)
 
         return socket
@@ -54,22 +90,137 @@ class Server(object):
         bluez_helper.stop_advertising(name)
 
     def serve(self, socket):
+        self._listener = socket
         while True:
             connection, address = socket.accept()
-            if not self.accept_connection(*address):
+            accepted = self.accept_connection(*address)
+            if self.instrument is not None:
+                self.instrument.accept(address, accepted)
+            if not accepted:
                 connection.close()
                 continue
 
-            self.connected = True
+            self.serve_connection(connection, address)
+
+    def serve_connection(self, connection, address=None):
+        """Handles requests arriving on an accepted connection until the
+        client disconnects or the connection is closed.
+
+        If a session_recorder is set, the packets exchanged on the connection
+        are recorded to it (see nOBEX.replay).
+        """
+
+        if self.session_recorder is not None:
+            connection = self.session_recorder.wrap(connection, address)
+
+        self.connected = True
+        if self.instrument is not None:
+            self.instrument.session_start(address)
 
+        session = None
+        try:
             while self.connected:
                 try:
-                    request = self.request_handler.decode(connection)
+                    request = self.request_handler.decode(session or connection)
+
+                    if isinstance(request, requests.Session) and \
+                            session is None:
+                        result = self._session_request(connection, request)
+                        if isinstance(result, reliable.ServerSession):
+                            session = result
+                        elif result is not None:
+                            # this connection resumed a session served by
+                            # another thread, which now reads from it
+                            result.wait()
+                            break
+                        continue
+
+                    if self.instrument is None:
+                        self.process_request(session or connection, request)
+                    else:
+                        self._process_instrumented(session or connection,
+                                request)
                 except ConnectionResetError:
-                    print("Connection to %s on port %i reset by peer!" % address)
+                    if address is not None:
+                        logger.info("Connection to %s on port %i reset by peer!",
+                                *address)
+                    else:
+                        logger.info("Connection reset by peer!")
                     self.connected = False
                     break
-                self.process_request(connection, request)
+        finally:
+            if session is not None:
+                session.close()
+            if self.instrument is not None:
+                self.instrument.session_end()
+            if self.session_recorder is not None:
+                self.session_recorder.finish(connection)
+
+    def _process_instrumented(self, connection, request):
+        name = _operation_names.get(type(request), "other")
+        start = time.perf_counter()
+        try:
+            self.process_request(connection, request)
+        except Exception as e:
+            self.instrument.operation(name, time.perf_counter() - start, 0, e)
+            raise
+        self.instrument.operation(name, time.perf_counter() - start)
+
+    def _session_request(self, connection, request, resume_only=False):
+        """Handles a request to create or resume a reliable session arriving
+        on a new connection. Returns the new ServerSession, an Event set
+        once a resumed session is done with the connection, or None if the
+        request was refused."""
+
+        params = {}
+        for header in request.header_data:
+            if isinstance(header, headers.Session_Parameters):
+                params = reliable.decode_parameters(header.decode())
+        opcode = params.get(reliable.SESSION_OPCODE, b"")
+
+        if opcode == bytes([reliable.CREATE_SESSION]) and not resume_only:
+            session = reliable.ServerSession(self, connection, params)
+            with self._sessions_lock:
+                self._sessions[session.session_id] = session
+            logger.info("Created reliable session")
+            return session
+        elif opcode == bytes([reliable.RESUME_SESSION]):
+            with self._sessions_lock:
+                session = self._sessions.get(params.get(reliable.SESSION_ID))
+            if session is not None:
+                return session.resume(connection, params)
+
+        self._reject(connection)
+        return None
+
+    def _forget_session(self, session):
+        with self._sessions_lock:
+            if self._sessions.get(session.session_id) is session:
+                del self._sessions[session.session_id]
+
+    def _accept_resume(self, listener, timeout):
+        """Accepts a connection on listener within timeout seconds, for a
+        client to resume a session on. Other connections are refused."""
+
+        listener.settimeout(timeout)
+        try:
+            connection, address = listener.accept()
+        except OSError:
+            return
+        finally:
+            listener.settimeout(None)
+
+        try:
+            connection.settimeout(timeout)
+            request = self.request_handler.decode(connection)
+            connection.settimeout(None)
+            if isinstance(request, requests.Session) and \
+                    self._session_request(connection, request,
+                        resume_only=True) is not None:
+                return
+        except OSError:
+            pass
+        connection.close()
 
     def _max_length(self):
         if hasattr(self, "remote_info"):
@@ -84,15 +235,45 @@ class Server(object):
             response.add_header(h)
         chunks = response.encode(self._max_length(), True)
         while len(chunks) > 1:
-            socket.sendall(chunks.pop(0))
+            self._send_packet(socket, chunks.pop(0))
             gf_request = self.request_handler.decode(socket)
+            if self._aborted(socket, gf_request):
+                return
             if not isinstance(gf_request, requests.Get_Final):
                 raise IOError("didn't receive get final request for continuation")
-        socket.sendall(chunks.pop(0))
+        self._send_packet(socket, chunks.pop(0))
+
+    def _send_packet(self, socket, data):
+        if self.instrument is not None:
+            self.instrument.packet(SENT, data[0], len(data), time.perf_counter())
+        socket.sendall(data)
 
     def _reject(self, socket):
         self.send_response(socket, responses.Forbidden())
 
+    def _aborted(self, socket, request):
+        """Answers and returns True if request aborts the multi-packet
+        operation in progress, which should then be abandoned."""
+
+        if isinstance(request, requests.Abort):
+            logger.debug("operation aborted by client")
+            self.abort(socket, request)
+            return True
+        return False
+
+    def _single_response(self, request):
+        """Returns True if request asks for Single Response Mode and the
+        server allows it. The operation's first packet is then answered
+        with a Single-Response-Mode header, and no further packets until
+        the final one."""
+
+        if not self.srm:
+            return False
+        for header in request.header_data:
+            if isinstance(header, headers.Single_Response_Mode):
+                return header.decode() == headers.SRM_ENABLE
+        return False
+
     def accept_connection(self, address, port):
         return True
 
@@ -103,7 +284,7 @@ class Server(object):
         more request types.
         """
 
-        #print(request)
+        logger.debug("%r", request)
         if isinstance(request, requests.Connect):
             self.connect(connection, request)
         elif isinstance(request, requests.Disconnect):
@@ -114,6 +295,8 @@ class Server(object):
             self.put(connection, request)
         elif isinstance(request, requests.Set_Path):
             self.set_path(connection, request)
+        elif isinstance(request, requests.Abort):
+            self.abort(connection, request)
         else:
             self._reject(connection)
 
@@ -143,3 +326,17 @@ class Server(object):
 
     def set_path(self, socket, request):
         self._reject(socket)
+
+    def abort(self, socket, request):
+        self.send_response(socket, responses.Success())
+
+_operation_names = {
+    requests.Connect: "connect",
+    requests.Disconnect: "disconnect",
+    requests.Get: "get",
+    requests.Get_Final: "get",
+    requests.Put: "put",
+    requests.Put_Final: "put",
+    requests.Set_Path: "setpath",
+    requests.Abort: "abort"
+}
@@ -0,0 +1,99 @@
+"""
+sizing.py - choosing OBEX packet sizes from measured throughput
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# packet lengths tried, from the smallest worth using up to the OBEX maximum
+SIZES = (512, 1024, 2048, 4096, 8192, 16384, 32768, 65535)
+
+class PacketSizer(object):
+    """PacketSizer(goodput=None, probe_interval=8, smoothing=0.3)
+
+    Chooses packet lengths for one direction of transfers with a device,
+    from the goodput (body bytes per second, including the round trip)
+    measured for each length. Lengths are picked from SIZES, capped at the
+    negotiated maximum, starting with the largest. Whenever the length with
+    the best smoothed goodput has a neighbour in SIZES not yet measured,
+    that is tried next, so the search climbs towards the best length. Once
+    both neighbours are measured, one of them is tried again every
+    probe_interval packets, so a better length is found if conditions
+    change.
+
+    goodput is a dict of packet lengths to bytes per second, such as one
+    saved from the goodput attribute of an earlier PacketSizer.
+    """
+
+    def __init__(self, goodput=None, probe_interval=8, smoothing=0.3):
+        self.goodput = dict((int(k), v) for k, v in (goodput or {}).items())
+        self.probe_interval = probe_interval
+        self.smoothing = smoothing
+        self._count = 0
+        self._probe_up = False
+
+    @staticmethod
+    def sizes(limit):
+        """Returns the packet lengths that may be used within limit"""
+        sizes = [s for s in SIZES if s < limit]
+        sizes.append(min(limit, SIZES[-1]))
+        return sizes
+
+    def best(self, limit):
+        """Returns the packet length within limit with the best measured
+        goodput, or limit if none has been measured"""
+        sizes = self.sizes(limit)
+        measured = [s for s in sizes if s in self.goodput]
+        if not measured:
+            return sizes[-1]
+        return max(measured, key=lambda s: self.goodput[s])
+
+    def next_size(self, limit):
+        """Returns the packet length to use for the next packet"""
+        sizes = self.sizes(limit)
+        best = self.best(limit)
+        if best not in self.goodput or len(sizes) == 1:
+            return best
+
+        i = sizes.index(best)
+        neighbours = [sizes[j] for j in (i - 1, i + 1) if 0 <= j < len(sizes)]
+        for size in neighbours:
+            if size not in self.goodput:
+                return size
+
+        # try the lengths either side of the best in turn
+        self._count += 1
+        if self._count % self.probe_interval:
+            return best
+        self._probe_up = not self._probe_up
+        return neighbours[-1] if self._probe_up else neighbours[0]
+
+    def record(self, size, nbytes, seconds):
+        """Records that a packet of the given length carried nbytes of body
+        in seconds, from sending the request to receiving the response"""
+        if nbytes <= 0 or seconds <= 0:
+            return
+        rate = nbytes / seconds
+        old = self.goodput.get(size)
+        if old is None:
+            self.goodput[size] = rate
+        else:
+            self.goodput[size] = old + self.smoothing * (rate - old)
+
+    def __repr__(self):
+        return "<PacketSizer %s>" % ", ".join("%i: %.0f B/s" % (s, r)
+                for s, r in sorted(self.goodput.items()))
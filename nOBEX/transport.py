@@ -0,0 +1,254 @@
+"""
+transport.py - in-process transports for running OBEX clients and servers
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random, socket, threading, time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class LocalSocket(socket.socket):
+    """An already connected socket whose connect() does nothing, so that it
+    can be handed to Client.set_socket() in place of a Bluetooth socket."""
+
+    def connect(self, address):
+        pass
+
+def socketpair():
+    """Returns a (client_socket, server_socket) tuple of connected
+    LocalSockets."""
+    a, b = socket.socketpair()
+    return (LocalSocket(a.family, a.type, a.proto, a.detach()),
+            LocalSocket(b.family, b.type, b.proto, b.detach()))
+
+def _serve(server, sock):
+    try:
+        server.serve_connection(sock)
+    finally:
+        sock.close()
+
+def serve_in_thread(server, sock):
+    """Serves a single session on sock in a daemon thread, closing sock when
+    the session ends. Returns the thread."""
+    t = threading.Thread(target=_serve, args=(server, sock), daemon=True)
+    t.start()
+    return t
+
+def connect_local(client, server, pair=socketpair):
+    """connect_local(client, server, pair=socketpair)
+
+    Connects client to a session of server over a new socket pair, serving
+    the session in a background thread. pair is called to create the
+    (client_socket, server_socket) tuple.
+
+    Returns the server thread, which exits once the client disconnects.
+    """
+
+    csock, ssock = pair()
+    t = serve_in_thread(server, ssock)
+    client.set_socket(csock)
+    try:
+        client.connect()
+    except:
+        csock.close()
+        t.join()
+        raise
+    return t
+
+class LinkEmulator(object):
+    """LinkEmulator(bandwidth=250000, latency=0.01, mtu=1013, jitter=0.0,
+                    loss=0.0, stall=0.2, seed=None, drop_after=None,
+                    buffer=16384)
+
+    Creates socket pairs whose traffic is relayed through threads that model
+    a slow radio link such as RFCOMM, so that transfer times over loopback
+    resemble those over Bluetooth.
+
+    Data is split into segments of at most mtu bytes. Each segment occupies
+    the link for len/bandwidth seconds (bandwidth is in bytes per second),
+    and arrives latency seconds after it finished transmitting, plus a
+    uniformly random extra delay of up to jitter seconds. With probability
+    loss a segment is treated as lost and retransmitted, stalling the link
+    for stall seconds. Segments are always delivered in order.
+
+    The link holds about buffer bytes in each direction, including those
+    waiting to go out and those in flight. Once it is full, the sender
+    blocks, as with RFCOMM flow control, so a bulk sender is held to the
+    link's pace rather than queueing its data in memory.
+
+    If drop_after is set, each link is cut once drop_after bytes have been
+    sent over it in either direction, as when a device goes out of range:
+    data still in flight is lost and both ends see the connection close.
+
+    Pass the socketpair method wherever a socket pair factory is accepted,
+    such as the pair argument of connect_local().
+    """
+
+    def __init__(self, bandwidth=250000, latency=0.01, mtu=1013, jitter=0.0,
+            loss=0.0, stall=0.2, seed=None, drop_after=None, buffer=16384):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.mtu = mtu
+        self.jitter = jitter
+        self.loss = loss
+        self.stall = stall
+        self.drop_after = drop_after
+        self.buffer = buffer
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def socketpair(self):
+        """Returns a (client_socket, server_socket) tuple of LocalSockets
+        connected through the emulated link."""
+        client, client_relay = socket.socketpair()
+        server, server_relay = socket.socketpair()
+
+        # keep the kernel from buffering much more than the link would
+        for sock in (client, client_relay, server, server_relay):
+            for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+                sock.setsockopt(socket.SOL_SOCKET, option, self.buffer)
+
+        # close the relay sockets once both directions have shut down
+        remaining = [2]
+        lock = threading.Lock()
+        def done():
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    client_relay.close()
+                    server_relay.close()
+
+        cut = None
+        if self.drop_after is not None:
+            cut = _Cut(self.drop_after, (client_relay, server_relay))
+        for src, dst in ((client_relay, server_relay),
+                (server_relay, client_relay)):
+            _LinkDirection(self, src, dst, done, cut).start()
+        return (LocalSocket(client.family, client.type, client.proto,
+                    client.detach()),
+                LocalSocket(server.family, server.type, server.proto,
+                    server.detach()))
+
+    def _segment_delays(self):
+        with self._random_lock:
+            jitter = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+            lost = self.loss and self._random.random() < self.loss
+        return jitter, lost
+
+class _Cut(object):
+    """Cuts an emulated link once a number of bytes have crossed it"""
+
+    def __init__(self, limit, relays):
+        self.remaining = limit
+        self.relays = relays
+        self.dropped = False
+        self.lock = threading.Lock()
+
+    def take(self, data):
+        """Returns the part of data sent before the link is cut"""
+        with self.lock:
+            if self.dropped:
+                return b""
+            if len(data) < self.remaining:
+                self.remaining -= len(data)
+                return data
+            self.dropped = True
+        for sock in self.relays:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        return b""
+
+class _LinkDirection(object):
+    """Relays one direction of an emulated link"""
+
+    def __init__(self, link, src, dst, done, cut=None):
+        self.link = link
+        self.src = src
+        self.dst = dst
+        self.done = done
+        self.cut = cut
+        self.segments = queue.Queue(max(2, link.buffer // link.mtu))
+        self.stopped = False
+        self.link_free = 0.0
+        self.last_arrival = 0.0
+
+    def start(self):
+        for target in (self._read, self._deliver):
+            threading.Thread(target=target, daemon=True).start()
+
+    def _read(self):
+        link = self.link
+        while True:
+            try:
+                data = self.src.recv(link.mtu)
+            except OSError:
+                data = b""
+            if data and self.cut is not None:
+                data = self.cut.take(data)
+            if not data:
+                self._put((None, None))
+                return
+
+            now = time.perf_counter()
+            jitter, lost = link._segment_delays()
+            start = max(now, self.link_free)
+            if lost:
+                start += link.stall
+            self.link_free = start + len(data) / float(link.bandwidth)
+            arrival = max(self.link_free + link.latency + jitter,
+                    self.last_arrival)
+            self.last_arrival = arrival
+            self._put((arrival, data))
+
+    def _put(self, segment):
+        # blocks while the link is full, unless delivery has stopped
+        while not self.stopped:
+            try:
+                self.segments.put(segment, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _deliver(self):
+        while True:
+            arrival, data = self.segments.get()
+            if data is None:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if self.cut is not None and self.cut.dropped:
+                break
+            try:
+                self.dst.sendall(data)
+            except OSError:
+                break
+
+        self.stopped = True
+
+        # propagate the close to the far end
+        try:
+            self.dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        self.done()
@@ -0,0 +1,323 @@
+"""
+vcard.py - streaming vCard parsing and property filtering for PBAP
+
+Copyright (C) 2017 Sultan Qasim Khan <Sultan.QasimKhan@nccgroup.trust>
+
+This file is part of the nOBEX Python package.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import base64, binascii, collections, re
+
+# PBAP Format application parameter values
+FORMAT_21 = 0
+FORMAT_30 = 1
+
+# PBAP PropertySelector (Filter) bit numbers
+PROPERTY_BITS = {
+    b'VERSION': 0, b'FN': 1, b'N': 2, b'PHOTO': 3, b'BDAY': 4, b'ADR': 5,
+    b'LABEL': 6, b'TEL': 7, b'EMAIL': 8, b'MAILER': 9, b'TZ': 10, b'GEO': 11,
+    b'TITLE': 12, b'ROLE': 13, b'LOGO': 14, b'AGENT': 15, b'ORG': 16,
+    b'NOTE': 17, b'REV': 18, b'SOUND': 19, b'URL': 20, b'UID': 21, b'KEY': 22,
+    b'NICKNAME': 23, b'CATEGORIES': 24, b'PROID': 25, b'CLASS': 26,
+    b'SORT-STRING': 27, b'X-IRMC-CALL-DATETIME': 28, b'X-BT-SPEEDDIALKEY': 29,
+    b'X-BT-UCI': 30, b'X-BT-UID': 31
+}
+
+# bit selecting proprietary (X-) properties not listed above
+PROPRIETARY_BIT = 39
+
+# lines that are always kept, and properties unknown to PBAP, which are only
+# kept when every property is selected; both lie beyond the 64 filter bits
+_STRUCTURAL = 1 << 64
+_UNKNOWN = 1 << 65
+
+# properties PBAP requires whatever the filter says
+MANDATORY = {
+    FORMAT_21: (1 << 0) | (1 << 2) | (1 << 7),
+    FORMAT_30: (1 << 0) | (1 << 1) | (1 << 2) | (1 << 7)
+}
+
+# Each property runs from its name to the end of its last line. Where that is
+# depends on how the value continues onto further lines: folded lines start
+# with whitespace, quoted-printable soft breaks end a line with "=", and
+# vCard 2.1 BASE64 data continues on lines without a colon, up to a blank line.
+_end_folded = re.compile(rb'\n(?![ \t])')
+_end_qp = re.compile(rb'(?<!=)(?<!=\r)\n(?![ \t])')
+_end_base64 = re.compile(rb'\n(?=[^\r\n:]*:)')
+_blank_line = re.compile(rb'\n\r?\n')
+
+def _property_bit(name):
+    bit = PROPERTY_BITS.get(name)
+    if bit is not None:
+        return 1 << bit
+    if name in (b'BEGIN', b'END'):
+        return _STRUCTURAL
+    if name.startswith(b'X-'):
+        return 1 << PROPRIETARY_BIT
+    return _UNKNOWN
+
+def property_spans(card):
+    """property_spans(card)
+
+    Returns a list of (start, end, bit) tuples, one per property of the raw
+    vCard bytes, where card[start:end] is the complete property including
+    its continuation lines and line ending, and bit is its filter bit.
+    """
+
+    spans = []
+    pos = 0
+    length = len(card)
+    while pos < length:
+        colon = card.find(b':', pos)
+        newline = card.find(b'\n', pos)
+        if newline < 0:
+            newline = length
+        if colon < 0 or colon > newline:
+            # not a property line, such as a stray blank line
+            spans.append((pos, newline + 1, _STRUCTURAL))
+            pos = newline + 1
+            continue
+
+        head = card[pos:colon].upper()
+        params = head.split(b';')
+        name = params[0].rsplit(b'.', 1)[-1].strip()
+
+        end = None
+        if b'QUOTED-PRINTABLE' in head:
+            pattern = _end_qp
+        elif b'BASE64' in head or b'ENCODING=B' in head:
+            pattern = _end_base64
+            # usually the data runs up to a blank line, found much faster
+            # with find() than by the regex checking every line
+            blank = _blank_line.search(card, colon)
+            if blank and card.find(b':', colon + 1, blank.start()) < 0:
+                end = blank.end()
+        else:
+            pattern = _end_folded
+        if end is None:
+            m = pattern.search(card, colon)
+            end = m.end() if m else length
+
+        spans.append((pos, end, _property_bit(name)))
+        pos = end
+    return spans
+
+class VCardIndex(object):
+    """VCardIndex(card)
+
+    A raw vCard with precomputed property offsets, so that it can be
+    filtered repeatedly by slicing rather than reparsing.
+    """
+
+    __slots__ = ("card", "spans", "present")
+
+    def __init__(self, card):
+        self.card = card
+        self.spans = property_spans(card)
+        present = 0
+        for start, end, bit in self.spans:
+            present |= bit
+        self.present = present
+
+    def filter(self, mask, fmt=FORMAT_21):
+        """Returns the vCard with only the properties selected by the PBAP
+        filter mask, plus the mandatory ones. A mask of zero selects every
+        property."""
+        if not mask:
+            return self.card
+        keep = mask | MANDATORY.get(fmt, MANDATORY[FORMAT_21]) | _STRUCTURAL
+        if self.present & ~keep == 0:
+            return self.card
+        card = self.card
+        return b''.join([card[s:e] for s, e, bit in self.spans if bit & keep])
+
+def filter_card(card, mask, fmt=FORMAT_21):
+    """Filters a single raw vCard, see VCardIndex.filter()"""
+    if not mask:
+        return card
+    return VCardIndex(card).filter(mask, fmt)
+
+_card_end = re.compile(rb'\nEND:VCARD[ \t]*\r?\n?', re.I)
+
+def split_stream(chunks):
+    """split_stream(chunks)
+
+    Splits a stream of concatenated vCards arriving as an iterable of byte
+    chunks, yielding the raw bytes of each vCard as soon as it is complete.
+    Only the vCard currently being received is held in memory.
+    """
+
+    buf = b''
+    scanned = 0
+    for chunk in chunks:
+        buf += chunk
+        pos = 0
+        # resume a little before the previous end, in case END:VCARD was split
+        for m in _card_end.finditer(buf, max(scanned - 16, 0)):
+            # wait for the line ending, so it stays with its vCard
+            if m.end() == len(buf) and not buf.endswith(b'\n'):
+                break
+            yield buf[pos:m.end()]
+            pos = m.end()
+        buf = buf[pos:]
+        scanned = len(buf)
+    if buf:
+        yield buf
+
+def filter_stream(chunks, mask, fmt=FORMAT_21):
+    """filter_stream(chunks, mask, fmt=FORMAT_21)
+
+    Filters a stream of concatenated vCards arriving as an iterable of byte
+    chunks, yielding the filtered bytes one vCard at a time. Only the vCard
+    currently being received is held in memory.
+    """
+
+    for card in split_stream(chunks):
+        yield filter_card(card, mask, fmt)
+
+# A decoded property. name is upper case, params maps upper case parameter
+# names to lists of values (vCard 2.1 bare types such as CELL are TYPE
+# values, and bare encodings such as QUOTED-PRINTABLE are ENCODING values),
+# and value is a str, or bytes for BASE64 data.
+Property = collections.namedtuple("Property", "group name params value")
+
+_unfold_21 = re.compile(rb'\r?\n(?=[ \t])')
+_unfold_30 = re.compile(rb'\r?\n[ \t]')
+_soft_break = re.compile(rb'=\r?\n[ \t]*')
+_line_break = re.compile(rb'\r?\n')
+_whitespace = re.compile(rb'\s+')
+
+# vCard 2.1 encodings, which may be given bare like types
+_bare_encodings = frozenset(("QUOTED-PRINTABLE", "BASE64", "B", "8BIT",
+        "7BIT"))
+
+def _decode_text(value, params):
+    charset = params.get("CHARSET")
+    if charset:
+        try:
+            return value.decode(charset[0], 'replace')
+        except LookupError:
+            pass
+    return value.decode('utf-8', 'replace')
+
+def parse_property(raw, version=b'2.1'):
+    """parse_property(raw, version=b'2.1')
+
+    Decodes the raw bytes of a single property, as delimited by
+    property_spans(), into a Property. Folded lines are unfolded as the
+    given vCard version requires, and quoted-printable and BASE64 values
+    are decoded. Malformed values are kept as they are, since harvested
+    data may be malformed on purpose.
+    """
+
+    head, sep, value = raw.partition(b':')
+    parts = head.strip().split(b';')
+    group, dot, name = parts[0].rpartition(b'.')
+    params = {}
+    for part in parts[1:]:
+        key, eq, values = part.partition(b'=')
+        if eq:
+            key = key.strip().upper().decode('ascii', 'replace')
+            values = [v.strip(b' \t"').decode('utf-8', 'replace')
+                    for v in values.split(b',')]
+        else:
+            values = [key.strip().decode('utf-8', 'replace')]
+            key = "TYPE"
+            if values[0].upper() in _bare_encodings:
+                key = "ENCODING"
+        params.setdefault(key, []).extend(values)
+
+    encoding = [e.upper() for e in params.get("ENCODING", ())]
+    value = value.rstrip(b'\r\n')
+    if "QUOTED-PRINTABLE" in encoding:
+        value = _decode_text(binascii.a2b_qp(_soft_break.sub(b'', value)),
+                params)
+    elif "BASE64" in encoding or "B" in encoding:
+        data = _whitespace.sub(b'', value)
+        try:
+            value = base64.b64decode(data, validate=True)
+        except (binascii.Error, ValueError):
+            value = data
+    else:
+        unfold = _unfold_30 if version.startswith(b'3') else _unfold_21
+        value = _decode_text(_line_break.sub(b'', unfold.sub(b'', value)),
+                params)
+
+    return Property(group.decode('utf-8', 'replace'),
+            name.strip().upper().decode('utf-8', 'replace'), params, value)
+
+class VCard(object):
+    """VCard(raw, properties)
+
+    A parsed vCard: its raw bytes and its properties in order, excluding
+    BEGIN and END.
+    """
+
+    __slots__ = ("raw", "properties")
+
+    def __init__(self, raw, properties):
+        self.raw = raw
+        self.properties = properties
+
+    @property
+    def version(self):
+        return self.get("VERSION", "2.1")
+
+    def get(self, name, default=None):
+        """Returns the value of the first property with the given name"""
+        for prop in self.properties:
+            if prop.name == name:
+                return prop.value
+        return default
+
+    def get_all(self, name):
+        """Returns the values of every property with the given name"""
+        return [prop.value for prop in self.properties if prop.name == name]
+
+    def __iter__(self):
+        return iter(self.properties)
+
+    def __repr__(self):
+        return "<VCard %r>" % (self.get("FN") or self.get("N"),)
+
+def parse_card(card):
+    """parse_card(card)
+
+    Parses the raw bytes of a single vCard 2.1 or 3.0 into a VCard.
+    """
+
+    version = b'2.1'
+    properties = []
+    for start, end, bit in property_spans(card):
+        if bit == _STRUCTURAL:
+            continue
+        prop = parse_property(card[start:end], version)
+        if prop.name == "VERSION":
+            version = prop.value.strip().encode('ascii', 'replace')
+        properties.append(prop)
+    return VCard(card, properties)
+
+def parse_stream(chunks):
+    """parse_stream(chunks)
+
+    Parses a stream of concatenated vCards arriving as an iterable of byte
+    chunks, such as Client.get_chunks() pulling a phone book, yielding a
+    VCard as soon as each is complete. Only the vCard currently being
+    received is held in memory.
+    """
+
+    for card in split_stream(chunks):
+        yield parse_card(card)
@@ -0,0 +1,105 @@
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+import unittest
+from nOBEX import client, headers, requests, responses, server, transport
+
+class PathServer(server.Server):
+    """Accepts every SETPATH, recording each as (to_parent, name)"""
+
+    def __init__(self):
+        super(PathServer, self).__init__()
+        self.setpaths = []
+
+    def set_path(self, socket, request):
+        name = None
+        for header in request.header_data:
+            if isinstance(header, headers.Name):
+                name = header.decode().strip("\x00")
+        to_parent = bool(request.flags & requests.Set_Path.NavigateToParent)
+        self.setpaths.append((to_parent, name))
+        self.send_response(socket, responses.Success())
+
+class BigServer(server.Server):
+    """Serves a large object for any GET, recording aborted transfers"""
+
+    def __init__(self, size):
+        super(BigServer, self).__init__()
+        self.body = b"x" * size
+        self.aborts = 0
+
+    def get(self, socket, request):
+        body = [headers.Body(self.body[i:i+4000])
+                for i in range(0, len(self.body), 4000)]
+        self.send_response(socket, responses.Success(),
+                [headers.Length(len(self.body))] + body)
+
+    def abort(self, socket, request):
+        self.aborts += 1
+        super(BigServer, self).abort(socket, request)
+
+class GetChunksTests(unittest.TestCase):
+    def setUp(self):
+        self.server = BigServer(1000000)
+        self.client = client.Client("local", 1)
+        self.thread = transport.connect_local(self.client, self.server)
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.thread.join()
+
+    def test_close_early_aborts(self):
+        chunks = self.client.get_chunks("big")
+        received = len(next(chunks))
+        chunks.close()
+        self.assertEqual(self.server.aborts, 1)
+        self.assertLess(received, len(self.server.body))
+
+        # the session is still in step with the server
+        hdrs, body = self.client.get("big")
+        self.assertEqual(body, self.server.body)
+
+    def test_complete(self):
+        body = b"".join(self.client.get_chunks("big"))
+        self.assertEqual(body, self.server.body)
+        self.assertEqual(self.server.aborts, 0)
+
+class ChdirTests(unittest.TestCase):
+    def setUp(self):
+        self.server = PathServer()
+        self.client = client.Client("local", 1)
+        self.thread = transport.connect_local(self.client, self.server)
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.thread.join()
+
+    def test_root_reset_from_unknown_cwd(self):
+        self.client.cwd = None
+        self.client.setpath("")
+        self.assertEqual(self.client.cwd, ())
+
+    def test_absolute_chdir_from_unknown_cwd(self):
+        self.client.cwd = None
+        self.client.chdir("/telecom/pb")
+        self.assertEqual(self.client.cwd, ("telecom", "pb"))
+        self.assertEqual(self.server.setpaths,
+                [(False, ""), (False, "telecom"), (False, "pb")])
+
+    def test_shared_client_from_unknown_cwd(self):
+        self.client.cwd = None
+        shared = client.SharedClient(self.client)
+        shared.chdir("/telecom")
+        cwd = shared.submit(lambda c: c.cwd).result(5)
+        shared.close(disconnect=False)
+        self.assertEqual(cwd, ("telecom",))
+
+if __name__ == "__main__":
+    unittest.main()
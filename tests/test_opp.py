@@ -0,0 +1,75 @@
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+import os, shutil, sys, tempfile, unittest
+from nOBEX import transport
+
+# the OPP client and server are examples, outside the package
+_examples = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+        "examples")
+if _examples not in sys.path:
+    sys.path.insert(0, _examples)
+
+from clients.opp import OPPClient
+from servers.opp import OPPServer
+
+class PushManyTests(unittest.TestCase):
+    def setUp(self):
+        self.src = tempfile.mkdtemp(prefix="nobex-test-")
+        self.dest = tempfile.mkdtemp(prefix="nobex-test-")
+        self.client = OPPClient("local", 1)
+        self.thread = transport.connect_local(self.client,
+                OPPServer(self.dest))
+
+    def tearDown(self):
+        self.thread.join(5)
+        shutil.rmtree(self.src)
+        shutil.rmtree(self.dest)
+
+    def make(self, name, size):
+        path = os.path.join(self.src, name)
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        return path
+
+    def saved(self, path):
+        with open(os.path.join(self.dest, os.path.basename(path)), "rb") as f:
+            return f.read()
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_push_many(self):
+        paths = [self.make("f%i" % i, 50000 * i + 1) for i in range(4)]
+        report = self.client.push_many(paths)
+        self.client.disconnect()
+        self.assertEqual([r.ok for r in report.results], [True] * 4)
+        for path in paths:
+            self.assertEqual(self.saved(path), self.read(path))
+
+    def test_missing_file_mid_batch(self):
+        a = self.make("a", 70000)
+        b = self.make("b", 30000)
+        missing = os.path.join(self.src, "missing")
+        with self.assertRaises(FileNotFoundError):
+            self.client.push_many([a, missing, b])
+
+        # the session is still in step with the server
+        report = self.client.push_many([b])
+        r, = report.results
+        self.assertTrue(r.ok)
+        self.assertGreater(r.seconds, 0)
+        self.client.disconnect()
+        self.assertEqual(self.saved(a), self.read(a))
+        self.assertEqual(self.saved(b), self.read(b))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+import unittest
+from nOBEX import client, server, transport
+from nOBEX.pool import SessionPool
+
+class DiscoveringClient(client.Client):
+    """Looks up its channel when given port None, as the profile clients
+    do with find_service()"""
+
+    def __init__(self, address, port=None):
+        if port is None:
+            port = 9
+        super(DiscoveringClient, self).__init__(address, port)
+
+class SessionPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.threads = []
+        def connect(c):
+            self.threads.append(transport.connect_local(c, server.Server()))
+        self.pool = SessionPool(connect=connect)
+
+    def tearDown(self):
+        self.pool.close()
+        for t in self.threads:
+            t.join()
+
+    def test_reuse(self):
+        for i in range(3):
+            with self.pool.session(DiscoveringClient, "local", 9):
+                pass
+        self.assertEqual(self.pool.connects, 1)
+
+    def test_reuse_discovered_channel(self):
+        for i in range(3):
+            with self.pool.session(DiscoveringClient, "local", None) as c:
+                self.assertEqual(c.port, 9)
+        self.assertEqual(self.pool.connects, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+import os, time, unittest
+from nOBEX import client, headers, reliable, responses, server, transport
+
+# a fast link, so that the tests only wait on the drops
+LINK = {"bandwidth": 10000000, "latency": 0.001}
+
+# bytes crossing the first link before it is cut, all past session setup
+DROP_POINTS = [300, 2500, 20000, 60000, 95000]
+
+class ObjectServer(server.Server):
+    """Serves GETs from, and stores PUTs in, a dict of objects by name"""
+
+    def __init__(self, objects):
+        super(ObjectServer, self).__init__()
+        self.objects = objects
+
+    def get(self, socket, request):
+        name = ""
+        for header in request.header_data:
+            if isinstance(header, headers.Name):
+                name = header.decode().strip("\x00")
+        if name not in self.objects:
+            self.send_response(socket, responses.Not_Found())
+            return
+        body = self.objects[name]
+        chunks = [headers.Body(body[i:i+1000])
+                for i in range(0, len(body), 1000)]
+        self.send_response(socket, responses.Success(),
+                [headers.Length(len(body))] + chunks)
+
+    def put(self, socket, request):
+        name = ""
+        body = b""
+        while True:
+            for header in request.header_data:
+                if isinstance(header, headers.Name):
+                    name = header.decode().strip("\x00")
+                elif isinstance(header, (headers.Body, headers.End_Of_Body)):
+                    body += header.decode()
+            if request.is_final():
+                break
+            self.send_response(socket, responses.Continue())
+            request = self.request_handler.decode(socket)
+            if self._aborted(socket, request):
+                return
+        self.objects[name] = body
+        self.send_response(socket, responses.Success())
+
+class RefusingServer(ObjectServer):
+    """An ObjectServer without reliable session support"""
+
+    def _session_request(self, connection, request, resume_only=False):
+        self._reject(connection)
+        return None
+
+class ReliableTests(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(100000)
+        self.server = ObjectServer({"obj": self.data})
+        self.threads = []
+
+    def tearDown(self):
+        for t in self.threads:
+            t.join(5)
+
+    def reconnect(self):
+        csock, ssock = transport.LinkEmulator(**LINK).socketpair()
+        self.threads.append(transport.serve_in_thread(self.server, ssock))
+        return csock
+
+    def connect(self, drop_after=None, timeout=None, reconnect=None,
+            attempts=3):
+        c = client.Client("local", 1)
+        c.max_packet_length = 2048
+        c.set_reliable(reconnect=reconnect or self.reconnect,
+                timeout=timeout, attempts=attempts)
+        link = transport.LinkEmulator(drop_after=drop_after, **LINK)
+        self.threads.append(transport.connect_local(c, self.server,
+            pair=link.socketpair))
+        return c
+
+    def test_get_resumed(self):
+        for drop_after in DROP_POINTS:
+            c = self.connect(drop_after)
+            hdrs, body = c.get("obj")
+            self.assertEqual(body, self.data, "dropped at %i" % drop_after)
+            self.assertEqual(c.socket.resumes, 1)
+            c.disconnect()
+            c.socket.close()
+
+    def test_put_resumed(self):
+        for drop_after in DROP_POINTS:
+            name = "put%i" % drop_after
+            c = self.connect(drop_after)
+            c.put(name, self.data)
+            self.assertEqual(c.socket.resumes, 1)
+            c.disconnect()
+            c.socket.close()
+            self.assertEqual(self.server.objects[name], self.data,
+                    "dropped at %i" % drop_after)
+
+    def test_repeated_drops(self):
+        def reconnect():
+            link = transport.LinkEmulator(drop_after=30000, **LINK)
+            csock, ssock = link.socketpair()
+            self.threads.append(transport.serve_in_thread(self.server, ssock))
+            return csock
+
+        c = self.connect(30000, reconnect=reconnect)
+        hdrs, body = c.get("obj")
+        self.assertEqual(body, self.data)
+        c.put("again", self.data)
+        self.assertEqual(self.server.objects["again"], self.data)
+        self.assertGreater(c.socket.resumes, 2)
+        c.disconnect()
+        c.socket.close()
+
+    def test_refused_falls_back(self):
+        self.server = RefusingServer({"obj": self.data})
+        c = self.connect()
+        self.assertNotIsInstance(c.socket, reliable.ClientSession)
+        hdrs, body = c.get("obj")
+        self.assertEqual(body, self.data)
+        c.disconnect()
+        c.socket.close()
+
+    def test_session_expires(self):
+        self.server.session_timeout = 0.3
+        def late_reconnect():
+            time.sleep(0.8)
+            return self.reconnect()
+
+        c = self.connect(20000, reconnect=late_reconnect, attempts=1)
+        first = self.threads[0]
+        with self.assertRaises(ConnectionRefusedError):
+            c.get("obj")
+        first.join(5)
+        self.assertFalse(first.is_alive())
+        self.assertEqual(self.server._sessions, {})
+        c.socket.close()
+
+if __name__ == "__main__":
+    unittest.main()
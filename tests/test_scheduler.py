@@ -0,0 +1,149 @@
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+import threading, time, unittest
+from unittest import mock
+from nOBEX import client, server, transport
+from nOBEX.scheduler import Scheduler
+
+DEVICES = ["00:00:00:00:00:0%i" % i for i in range(4)]
+
+class Stop(BaseException):
+    pass
+
+class Sessions(object):
+    """Opens sessions with local servers, recording how many are open at
+    once, in total and per device"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = {}
+        self.max_open = 0
+        self.max_per_device = 0
+
+    def open_session(self, cls, address):
+        c = cls(address, 1)
+        t = transport.connect_local(c, server.Server())
+        with self.lock:
+            self.open[address] = self.open.get(address, 0) + 1
+            self.max_open = max(self.max_open, sum(self.open.values()))
+            self.max_per_device = max(self.max_per_device, self.open[address])
+        return c, t
+
+    def close_session(self, session):
+        c, t = session
+        with self.lock:
+            self.open[c.address] -= 1
+        c.disconnect()
+        t.join()
+
+    def job(self, hold=0.02, fail=0, error=OSError):
+        """Returns a job holding a session for hold seconds, which raises
+        error on its first fail attempts on each device"""
+        attempts = {}
+        def run(address):
+            attempts[address] = attempts.get(address, 0) + 1
+            if attempts[address] <= fail:
+                raise error("attempt %i" % attempts[address])
+            session = self.open_session(client.Client, address)
+            try:
+                time.sleep(hold)
+            finally:
+                self.close_session(session)
+            return address
+        return run
+
+class SchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.sessions = Sessions()
+
+    def run_scheduler(self, scheduler, devices, jobs, on_result=None):
+        # a hung scheduler fails the test instead of the whole run
+        out = []
+        t = threading.Thread(target=lambda: out.append(
+                scheduler.run(devices, jobs, on_result)), daemon=True)
+        t.start()
+        t.join(10)
+        self.assertFalse(t.is_alive(), "scheduler did not finish")
+        return out[0]
+
+    def test_connection_cap(self):
+        jobs = [("a", self.sessions.job(hold=0.05)),
+                ("b", self.sessions.job(hold=0.05))]
+        results = self.run_scheduler(Scheduler(max_connections=2), DEVICES,
+                jobs)
+        self.assertEqual(len(results), len(DEVICES) * 2)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(self.sessions.max_open, 2)
+        self.assertEqual(self.sessions.max_per_device, 1)
+
+    def test_device_jobs_in_order(self):
+        jobs = [(name, self.sessions.job()) for name in "abc"]
+        results = self.run_scheduler(Scheduler(max_connections=3), DEVICES,
+                jobs)
+        for d in DEVICES:
+            self.assertEqual([r.job for r in results if r.device == d],
+                    ["a", "b", "c"])
+        self.assertEqual(self.sessions.max_per_device, 1)
+
+    def test_retry_with_backoff(self):
+        scheduler = Scheduler(retries=2, backoff=0.05, backoff_factor=2.0)
+        results = self.run_scheduler(scheduler, DEVICES[:1],
+                [("a", self.sessions.job(fail=2))])
+        r, = results
+        self.assertTrue(r.ok)
+        self.assertEqual(r.attempts, 3)
+        self.assertEqual(r.result, DEVICES[0])
+        self.assertGreaterEqual(r.total, 0.05 + 0.1)
+
+    def test_retries_exhausted(self):
+        scheduler = Scheduler(retries=1, backoff=0.01)
+        r, = self.run_scheduler(scheduler, DEVICES[:1],
+                [("a", self.sessions.job(fail=5))])
+        self.assertFalse(r.ok)
+        self.assertEqual(r.attempts, 2)
+        self.assertIsInstance(r.error, OSError)
+
+    def test_no_retry_outside_retry_on(self):
+        scheduler = Scheduler(retries=2, backoff=0.01, retry_on=(OSError,))
+        r, = self.run_scheduler(scheduler, DEVICES[:1],
+                [("a", self.sessions.job(fail=1, error=ValueError))])
+        self.assertFalse(r.ok)
+        self.assertEqual(r.attempts, 1)
+
+    def test_on_result_order(self):
+        seen = []
+        jobs = [("a", self.sessions.job(hold=0)),
+                ("b", self.sessions.job(hold=0, fail=1))]
+        results = self.run_scheduler(Scheduler(backoff=0.01), DEVICES[:2],
+                jobs, seen.append)
+        self.assertEqual(seen, results)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_base_exception_releases_device(self):
+        stopped = []
+        def stop(address):
+            if address == DEVICES[0]:
+                raise Stop()
+            stopped.append(address)
+        jobs = [("stop", stop), ("a", self.sessions.job())]
+        with mock.patch.object(threading, "excepthook"):
+            results = self.run_scheduler(Scheduler(max_connections=2),
+                    DEVICES, jobs)
+        failed = [r for r in results if not r.ok]
+        self.assertEqual(len(failed), 1)
+        self.assertIsInstance(failed[0].error, Stop)
+        self.assertEqual(sorted(stopped), DEVICES[1:])
+        self.assertEqual(len([r for r in results if r.job == "a"]),
+                len(DEVICES))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+#
+# Released as open source by NCC Group Plc - http://www.nccgroup.com/
+#
+# Developed by Sultan Qasim Khan, Sultan.QasimKhan@nccgroup.trust
+#
+# http://www.github.com/nccgroup/nOBEX
+#
+# Released under GPLv3, a full copy of which can be found in COPYING.
+#
+
+import unittest
+from nOBEX import vcard
+
+CARD_21 = (b"BEGIN:VCARD\r\n"
+        b"VERSION:2.1\r\n"
+        b"N:Doe;Jane\r\n"
+        b"TEL;CELL:+15551234\r\n"
+        b"NOTE;CHARSET=UTF-8;QUOTED-PRINTABLE:caf=C3=A9 =\r\n"
+        b"line2\r\n"
+        b"PHOTO;JPEG;BASE64:\r\n"
+        b" /9j/4AAQ\r\n"
+        b"\r\n"
+        b"END:VCARD\r\n")
+
+class VCard21Tests(unittest.TestCase):
+    def test_bare_encodings(self):
+        card = vcard.parse_card(CARD_21)
+        self.assertEqual(card.get("NOTE"), "café line2")
+        self.assertEqual(card.get("PHOTO"), b"\xff\xd8\xff\xe0\x00\x10")
+
+    def test_bare_encoding_params(self):
+        prop = vcard.parse_property(b"PHOTO;JPEG;BASE64:/9j/4AAQ\r\n")
+        self.assertEqual(prop.params["ENCODING"], ["BASE64"])
+        self.assertEqual(prop.params["TYPE"], ["JPEG"])
+
+    def test_bare_types(self):
+        card = vcard.parse_card(CARD_21)
+        tel = [p for p in card if p.name == "TEL"][0]
+        self.assertEqual(tel.params, {"TYPE": ["CELL"]})
+        self.assertEqual(tel.value, "+15551234")
+
+if __name__ == "__main__":
+    unittest.main()